@@ -1,41 +1,137 @@
 # =========================
 # IMPORTS Y CONFIGURACIÓN
 # =========================
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail, Message
 from dotenv import load_dotenv
 import os
+import gc
+import math
+import json
+import base64
+import binascii
 import random
 import string
 from models import db, User, Role, CodigosVerificacion
 from flask_bcrypt import Bcrypt
 import datetime
 import joblib
-import numpy as np
 import osmnx as ox
 import networkx as nx
-from models import db, User, Role, CodigosVerificacion, Cotizacion, Pedido, PedidoDetalle
-from ml.ruta_modelo import load_graph_z16, shortest_route_stats, ensure_edge_speeds
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, joinedload
+from models import db, User, Role, CodigosVerificacion, Cotizacion, Pedido, PedidoDetalle, ModeloML
+from ml.ruta_modelo import load_graph_z16, ensure_edge_speeds, FERIA_POINTS, MODEL_PATH
+from ml.forest_compilado import load_compiled, COMPILED_MODEL_PATH
+from ml.snapshot import load_routing_graph, file_checksum, SNAPSHOT_DIR
+from ml.contraccion import load_ch
+from ml.busqueda_dirigida import load_landmarks
+from ml.ferias import load_feria_mask, feria_fingerprint, day_profile, FERIA_PROFILE, THURSDAY
+from ml.perfiles_velocidad import load_speed_profiles, seconds_into_week, FERIA_CONGESTION_BUFFER_M
+from ml.snap import SnapIndex, DEFAULT_MAX_SNAP_M
+from ml.tsp import solve_tsp, SOLVERS, DEFAULT_TIME_BUDGET_MS, HELD_KARP_MAX_STOPS
+from ml.jobs import submit_training_job, read_job
+from ml.pipeline import STAGES as PIPELINE_STAGES, model_artifact_dir
+from ml.log_predicciones import (PredictionLogger, DEFAULT_MAX_ROWS as DEFAULT_LOG_MAX_ROWS,
+                                 DEFAULT_BATCH_SIZE as DEFAULT_LOG_BATCH_SIZE,
+                                 DEFAULT_FLUSH_SECONDS as DEFAULT_LOG_FLUSH_SECONDS)
+from ml.registro import LoadedModel, ModelWatcher, register_model, activate_version, POLL_SECONDS
+from ml.inferencia import MicroBatcher, rows_to_matrix, DEFAULT_WINDOW_MS, DEFAULT_MAX_BATCH_ROWS
+from ml.cache_rutas import RouteCache, route_cache_key, DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS
+from ml.cache_pares import PairDistanceCache, DEFAULT_MAX_PAIRS
+from streaming import stream_query, stream_format, DEFAULT_CHUNK_ROWS
+import carga_masiva
+import pool_db
+import inventario
+from esquema import upgrade_schema
+from pool_db import statement_timeout
 
 # =========================
 # VARIABLES GLOBALES Y ML
 # =========================
 G_CACHED = None
+ROUTER_CACHED = None
+SNAP_CACHED = None
+MAX_SNAP_DISTANCE_M = float(os.getenv('MAX_SNAP_DISTANCE_M', DEFAULT_MAX_SNAP_M))
+FERIA_BUFFER_M = float(os.getenv('FERIA_BUFFER_M', 500))
+ROUTING_CH = os.getenv('ROUTING_CH', 'True') == 'True'
 MODEL_CACHED = None
+MAX_PREDICT_ROWS = int(os.getenv('MAX_PREDICT_ROWS', 5000))
+PEDIDOS_PAGE_SIZE = int(os.getenv('PEDIDOS_PAGE_SIZE', 100))
+PEDIDOS_MAX_PAGE_SIZE = int(os.getenv('PEDIDOS_MAX_PAGE_SIZE', 1000))
+# Filas por bloque al leer de la base en los listados por stream
+STREAM_CHUNK_ROWS = int(os.getenv('STREAM_CHUNK_ROWS', DEFAULT_CHUNK_ROWS))
+# Máximo de ítems por request en /api/pedidos/bulk y /api/cotizaciones/bulk
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 5000))
+# Caché de /api/find-route (ROUTE_CACHE_SQLITE: ruta del nivel compartido entre workers)
+ROUTE_CACHE = RouteCache(
+    max_entries=int(os.getenv('ROUTE_CACHE_SIZE', DEFAULT_MAX_ENTRIES)),
+    ttl_seconds=float(os.getenv('ROUTE_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)),
+    shared_path=os.getenv('ROUTE_CACHE_SQLITE') or None
+)
+# Distancias entre pares de nodos reutilizadas entre matrices de TSP (por worker)
+PAIR_CACHE = PairDistanceCache(max_pairs=int(os.getenv('PAIR_CACHE_MAX_PAIRS', DEFAULT_MAX_PAIRS)))
 
-def load_ml_model():
-    """Carga y cachea el modelo ML."""
+def read_ml_model():
+    """
+    Lee el modelo desde disco (sin registro): el bosque compilado (model_rf.npz) si
+    existe y no es más antiguo que model_rf.pkl; si no, el pickle de sklearn.
+    El hash del archivo sirve de versión, igual en todos los workers.
+    """
+    if os.path.exists(COMPILED_MODEL_PATH) and (
+            not os.path.exists(MODEL_PATH)
+            or os.path.getmtime(COMPILED_MODEL_PATH) >= os.path.getmtime(MODEL_PATH)):
+        return LoadedModel(load_compiled(COMPILED_MODEL_PATH), artifact_hash=file_checksum(COMPILED_MODEL_PATH))
+    return LoadedModel(joblib.load(MODEL_PATH), artifact_hash=file_checksum(MODEL_PATH))
+
+def set_active_model(loaded):
+    """Activa un modelo ya cargado con una sola asignación de referencia."""
     global MODEL_CACHED
+    MODEL_CACHED = loaded
+    print(f"Modelo ML activo: {loaded.info()}")
+
+def load_ml_model():
+    """
+    Carga y cachea el modelo ML: la versión activa del registro (ModeloML) o, si
+    no hay registro, el modelo en disco. Después lo mantiene al día MODEL_WATCHER.
+    """
+    if MODEL_CACHED is None:
+        try:
+            MODEL_WATCHER.check_once()
+        except Exception as e:
+            print(f"Registro de modelos no disponible: {e}")
     if MODEL_CACHED is None:
         try:
-            MODEL_CACHED = joblib.load('ml/model_rf.pkl')
-            print("Modelo ML cargado exitosamente")
+            set_active_model(read_ml_model())
         except Exception as e:
             print(f"Error cargando modelo ML: {e}")
     return MODEL_CACHED
 
+def activate_trained_model(result):
+    """
+    Al terminar un entrenamiento: registra el modelo como nueva versión activa y lo
+    carga en este worker; los demás lo toman en su próximo sondeo del registro.
+    """
+    model_dir = model_artifact_dir(result['fingerprints']['model'])
+    try:
+        with app.app_context():
+            record = register_model(db.session, model_dir)
+            print(f"Modelo registrado como versión {record.version}")
+        MODEL_WATCHER.check_once()
+    except Exception as e:
+        print(f"No se pudo registrar el modelo ({e}); se carga desde disco")
+        set_active_model(read_ml_model())
+
+def preload_ml_model():
+    """Carga el modelo activo antes del fork (gunicorn preload_app)."""
+    load_ml_model()
+    with app.app_context():
+        # Los workers no deben heredar conexiones abiertas por el master
+        db.engine.dispose()
+
 def init_graph():
     """Inicializa y cachea el grafo para reutilizarlo."""
     global G_CACHED
@@ -52,18 +148,110 @@ def init_graph():
             ensure_edge_speeds(G_CACHED, fallback_kph=30.0)
     return G_CACHED
 
+def init_router():
+    """
+    Carga (una sola vez) el grafo de ruteo CSR desde el snapshot binario.
+    El GraphML solo se parsea (init_graph) si hay que reconstruir el snapshot.
+    """
+    global ROUTER_CACHED
+    if ROUTER_CACHED is None:
+        router = load_routing_graph(init_graph)
+        # Cierres de feria (jueves) como máscara sobre los mismos arcos
+        feria_mask = load_feria_mask(router, FERIA_POINTS, FERIA_BUFFER_M, SNAPSHOT_DIR)
+        router.add_closure_profile(FERIA_PROFILE, feria_mask)
+        # Perfiles de velocidad por hora para rutas con hora de salida
+        feria_zone = load_feria_mask(router, FERIA_POINTS, FERIA_CONGESTION_BUFFER_M, SNAPSHOT_DIR)
+        router.speed_profiles = load_speed_profiles(router, feria_zone, SNAPSHOT_DIR)
+        # Jerarquías de contracción construidas offline (python -m ml.contraccion build)
+        if ROUTING_CH:
+            for profile in (None, FERIA_PROFILE):
+                ch = load_ch(router, SNAPSHOT_DIR, 'length', profile)
+                if ch is not None:
+                    router.add_contraction(ch)
+                    print(f"Índice CH cargado para el perfil {profile or 'normal'}: {ch.n_shortcuts} atajos")
+        # Landmarks ALT (python -m ml.busqueda_dirigida build): A* dirigido sin CH
+        landmarks = load_landmarks(router, SNAPSHOT_DIR, 'length')
+        if landmarks is not None:
+            router.add_landmarks(landmarks)
+            print(f"Landmarks ALT cargados: {len(landmarks.landmarks)}")
+        ROUTER_CACHED = router
+        print(f"Grafo de ruteo CSR listo: {ROUTER_CACHED.n_nodes} nodos, {ROUTER_CACHED.n_arcs} arcos")
+    return ROUTER_CACHED
+
+def route_cache_versions(router):
+    """
+    Versión del grafo (snapshot más la huella de las ferias: puntos y buffer de
+    cierre) y del modelo ML con que se calculan las rutas. Solo valores de
+    contenido (hash / versión del registro), iguales en todos los workers, para
+    que el nivel compartido de la caché acierte entre procesos.
+    """
+    model = load_ml_model()
+    model_version = None
+    if model is not None:
+        model_version = model.artifact_hash or model.version
+    graph_version = (router.version, feria_fingerprint(FERIA_POINTS, FERIA_BUFFER_M, router.meta))
+    return graph_version, model_version
+
+def init_snap_index():
+    """Construye (una sola vez) el índice espacial para ajustar waypoints a la red."""
+    global SNAP_CACHED
+    if SNAP_CACHED is None:
+        SNAP_CACHED = SnapIndex(init_router(), max_snap_m=MAX_SNAP_DISTANCE_M)
+    return SNAP_CACHED
+
+def preload_routing():
+    """
+    Carga grafo de ruteo e índice espacial antes del fork (gunicorn preload_app).
+    Los arreglos del snapshot están memory-mapped y el resto queda en páginas
+    copy-on-write; gc.freeze() evita que el GC de los workers las ensucie.
+    """
+    init_snap_index()
+    gc.freeze()
+
+def process_memory_stats():
+    """RSS/PSS y memoria compartida vs privada del proceso actual (Linux, en bytes)."""
+    stats = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    stats[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except OSError:
+        import resource
+        return {'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    return {
+        'rss': stats.get('Rss', 0),
+        'pss': stats.get('Pss', 0),
+        'shared': stats.get('Shared_Clean', 0) + stats.get('Shared_Dirty', 0),
+        'private': stats.get('Private_Clean', 0) + stats.get('Private_Dirty', 0)
+    }
+
+def _predict_with_cached_model(X):
+    """Predicción del lote con el modelo cacheado (se lee en cada lote)."""
+    model = load_ml_model()
+    if model is None:
+        raise RuntimeError('Modelo ML no disponible')
+    y = model.predict(X)
+    if PREDICTION_LOGGER is not None:
+        PREDICTION_LOGGER.log(model.modelo_id, X, y)
+    return y
+
+# Junta predicciones concurrentes del worker en un solo model.predict
+PREDICT_BATCHER = MicroBatcher(
+    _predict_with_cached_model,
+    window_ms=float(os.getenv('ML_BATCH_WINDOW_MS', DEFAULT_WINDOW_MS)),
+    max_batch_rows=int(os.getenv('ML_BATCH_MAX_ROWS', DEFAULT_MAX_BATCH_ROWS))
+)
+
+def predict_route_times(X):
+    """Predice tiempos (segundos) para la matriz X (N, 3) de dist_m, base_time_sec, is_thursday."""
+    return PREDICT_BATCHER.predict(X)
+
 def predict_route_time_ml(data):
     """Predice tiempo de ruta usando modelo pre-entrenado."""
-    model = load_ml_model()
-    if not model:
-        return {'predicted_time_min': data['base_time_sec'] / 60.0}
     try:
-        X = np.array([[
-            data['dist_m'],
-            data['base_time_sec'],
-            data['is_thursday']
-        ]])
-        pred_sec = model.predict(X)[0]
+        pred_sec = predict_route_times(rows_to_matrix([data]))[0]
         return {
             'predicted_time_sec': float(pred_sec),
             'predicted_time_min': round(float(pred_sec) / 60.0, 2)
@@ -82,6 +270,24 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool por worker de gunicorn: con W workers el máximo de conexiones es
+# W x (DB_POOL_SIZE + DB_MAX_OVERFLOW). DB_PGBOUNCER=True deja el pool a PgBouncer.
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'False') == 'True'
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', pool_db.DEFAULT_STATEMENT_TIMEOUT_MS))
+# Listados por stream y cargas en bloque recorren o escriben tablas enteras
+DB_STREAM_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STREAM_STATEMENT_TIMEOUT_MS', 300000))
+DB_BULK_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_BULK_STATEMENT_TIMEOUT_MS', 120000))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_db.engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=int(os.getenv('DB_POOL_SIZE', pool_db.DEFAULT_POOL_SIZE)),
+    max_overflow=int(os.getenv('DB_MAX_OVERFLOW', pool_db.DEFAULT_MAX_OVERFLOW)),
+    pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', pool_db.DEFAULT_POOL_TIMEOUT)),
+    pool_recycle=int(os.getenv('DB_POOL_RECYCLE', pool_db.DEFAULT_POOL_RECYCLE)),
+    pre_ping=os.getenv('DB_POOL_PRE_PING', 'True') == 'True',
+    statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS,
+    pgbouncer=DB_PGBOUNCER
+)
+pool_db.install_statement_timeouts(DB_STATEMENT_TIMEOUT_MS if DB_PGBOUNCER else None)
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
 app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT'))
 app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS') == 'True'
@@ -91,6 +297,22 @@ app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 db.init_app(app)
 mail = Mail(app)
 
+# Sigue la versión activa del modelo en el registro (un hilo por worker)
+MODEL_WATCHER = ModelWatcher(app, set_active_model,
+                             poll_seconds=float(os.getenv('MODEL_POLL_SECONDS', POLL_SECONDS)))
+
+@app.before_request
+def start_model_watcher():
+    MODEL_WATCHER.ensure_started()
+
+# Auditoría de predicciones en predicciones_ml (cola en memoria + inserción en bloque)
+PREDICTION_LOGGER = PredictionLogger(
+    app, db,
+    max_rows=int(os.getenv('PREDICTION_LOG_MAX_ROWS', DEFAULT_LOG_MAX_ROWS)),
+    batch_size=int(os.getenv('PREDICTION_LOG_BATCH', DEFAULT_LOG_BATCH_SIZE)),
+    flush_seconds=float(os.getenv('PREDICTION_LOG_FLUSH_SECONDS', DEFAULT_LOG_FLUSH_SECONDS))
+) if os.getenv('PREDICTION_LOG_ENABLED', 'True') == 'True' else None
+
 # =========================
 # FUNCIONES AUXILIARES
 # =========================
@@ -112,10 +334,13 @@ def generate_username(email):
 
 def create_tables():
     """
-    Crea las tablas y los usuarios/roles iniciales si no existen.
+    Crea las tablas y los usuarios/roles iniciales si no existen, y agrega a
+    las tablas existentes las columnas e índices nuevos (ver esquema.py).
     """
     with app.app_context():
         db.create_all()
+        if upgrade_schema(db.engine):
+            print("Esquema de la base verificado")
         # Crear roles y usuarios iniciales si no existen
         if not Role.query.filter_by(nombre='admin').first():
             admin_role = Role(nombre='admin')
@@ -197,19 +422,25 @@ def change_password():
     db.session.commit()
     return jsonify({'success': True, 'message': 'Usuario y contraseña actualizados'})
 
+def user_to_dict(u):
+    return {
+        'id': u.id,
+        'username': u.nombre,
+        'email': u.email,
+        'role': u.role.nombre,
+        'is_active': u.activo
+    }
+
 @app.route('/api/users', methods=['GET'])
+@statement_timeout(DB_STREAM_STATEMENT_TIMEOUT_MS)
 def get_users():
-    """Endpoint para obtener la lista de usuarios."""
-    users = User.query.all()
-    return jsonify({'success': True, 'users': [
-        {
-            'id': u.id,
-            'username': u.nombre,
-            'email': u.email,
-            'role': u.role.nombre,
-            'is_active': u.activo
-        } for u in users
-    ]})
+    """Endpoint para obtener la lista de usuarios (stream JSON o NDJSON, ver ?format)."""
+    try:
+        fmt = stream_format(request)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    query = User.query.options(joinedload(User.role)).order_by(User.id)
+    return stream_query(query, user_to_dict, 'users', fmt, STREAM_CHUNK_ROWS)
 
 @app.route('/api/users', methods=['POST'])
 def create_user():
@@ -311,48 +542,120 @@ def delete_user(user_id):
 @app.route('/api/predict-route-time', methods=['POST'])
 def predict_route_time():
     """
-    Endpoint que recibe los datos de una ruta y retorna la predicción de tiempo de entrega usando el modelo ML.
+    Endpoint que recibe los datos de una o varias rutas y retorna la predicción de tiempo de entrega usando el modelo ML.
     Espera un JSON con: dist_m, base_time_sec, is_thursday
+    o {"rows": [{dist_m, base_time_sec, is_thursday}, ...]} para varias rutas en un solo predict.
     """
-    data = request.get_json()
-    dist_m = data.get('dist_m')
-    base_time_sec = data.get('base_time_sec')
-    is_thursday = data.get('is_thursday', 0)
+    data = request.get_json() or {}
+    rows = data.get('rows')
+    single = rows is None
+    if single:
+        rows = [data]
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'success': False, 'message': 'rows debe ser una lista no vacía'}), 400
+    if len(rows) > MAX_PREDICT_ROWS:
+        return jsonify({'success': False, 'message': f'Máximo {MAX_PREDICT_ROWS} filas por solicitud'}), 400
 
     # Validar datos de entrada
-    if dist_m is None or base_time_sec is None:
-        return jsonify({'success': False, 'message': 'Se requieren dist_m y base_time_sec'}), 400
-
-    # Cargar el modelo entrenado
     try:
-        model = joblib.load(MODEL_PATH)
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Error cargando el modelo: {str(e)}'}), 500
+        X = rows_to_matrix(rows)
+    except (ValueError, TypeError, AttributeError) as e:
+        message = 'Se requieren dist_m y base_time_sec' if single else str(e)
+        return jsonify({'success': False, 'message': message}), 400
+
+    if load_ml_model() is None:
+        return jsonify({'success': False, 'message': 'Modelo ML no disponible'}), 503
 
-    # Preparar datos para predicción
-    X = np.array([[dist_m, base_time_sec, is_thursday]])
     try:
-        pred = model.predict(X)[0]
-        return jsonify({
-            'success': True, 
-            'predicted_time_sec': float(pred),
-            'predicted_time_min': round(float(pred) / 60.0, 2)
-        })
+        preds = predict_route_times(X)
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error en la predicción: {str(e)}'}), 500
 
+    predictions = [
+        {'predicted_time_sec': float(p), 'predicted_time_min': round(float(p) / 60.0, 2)}
+        for p in preds
+    ]
+    if single:
+        return jsonify({'success': True, **predictions[0]})
+    return jsonify({'success': True, 'count': len(predictions), 'predictions': predictions})
+
 @app.route('/api/train-route-model', methods=['POST'])
 def train_route_model():
     """
     Endpoint para reentrenar el modelo ML con nuevos datos.
+    Encola el pipeline (ml/pipeline.py) en un proceso aparte y responde al instante
+    con el id del trabajo; el avance se consulta en /api/jobs/<id>.
+    Acepta opcionalmente: n_pairs, seed, workers, from_stage.
     """
+    data = request.get_json(silent=True) or {}
+    params = {}
+    try:
+        for key in ('n_pairs', 'seed', 'workers'):
+            if data.get(key) is not None:
+                params[key] = int(data[key])
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'n_pairs, seed y workers deben ser enteros'}), 400
+    if params.get('n_pairs', 1) < 1:
+        return jsonify({'success': False, 'message': 'n_pairs debe ser al menos 1'}), 400
+    if params.get('workers', 0) < 0:
+        return jsonify({'success': False, 'message': 'workers no puede ser negativo'}), 400
+    if data.get('from_stage') is not None:
+        if data['from_stage'] not in PIPELINE_STAGES:
+            return jsonify({'success': False, 'message': f"from_stage debe ser uno de: {', '.join(PIPELINE_STAGES)}"}), 400
+        params['from_stage'] = data['from_stage']
+
     try:
-        # Ejecuta el pipeline principal de ruta_modelo.py
-        from ml import ruta_modelo
-        ruta_modelo.main()
-        return jsonify({'success': True, 'message': 'Modelo reentrenado y guardado.'})
+        job = submit_training_job(params, on_success=activate_trained_model)
     except Exception as e:
-        return jsonify({'success': False, 'message': f'Error al entrenar el modelo: {str(e)}'}), 500
+        return jsonify({'success': False, 'message': f'Error al encolar el entrenamiento: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'message': 'Entrenamiento encolado',
+        'job_id': job['id'],
+        'status_url': f"/api/jobs/{job['id']}"
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado, etapas y tiempos de un trabajo de entrenamiento."""
+    job = read_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Trabajo no encontrado'}), 404
+    job.pop('traceback', None)
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Versiones registradas del modelo de tiempos de ruta y la que sirve este worker."""
+    rows = ModeloML.query.order_by(ModeloML.nombre, ModeloML.version.desc()).all()
+    served = MODEL_CACHED.info() if MODEL_CACHED is not None else None
+    return jsonify({'success': True, 'served': served, 'models': [{
+        'id': m.id,
+        'nombre': m.nombre,
+        'version': m.version,
+        'tipo': m.tipo,
+        'activo': m.activo,
+        'metricas': m.metricas,
+        'esquema': m.esquema,
+        'hash': m.hash_artefacto,
+        'fecha_entrenamiento': m.fecha_entrenamiento.isoformat() if m.fecha_entrenamiento else None
+    } for m in rows]})
+
+@app.route('/api/models/<int:version>/activate', methods=['POST'])
+def activate_model(version):
+    """
+    Promueve una versión registrada. Este worker la carga de inmediato; los demás
+    en su próximo sondeo del registro (MODEL_POLL_SECONDS).
+    """
+    try:
+        record = activate_version(db.session, version)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    try:
+        MODEL_WATCHER.check_once()
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Versión activada pero no se pudo cargar: {str(e)}'}), 500
+    return jsonify({'success': True, 'version': record.version, 'served': MODEL_CACHED.info()})
 
 # =========================
 # ENDPOINTS DE DASHBOARD Y OTROS
@@ -412,29 +715,70 @@ def health_check():
         'service': 'Metales Galvanizados API'
     })
 
+@app.route('/api/metrics/prediction-log', methods=['GET'])
+def prediction_log_metrics():
+    """Estado de la cola de auditoría de predicciones de este worker."""
+    if PREDICTION_LOGGER is None:
+        return jsonify({'success': True, 'enabled': False})
+    return jsonify({'success': True, 'enabled': True, 'pid': os.getpid(), **PREDICTION_LOGGER.stats()})
+
+@app.route('/api/metrics/route-cache', methods=['GET', 'DELETE'])
+def route_cache_metrics():
+    """Aciertos / fallos de las cachés de rutas y de pares de este worker; DELETE las vacía."""
+    if request.method == 'DELETE':
+        ROUTE_CACHE.clear()
+        PAIR_CACHE.clear()
+    return jsonify({'success': True, 'pid': os.getpid(), **ROUTE_CACHE.stats(), 'pairs': PAIR_CACHE.stats()})
+
+@app.route('/api/metrics/db-pool', methods=['GET'])
+def db_pool_metrics():
+    """Conexiones en uso, overflow y espera de checkout del pool de este worker."""
+    return jsonify({'success': True, 'pid': os.getpid(), 'pgbouncer': DB_PGBOUNCER,
+                    'statement_timeout_ms': DB_STATEMENT_TIMEOUT_MS, **pool_db.pool_stats(db.engine)})
+
+@app.route('/api/metrics/memory', methods=['GET'])
+def memory_metrics():
+    """Endpoint con la huella de memoria del worker y de las estructuras de ruteo."""
+    routing = {'loaded': ROUTER_CACHED is not None}
+    if ROUTER_CACHED is not None:
+        routing['graph'] = ROUTER_CACHED.memory_footprint()
+    if SNAP_CACHED is not None:
+        routing['snap_index_bytes'] = SNAP_CACHED.nbytes
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'process': process_memory_stats(),
+        'routing': routing
+    })
+
 # -------------------------
 # CRUD Cotizaciones
 # -------------------------
+def cotizacion_to_dict(c):
+    return {
+        'id': c.id,
+        'cliente_id': c.cliente_id,
+        'nombre_cliente': c.nombre_cliente,
+        'producto': c.producto,
+        'color': c.color,
+        'fecha_emitida': c.fecha_emitida.isoformat() if c.fecha_emitida else None,
+        'fecha_expiracion': c.fecha_expiracion.isoformat() if c.fecha_expiracion else None,
+        'precio_unitario': float(c.precio_unitario) if c.precio_unitario is not None else None,
+        'cantidad': float(c.cantidad) if c.cantidad is not None else None,
+        'estado': c.estado,
+        'usuario_id': c.usuario_id
+    }
+
 @app.route('/api/cotizaciones', methods=['GET'])
+@statement_timeout(DB_STREAM_STATEMENT_TIMEOUT_MS)
 def list_cotizaciones():
+    """Cotizaciones más recientes primero, escritas por stream (JSON o NDJSON, ver ?format)."""
     try:
-        cotizaciones = Cotizacion.query.order_by(Cotizacion.fecha_emitida.desc()).all()
-        data = [{
-            'id': c.id,
-            'cliente_id': c.cliente_id,
-            'nombre_cliente': c.nombre_cliente,
-            'producto': c.producto,
-            'color': c.color,
-            'fecha_emitida': c.fecha_emitida.isoformat() if c.fecha_emitida else None,
-            'fecha_expiracion': c.fecha_expiracion.isoformat() if c.fecha_expiracion else None,
-            'precio_unitario': float(c.precio_unitario) if c.precio_unitario is not None else None,
-            'cantidad': float(c.cantidad) if c.cantidad is not None else None,
-            'estado': c.estado,
-            'usuario_id': c.usuario_id
-        } for c in cotizaciones]
-        return jsonify({'success': True, 'cotizaciones': data})
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
+        fmt = stream_format(request)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    query = Cotizacion.query.order_by(Cotizacion.fecha_emitida.desc(), Cotizacion.id.desc())
+    return stream_query(query, cotizacion_to_dict, 'cotizaciones', fmt, STREAM_CHUNK_ROWS)
 
 @app.route('/api/cotizaciones/<int:cid>', methods=['GET'])
 def get_cotizacion(cid):
@@ -507,48 +851,149 @@ def delete_cotizacion(cid):
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def bulk_write(operation, ok_status):
+    """
+    Ejecuta una operación de carga_masiva con el cuerpo del request: una lista
+    de ítems u {"items": [...], "atomic": bool}. Un solo commit por lote.
+    Respuesta: ids alineados con los ítems (null si falló) y errores por índice.
+    """
+    payload = request.get_json(silent=True)
+    atomic = False
+    if isinstance(payload, dict):
+        atomic = bool(payload.get('atomic', False))
+        payload = payload.get('items')
+    if not isinstance(payload, list) or not payload:
+        return jsonify({'success': False, 'message': 'Se espera una lista de ítems no vacía'}), 400
+    if len(payload) > BULK_MAX_ITEMS:
+        return jsonify({'success': False, 'message': f'Máximo {BULK_MAX_ITEMS} ítems por request'}), 413
+    try:
+        ids, errors = operation(db.session, payload, atomic)
+        written = sum(pk is not None for pk in ids)
+        if not written:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'No se escribió ningún ítem',
+                            'ids': ids, 'errors': errors}), 422
+        db.session.commit()
+        return jsonify({'success': True, 'written': written, 'ids': ids, 'errors': errors}), ok_status
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e.orig)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/cotizaciones/bulk', methods=['POST'])
+@statement_timeout(DB_BULK_STATEMENT_TIMEOUT_MS)
+def bulk_create_cotizaciones():
+    return bulk_write(carga_masiva.create_cotizaciones, 201)
+
+@app.route('/api/cotizaciones/bulk', methods=['PUT'])
+@statement_timeout(DB_BULK_STATEMENT_TIMEOUT_MS)
+def bulk_update_cotizaciones():
+    return bulk_write(carga_masiva.update_cotizaciones, 200)
+
 # -------------------------
 # CRUD Pedidos (y detalles)
 # -------------------------
+def pedido_to_dict(p):
+    """Pedido con sus detalles (usa la relación ya cargada si se pidió con selectinload)."""
+    return {
+        'id': p.id,
+        'cliente_id': p.cliente_id,
+        'fecha_pedido': p.fecha_pedido.isoformat() if p.fecha_pedido else None,
+        'estado': p.estado,
+        'prioridad': p.prioridad,
+        'total': float(p.total) if p.total is not None else None,
+        'detalles': [{
+            'id': d.id, 'producto_id': d.producto_id, 'cantidad': int(d.cantidad), 'subtotal': float(d.subtotal)
+        } for d in p.detalles]
+    }
+
+def encode_cursor(fecha, pid):
+    """Cursor opaco (base64 url-safe) con la clave (fecha_pedido, id) del último pedido."""
+    raw = json.dumps([fecha.isoformat() if fecha else None, pid]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(fecha_pedido, id) del cursor. ValueError si no es válido."""
+    try:
+        fecha, pid = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return (datetime.datetime.fromisoformat(fecha) if fecha else None), int(pid)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError('Cursor inválido') from e
+
+def pedidos_query(args):
+    """
+    Consulta de pedidos ordenada por (fecha_pedido, id) descendente, con los filtros
+    estado / prioridad (repetibles) y cliente_id, y la página siguiente a `cursor`.
+    ValueError si algún parámetro no es válido.
+    """
+    query = Pedido.query
+    estados = args.getlist('estado')
+    if estados:
+        query = query.filter(Pedido.estado.in_(estados))
+    prioridades = args.getlist('prioridad')
+    if prioridades:
+        query = query.filter(Pedido.prioridad.in_(prioridades))
+    if args.get('cliente_id'):
+        try:
+            query = query.filter(Pedido.cliente_id == int(args['cliente_id']))
+        except ValueError:
+            raise ValueError('cliente_id debe ser entero')
+    if args.get('cursor'):
+        fecha, pid = decode_cursor(args['cursor'])
+        if fecha is None:
+            # Los pedidos sin fecha van al final
+            query = query.filter(Pedido.fecha_pedido.is_(None), Pedido.id < pid)
+        else:
+            # Comparación expandida en vez de (fecha, id) < (f, pid): SQLite compara
+            # la tupla como texto y no siempre coincide con el orden de las fechas
+            query = query.filter(or_(Pedido.fecha_pedido < fecha,
+                                     and_(Pedido.fecha_pedido == fecha, Pedido.id < pid),
+                                     Pedido.fecha_pedido.is_(None)))
+    return query.order_by(Pedido.fecha_pedido.desc().nullslast(), Pedido.id.desc())
+
 @app.route('/api/pedidos', methods=['GET'])
 def list_pedidos():
+    """
+    Pedidos paginados por cursor (más recientes primero). Parámetros: limit,
+    cursor (next_cursor de la página anterior), estado, prioridad y cliente_id.
+    Con ?format=json|ndjson (o Accept: application/x-ndjson) se escriben por
+    stream todos los pedidos que cumplen los filtros, sin límite de página.
+    """
+    try:
+        fmt = stream_format(request, default=None)
+        limit = min(int(request.args.get('limit', PEDIDOS_PAGE_SIZE)), PEDIDOS_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('limit debe ser positivo')
+        query = pedidos_query(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if fmt:
+        g.statement_timeout_ms = DB_STREAM_STATEMENT_TIMEOUT_MS
+        query = query.options(selectinload(Pedido.detalles))
+        return stream_query(query, pedido_to_dict, 'pedidos', fmt, STREAM_CHUNK_ROWS)
     try:
-        pedidos = Pedido.query.order_by(Pedido.fecha_pedido.desc()).all()
-        data = []
-        for p in pedidos:
-            detalles = PedidoDetalle.query.filter_by(pedido_id=p.id).all()
-            detalles_list = [{
-                'id': d.id, 'producto_id': d.producto_id, 'cantidad': int(d.cantidad), 'subtotal': float(d.subtotal)
-            } for d in detalles]
-            data.append({
-                'id': p.id,
-                'cliente_id': p.cliente_id,
-                'fecha_pedido': p.fecha_pedido.isoformat() if p.fecha_pedido else None,
-                'estado': p.estado,
-                'prioridad': p.prioridad,
-                'total': float(p.total) if p.total is not None else None,
-                'detalles': detalles_list
-            })
-        return jsonify({'success': True, 'pedidos': data})
+        # Una consulta para la página y otra (IN) para todos sus detalles
+        pedidos = query.options(selectinload(Pedido.detalles)).limit(limit + 1).all()
+        has_more = len(pedidos) > limit
+        pedidos = pedidos[:limit]
+        next_cursor = encode_cursor(pedidos[-1].fecha_pedido, pedidos[-1].id) if has_more else None
+        return jsonify({
+            'success': True,
+            'pedidos': [pedido_to_dict(p) for p in pedidos],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/pedidos/<int:pid>', methods=['GET'])
 def get_pedido(pid):
-    p = Pedido.query.get(pid)
+    p = Pedido.query.options(selectinload(Pedido.detalles)).get(pid)
     if not p:
         return jsonify({'success': False, 'message': 'Pedido no encontrado'}), 404
-    detalles = PedidoDetalle.query.filter_by(pedido_id=p.id).all()
-    detalles_list = [{'id': d.id, 'producto_id': d.producto_id, 'cantidad': int(d.cantidad), 'subtotal': float(d.subtotal)} for d in detalles]
-    return jsonify({'success': True, 'pedido': {
-        'id': p.id,
-        'cliente_id': p.cliente_id,
-        'fecha_pedido': p.fecha_pedido.isoformat() if p.fecha_pedido else None,
-        'estado': p.estado,
-        'prioridad': p.prioridad,
-        'total': float(p.total) if p.total is not None else None,
-        'detalles': detalles_list
-    }})
+    return jsonify({'success': True, 'pedido': pedido_to_dict(p)})
 
 @app.route('/api/pedidos', methods=['POST'])
 def create_pedido():
@@ -626,12 +1071,261 @@ def delete_pedido(pid):
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/pedidos/bulk', methods=['POST'])
+@statement_timeout(DB_BULK_STATEMENT_TIMEOUT_MS)
+def bulk_create_pedidos():
+    return bulk_write(carga_masiva.create_pedidos, 201)
+
+@app.route('/api/pedidos/bulk', methods=['PUT'])
+@statement_timeout(DB_BULK_STATEMENT_TIMEOUT_MS)
+def bulk_update_pedidos():
+    return bulk_write(carga_masiva.update_pedidos, 200)
+
+# -------------------------
+# Inventario (libro mayor + saldos por producto / sucursal / estado)
+# -------------------------
+def saldo_to_dict(s):
+    return {
+        'producto_id': s.producto_id,
+        'sucursal_id': s.sucursal_id,
+        'estado': s.estado,
+        'cantidad': float(s.cantidad),
+        'actualizado': s.actualizado.isoformat() if s.actualizado else None,
+        'ultimo_movimiento_id': s.ultimo_movimiento_id
+    }
+
+def int_arg(name):
+    """Parámetro entero opcional del query string. ValueError si no es entero."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} debe ser entero')
+
+@app.route('/api/inventario/saldos', methods=['GET'])
+def list_saldos():
+    """
+    Saldos materializados, filtrables por producto_id, sucursal_id y estado
+    (repetible), con el total por estado de lo devuelto.
+    """
+    try:
+        query = inventario.saldos_query(int_arg('producto_id'), int_arg('sucursal_id'),
+                                        request.args.getlist('estado'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    saldos = db.session.scalars(query).all()
+    totales = {}
+    for s in saldos:
+        totales[s.estado] = totales.get(s.estado, 0) + float(s.cantidad)
+    return jsonify({'success': True, 'saldos': [saldo_to_dict(s) for s in saldos], 'totales': totales})
+
+@app.route('/api/inventario/stock', methods=['GET'])
+def get_stock():
+    """Stock de un producto en una sucursal y estado (por defecto 'disponible'): lectura por clave."""
+    try:
+        producto_id, sucursal_id = int_arg('producto_id'), int_arg('sucursal_id')
+        if producto_id is None or sucursal_id is None:
+            raise ValueError('producto_id y sucursal_id son obligatorios')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    estado = request.args.get('estado', inventario.ESTADO_DEFAULT)
+    cantidad = inventario.stock(db.session, producto_id, sucursal_id, estado)
+    return jsonify({'success': True, 'producto_id': producto_id, 'sucursal_id': sucursal_id,
+                    'estado': estado, 'cantidad': float(cantidad)})
+
+@app.route('/api/inventario/movimientos', methods=['POST'])
+def create_movimientos():
+    """
+    Registra uno o varios movimientos (objeto o lista) y actualiza los saldos en
+    la misma transacción. Todo o nada: 409 si alguna salida deja saldo negativo
+    (salvo 'permitir_negativo' en ?query).
+    """
+    payload = request.get_json(silent=True)
+    items = payload if isinstance(payload, list) else [payload]
+    if not items or len(items) > BULK_MAX_ITEMS:
+        return jsonify({'success': False, 'message': f'Se esperan entre 1 y {BULK_MAX_ITEMS} movimientos'}), 400
+    movimientos = []
+    for i, item in enumerate(items):
+        try:
+            movimientos.append(inventario.parse_movimiento(item))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e), 'index': i}), 400
+    try:
+        ids, saldos = inventario.registrar_movimientos(
+            db.session, movimientos, permitir_negativo=request.args.get('permitir_negativo') == 'true')
+        db.session.commit()
+    except inventario.StockInsuficiente as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'faltantes': e.faltantes}), 409
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e.orig)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+    return jsonify({'success': True, 'ids': ids, 'saldos': [
+        {'producto_id': p, 'sucursal_id': s, 'estado': e, 'cantidad': float(c)}
+        for (p, s, e), c in sorted(saldos.items())
+    ]}), 201
+
+@app.route('/api/inventario/saldos/rebuild', methods=['POST'])
+@statement_timeout(DB_BULK_STATEMENT_TIMEOUT_MS)
+def rebuild_saldos():
+    """Recalcula todos los saldos desde el libro mayor de movimientos."""
+    try:
+        result = inventario.reconstruir_saldos(db.session)
+        db.session.commit()
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 
 # =========================
 # ENDPOINTS DE ML Y RUTAS OPTIMIZADO PARA MÚLTIPLES PUNTOS
 # =========================
 
+WEEKDAYS = {
+    'lunes': 0, 'martes': 1, 'miercoles': 2, 'miércoles': 2, 'jueves': 3,
+    'viernes': 4, 'sabado': 5, 'sábado': 5, 'domingo': 6,
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
+    'friday': 4, 'saturday': 5, 'sunday': 6
+}
+
+def resolve_route_day(data, departure=None):
+    """
+    Día de la ruta a partir del request: 'is_thursday' explícito, o 'day'
+    (0=lunes..6=domingo o nombre del día), o el día de la salida, o el actual.
+    Retorna (weekday, is_thursday); ValueError si 'day' no es válido o si 'day'
+    / 'is_thursday' contradicen el día de la salida (los perfiles de velocidad
+    se evalúan con la hora de salida).
+    """
+    day = data.get('day')
+    if day is None:
+        weekday = (departure or datetime.datetime.now()).weekday()
+    elif isinstance(day, int) and 0 <= day <= 6:
+        weekday = day
+    elif isinstance(day, str) and day.strip().lower() in WEEKDAYS:
+        weekday = WEEKDAYS[day.strip().lower()]
+    else:
+        raise ValueError(f'Día no válido: {day}')
+    if departure is not None and weekday != departure.weekday():
+        raise ValueError(f"'day' ({day}) no coincide con el día de 'departure' ({departure.date()})")
+    if 'is_thursday' in data:
+        is_thursday = bool(data['is_thursday'])
+        if (day is not None or departure is not None) and is_thursday != (weekday == THURSDAY):
+            raise ValueError("'is_thursday' contradice el día de la ruta ('day' o 'departure')")
+        return weekday, is_thursday
+    return weekday, weekday == THURSDAY
+
+def compute_route(router, waypoint_nodes, profile, departure_sec, is_thursday, solver, time_budget_ms):
+    """
+    Calcula la ruta (ida y vuelta para 2 puntos, TSP desde el primero para 3 o más)
+    y su tiempo predicho. Retorna el resultado cacheable o None si no hay ruta.
+    """
+    tsp_result = None
+    # Si solo hay 2 puntos, calcular ruta directa
+    if len(waypoint_nodes) == 2:
+        path, total_distance, total_time = router.shortest_path(
+            waypoint_nodes[0], waypoint_nodes[1], profile=profile, departure=departure_sec
+        )
+        # Para volver al punto inicial en caso de 2 puntos
+        return_departure = departure_sec + total_time if departure_sec is not None and path else None
+        return_path, return_distance, return_time = router.shortest_path(
+            waypoint_nodes[1], waypoint_nodes[0], profile=profile, departure=return_departure
+        )
+        if path is None or return_path is None:
+            return None
+        
+        # Combinar rutas (ida y vuelta)
+        full_path = path + return_path[1:]  # Evitar duplicar el nodo final
+        total_distance += return_distance
+        total_time += return_time
+        
+    else:
+        # Para 3 o más puntos, resolver TSP
+        # Calcular matrices de distancia/tiempo: una búsqueda por origen
+        # (con hora de salida, todas salen a esa hora; sin ella, los pares ya
+        # calculados en otros requests salen de PAIR_CACHE)
+        matrix = router.route_matrix(waypoint_nodes, profile=profile, departure=departure_sec,
+                                     cache=PAIR_CACHE)
+        # Sin hora de salida se minimiza distancia; con hora, tiempo
+        objective = 'time' if departure_sec is not None else 'distance'
+
+        # Resolver TSP: greedy + mejora local (o Held-Karp exacto si son pocas paradas)
+        tsp_result = solve_tsp(
+            matrix.time if objective == 'time' else matrix.dist,
+            depot=0,
+            time_budget_ms=time_budget_ms,
+            solver=solver
+        )
+        optimal_tour = tsp_result['tour']
+
+        # Construir la ruta completa conectando los segmentos
+        full_path = []
+        total_distance = 0
+        total_time = 0
+        if departure_sec is None:
+            # Tramos cuyo par vino de PAIR_CACHE: una sola pasada para todos
+            matrix.prepare_paths(zip(optimal_tour[:-1], optimal_tour[1:]))
+        
+        for i in range(len(optimal_tour) - 1):
+            start_idx = optimal_tour[i]
+            end_idx = optimal_tour[i + 1]
+            
+            if departure_sec is None:
+                # Reutiliza el árbol de predecesores del origen (sin nueva búsqueda)
+                segment_path, segment_dist, segment_time = matrix.path(start_idx, end_idx)
+            else:
+                # Cada tramo sale a la hora real de llegada a la parada anterior
+                segment_path, segment_dist, segment_time = router.shortest_path(
+                    waypoint_nodes[start_idx], waypoint_nodes[end_idx],
+                    profile=profile, departure=departure_sec + total_time
+                )
+            if segment_path is None:
+                return None
+            
+            # Para evitar duplicar nodos, omitir el primero en segmentos subsiguientes
+            if full_path:
+                full_path.extend(segment_path[1:])
+            else:
+                full_path.extend(segment_path)
+            
+            total_distance += segment_dist
+            total_time += segment_time
+
+    # Extraer coordenadas de la ruta completa
+    route_coords = router.coords(full_path)
+
+    # Predecir tiempo total con ML
+    pred_time = predict_route_time_ml({
+        'dist_m': total_distance,
+        'base_time_sec': total_time,
+        'is_thursday': int(is_thursday)
+    })
+
+    result = {
+        'route': {
+            'coordinates': route_coords,
+            'distance_meters': round(total_distance, 2),
+            'base_time_sec': round(total_time, 2),
+            'predicted_time_min': round(pred_time['predicted_time_min'], 2)
+        },
+        'tsp': None
+    }
+    if tsp_result:
+        result['tsp'] = {
+            'solver': tsp_result['solver'],
+            'objective': objective,
+            'greedy_cost': round(tsp_result['greedy_cost'], 2),
+            'improvement_pct': round(tsp_result['improvement_pct'], 2),
+            'timed_out': tsp_result['timed_out'],
+            'solver_time_ms': round(tsp_result['time_ms'], 2)
+        }
+    return result
+
 @app.route('/api/find-route', methods=['POST'])
 def find_route():
     """Endpoint para encontrar la mejor ruta entre múltiples puntos (TSP)."""
@@ -647,118 +1341,80 @@ def find_route():
                 'message': 'Se requieren al menos 2 puntos de ruta'
             }), 400
 
-        # Usar grafo cacheado
-        G = init_graph()
+        solver = data.get('solver', 'auto')
+        if solver != 'auto' and solver not in SOLVERS:
+            return jsonify({
+                'success': False,
+                'message': f'Solver no soportado: {solver}'
+            }), 400
+        if solver == 'held_karp' and len(waypoints) > HELD_KARP_MAX_STOPS:
+            return jsonify({
+                'success': False,
+                'message': f'held_karp admite hasta {HELD_KARP_MAX_STOPS} puntos; use auto o local_search'
+            }), 400
+        time_budget_ms = data.get('time_budget_ms', DEFAULT_TIME_BUDGET_MS)
+        if (isinstance(time_budget_ms, bool) or not isinstance(time_budget_ms, (int, float))
+                or not math.isfinite(time_budget_ms) or time_budget_ms < 0):
+            return jsonify({
+                'success': False,
+                'message': 'time_budget_ms debe ser un número no negativo'
+            }), 400
+        try:
+            # Hora de salida opcional (ISO 8601): activa el ruteo dependiente del tiempo
+            departure = datetime.datetime.fromisoformat(data['departure']) if data.get('departure') else None
+            weekday, is_thursday = resolve_route_day(data, departure)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        departure_sec = seconds_into_week(departure) if departure else None
+        # Los jueves se rutea con los arcos cerrados por ferias
+        profile = day_profile(is_thursday)
 
-        # Encontrar nodos más cercanos para todos los waypoints
-        waypoint_nodes = []
-        for waypoint in waypoints:
-            node = ox.nearest_nodes(G, waypoint[1], waypoint[0])
-            waypoint_nodes.append(node)
+        # Usar grafo de ruteo e índice espacial cacheados
+        router = init_router()
+        snap_index = init_snap_index()
 
-        # El primer punto es el origen/depósito
-        depot_node = waypoint_nodes[0]
-        
-        # Si solo hay 2 puntos, calcular ruta directa
-        if len(waypoint_nodes) == 2:
-            path, total_distance, total_time = shortest_route_stats(G, waypoint_nodes[0], waypoint_nodes[1])
-            # Para volver al punto inicial en caso de 2 puntos
-            return_path, return_distance, return_time = shortest_route_stats(G, waypoint_nodes[1], waypoint_nodes[0])
-            
-            # Combinar rutas (ida y vuelta)
-            full_path = path + return_path[1:]  # Evitar duplicar el nodo final
-            total_distance += return_distance
-            total_time += return_time
-            
-        else:
-            # Para 3 o más puntos, resolver TSP
-            # Calcular matriz de distancias entre todos los puntos
-            distance_matrix = []
-            for i in range(len(waypoint_nodes)):
-                row = []
-                for j in range(len(waypoint_nodes)):
-                    if i == j:
-                        row.append(0)
-                    else:
-                        try:
-                            _, dist, _ = shortest_route_stats(G, waypoint_nodes[i], waypoint_nodes[j])
-                            row.append(dist)
-                        except:
-                            # Si no hay ruta, usar una distancia grande
-                            row.append(float('inf'))
-                distance_matrix.append(row)
-
-            # Resolver TSP (algoritmo simple - nearest neighbor)
-            def solve_tsp_nearest_neighbor(distance_matrix, depot=0):
-                n = len(distance_matrix)
-                unvisited = set(range(n))
-                unvisited.remove(depot)
-                tour = [depot]
-                current = depot
-                total_distance = 0
-
-                while unvisited:
-                    next_node = min(unvisited, key=lambda x: distance_matrix[current][x])
-                    total_distance += distance_matrix[current][next_node]
-                    tour.append(next_node)
-                    unvisited.remove(next_node)
-                    current = next_node
-
-                # Volver al depósito
-                total_distance += distance_matrix[current][depot]
-                tour.append(depot)
-                
-                return tour, total_distance
-
-            # Obtener tour óptimo
-            optimal_tour, total_distance = solve_tsp_nearest_neighbor(distance_matrix)
-
-            # Construir la ruta completa conectando los segmentos
-            full_path = []
-            total_time = 0
-            
-            for i in range(len(optimal_tour) - 1):
-                start_idx = optimal_tour[i]
-                end_idx = optimal_tour[i + 1]
-                
-                segment_path, segment_dist, segment_time = shortest_route_stats(
-                    G, waypoint_nodes[start_idx], waypoint_nodes[end_idx]
-                )
-                
-                # Para evitar duplicar nodos, omitir el primero en segmentos subsiguientes
-                if full_path:
-                    full_path.extend(segment_path[1:])
-                else:
-                    full_path.extend(segment_path)
-                
-                total_time += segment_time
-
-        # Extraer coordenadas de la ruta completa
-        route_coords = []
-        for node in full_path:
-            route_coords.append([float(G.nodes[node]['y']), float(G.nodes[node]['x'])])
-
-        # Predecir tiempo total con ML
-        is_thursday = datetime.datetime.now().weekday() == 3
-        pred_time = predict_route_time_ml({
-            'dist_m': total_distance,
-            'base_time_sec': total_time,
-            'is_thursday': int(is_thursday)
-        })
+        # Ajustar todos los waypoints a la red en una sola consulta
+        node_ids, snap_distances = snap_index.snap([[w[0], w[1]] for w in waypoints])
+        rejected = [i for i, node in enumerate(node_ids) if node == -1]
+        if rejected:
+            return jsonify({
+                'success': False,
+                'message': f'Puntos demasiado lejos de la red vial (>{MAX_SNAP_DISTANCE_M:.0f} m): {rejected}'
+            }), 400
+        waypoint_nodes = [int(node) for node in node_ids]
+
+        cache_key = route_cache_key(waypoint_nodes, profile, departure_sec, solver, time_budget_ms)
+        cache_versions = route_cache_versions(router)
+        result = ROUTE_CACHE.get(cache_key, cache_versions)
+        cache_status = 'hit'
+        if result is None:
+            cache_status = 'miss'
+            result = compute_route(router, waypoint_nodes, profile, departure_sec, is_thursday,
+                                   solver, time_budget_ms)
+            if result is None:
+                return jsonify({
+                    'success': False,
+                    'message': 'No existe ruta entre los puntos con las restricciones del día'
+                }), 422
+            ROUTE_CACHE.put(cache_key, result, cache_versions)
 
         end_time = datetime.datetime.now()
         processing_time = (end_time - start_time).total_seconds() * 1000
 
-        return jsonify({
+        response = {
             'success': True,
-            'route': {
-                'coordinates': route_coords,
-                'distance_meters': round(total_distance, 2),
-                'base_time_sec': round(total_time, 2),
-                'predicted_time_min': round(pred_time['predicted_time_min'], 2)
-            },
-            'processing_time_ms': round(processing_time, 2)
-        })
+            'route': result['route'],
+            'snap_distance_m': [round(float(d), 2) for d in snap_distances],
+            'day': weekday,
+            'is_thursday': is_thursday,
+            'routing_profile': profile or 'normal',
+            'departure': departure.isoformat() if departure else None,
+            'processing_time_ms': round(processing_time, 2),
+            'cache': cache_status
+        }
+        if result.get('tsp'):
+            response['tsp'] = result['tsp']
+        return jsonify(response)
 
     except Exception as e:
         import traceback
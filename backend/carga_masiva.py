@@ -0,0 +1,335 @@
+"""
+carga_masiva.py
+
+- Alta y actualización en bloque de pedidos y cotizaciones (importación diaria
+  de las sucursales) en lugar de un request y un commit por registro.
+- Una sola pasada de validación: tipos y obligatorios en Python, y claves
+  foráneas (clientes, usuarios, productos) y existencia de los registros a
+  actualizar con una consulta IN por tabla. Cada ítem inválido se informa con
+  su índice y no frena al resto (salvo con atomic=True: si hay errores no se
+  escribe nada).
+- Escritura: INSERT ... RETURNING con executemany (los ids vuelven en el orden
+  de entrada), UPDATE por clave primaria en bloque y los detalles de pedido con
+  COPY en PostgreSQL desde COPY_MIN_ROWS filas.
+- Todo corre en la transacción de la sesión: quien llama hace un solo commit o
+  rollback por lote.
+"""
+
+import csv
+import datetime
+import decimal
+import io
+
+from sqlalchemy import delete, insert, select, update
+
+from models import Cliente, Cotizacion, Pedido, PedidoDetalle, Producto, User
+
+COPY_MIN_ROWS = 500
+COTIZACION_DIAS_EXPIRACION = 3
+DETALLE_COLUMNS = ('pedido_id', 'producto_id', 'cantidad', 'subtotal')
+
+
+class ItemError(ValueError):
+    """Ítem del lote que no se puede escribir."""
+
+
+def _int(value, column):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ItemError(f"'{column.name}' debe ser entero")
+    try:
+        return int(value)
+    except ValueError:
+        raise ItemError(f"'{column.name}' debe ser entero")
+
+
+def _decimal(value, column):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ItemError(f"'{column.name}' debe ser numérico")
+    try:
+        number = decimal.Decimal(str(value))
+    except decimal.InvalidOperation:
+        raise ItemError(f"'{column.name}' debe ser numérico")
+    if not number.is_finite():
+        raise ItemError(f"'{column.name}' debe ser numérico")
+    return number
+
+
+def _text(value, column):
+    if not isinstance(value, str):
+        raise ItemError(f"'{column.name}' debe ser texto")
+    if column.type.length and len(value) > column.type.length:
+        raise ItemError(f"'{column.name}' supera {column.type.length} caracteres")
+    return value
+
+
+def _datetime(value, column):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ItemError(f"'{column.name}' debe ser fecha ISO 8601")
+
+
+COTIZACION_FIELDS = {
+    'cliente_id': _int, 'nombre_cliente': _text, 'producto': _text, 'color': _text,
+    'fecha_expiracion': _datetime, 'precio_unitario': _decimal, 'cantidad': _decimal,
+    'estado': _text, 'usuario_id': _int,
+}
+PEDIDO_FIELDS = {'cliente_id': _int, 'estado': _text, 'prioridad': _text, 'total': _decimal}
+DETALLE_FIELDS = {'producto_id': _int, 'cantidad': _int, 'subtotal': _decimal}
+
+
+def _parse(model, fields, item, partial=False):
+    """Fila con los campos de `fields` convertidos; con partial solo los que trae el ítem."""
+    row = {}
+    for name, parse in fields.items():
+        if partial and name not in item:
+            continue
+        value = item.get(name)
+        row[name] = None if value is None else parse(value, model.__table__.c[name])
+    return row
+
+
+def _require(model, row, names=None):
+    """ItemError si falta algún campo obligatorio (por defecto, los NOT NULL presentes)."""
+    columns = model.__table__.c
+    for name in names if names is not None else [n for n in row if not columns[n].nullable]:
+        if row.get(name) is None:
+            raise ItemError(f"'{name}' es obligatorio")
+
+
+def _item_id(item, seen):
+    if 'id' not in item:
+        raise ItemError("'id' es obligatorio")
+    pk = _int(item['id'], Pedido.__table__.c.id)
+    if pk in seen:
+        raise ItemError(f"id {pk} repetido en el lote")
+    seen.add(pk)
+    return pk
+
+
+def _detalles(item):
+    detalles = item.get('detalles') or []
+    if not isinstance(detalles, list):
+        raise ItemError("'detalles' debe ser una lista")
+    rows = []
+    for k, d in enumerate(detalles):
+        try:
+            if not isinstance(d, dict):
+                raise ItemError('debe ser un objeto')
+            row = _parse(PedidoDetalle, DETALLE_FIELDS, d)
+            _require(PedidoDetalle, row, ('cantidad', 'subtotal'))
+        except ItemError as e:
+            raise ItemError(f"detalles[{k}]: {e}")
+        rows.append(row)
+    return rows
+
+
+def _validate(items, build):
+    """{índice: fila} de los ítems válidos y {índice: mensaje} de los que no."""
+    rows, errors = {}, {}
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ItemError('El ítem debe ser un objeto')
+            rows[i] = build(item)
+        except ItemError as e:
+            errors[i] = str(e)
+    return rows, errors
+
+
+def _missing_ids(session, model, values):
+    """Ids de `values` que no están en la tabla de `model` (una consulta)."""
+    values = {v for v in values if v is not None}
+    if not values:
+        return set()
+    return values - set(session.scalars(select(model.id).where(model.id.in_(values))))
+
+
+def _check_refs(session, rows, errors, refs):
+    """Marca con error los ítems cuyas claves foráneas no existen. refs: [(get, modelo, mensaje)]."""
+    for get, model, message in refs:
+        candidates = {i: get(row) for i, row in rows.items() if i not in errors}
+        missing = _missing_ids(session, model, [v for vals in candidates.values() for v in vals])
+        if missing:
+            for i, vals in candidates.items():
+                bad = [v for v in vals if v in missing]
+                if bad:
+                    errors[i] = message.format(bad[0])
+
+
+def _field(name):
+    return lambda row: [row.get(name)]
+
+
+def _detalle_productos(entry):
+    return [d['producto_id'] for d in entry[1] or ()]
+
+
+def _pedido_field(name):
+    return lambda entry: [entry[0].get(name)]
+
+
+def _result(items, rows, errors, ids=None):
+    """ids alineados con los ítems (None si falló) y errores ordenados por índice."""
+    result = [None] * len(items)
+    for i, pk in zip([i for i in rows if i not in errors], ids or []):
+        result[i] = pk
+    return result, [{'index': i, 'message': errors[i]} for i in sorted(errors)]
+
+
+def insert_returning_ids(session, model, rows):
+    """INSERT en bloque (executemany) con los ids en el orden de `rows`."""
+    if not rows:
+        return []
+    # insert() sobre la tabla (no el modelo): el ORM separa las filas por claves con None
+    table = model.__table__
+    stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    return list(session.execute(stmt, rows).scalars())
+
+
+def insert_detalles(session, rows):
+    """
+    Inserta detalles de pedido sin pedir ids de vuelta: COPY ... FROM STDIN en
+    PostgreSQL (psycopg2) desde COPY_MIN_ROWS filas; si no, executemany.
+    """
+    if not rows:
+        return
+    conn = session.connection()
+    if len(rows) >= COPY_MIN_ROWS and conn.dialect.name == 'postgresql':
+        cursor = conn.connection.dbapi_connection.cursor()
+        if hasattr(cursor, 'copy_expert'):
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for row in rows:
+                # En CSV de COPY el campo vacío sin comillas es NULL
+                writer.writerow(['' if row[c] is None else row[c] for c in DETALLE_COLUMNS])
+            buf.seek(0)
+            try:
+                cursor.copy_expert(f"COPY {PedidoDetalle.__tablename__} ({', '.join(DETALLE_COLUMNS)}) "
+                                   "FROM STDIN WITH (FORMAT csv)", buf)
+            finally:
+                cursor.close()
+            return
+        cursor.close()
+    session.execute(insert(PedidoDetalle.__table__), rows)
+
+
+# -------------------------
+# Cotizaciones
+# -------------------------
+def create_cotizaciones(session, items, atomic=False):
+    """Alta en bloque. Devuelve (ids alineados con items, errores)."""
+    now = datetime.datetime.now()
+
+    def build(item):
+        row = _parse(Cotizacion, COTIZACION_FIELDS, item)
+        # Misma regla que el modelo: vence a los 3 días si no se indica
+        if row['fecha_expiracion'] is None:
+            row['fecha_expiracion'] = now + datetime.timedelta(days=COTIZACION_DIAS_EXPIRACION)
+        row['estado'] = row['estado'] or 'emitida'
+        _require(Cotizacion, row, ('producto',))
+        return row
+
+    rows, errors = _validate(items, build)
+    _check_refs(session, rows, errors, [
+        (_field('cliente_id'), Cliente, 'Cliente {} no existe'),
+        (_field('usuario_id'), User, 'Usuario {} no existe'),
+    ])
+    if atomic and errors:
+        return _result(items, rows, errors)
+    ids = insert_returning_ids(session, Cotizacion, [rows[i] for i in rows if i not in errors])
+    return _result(items, rows, errors, ids)
+
+
+def update_cotizaciones(session, items, atomic=False):
+    """Actualización en bloque por id (solo los campos presentes). Devuelve (ids, errores)."""
+    seen = set()
+
+    def build(item):
+        pk = _item_id(item, seen)
+        row = _parse(Cotizacion, COTIZACION_FIELDS, item, partial=True)
+        _require(Cotizacion, row)
+        return dict(row, id=pk)
+
+    rows, errors = _validate(items, build)
+    _check_refs(session, rows, errors, [
+        (_field('id'), Cotizacion, 'Cotización {} no encontrada'),
+        (_field('cliente_id'), Cliente, 'Cliente {} no existe'),
+        (_field('usuario_id'), User, 'Usuario {} no existe'),
+    ])
+    if atomic and errors:
+        return _result(items, rows, errors)
+    valid = [rows[i] for i in rows if i not in errors]
+    changed = [row for row in valid if len(row) > 1]
+    if changed:
+        session.execute(update(Cotizacion), changed)
+    return _result(items, rows, errors, [row['id'] for row in valid])
+
+
+# -------------------------
+# Pedidos (con detalles)
+# -------------------------
+def _detalles_total(detalles):
+    return sum((d['subtotal'] for d in detalles), decimal.Decimal(0))
+
+
+def create_pedidos(session, items, atomic=False):
+    """Alta en bloque de pedidos y sus detalles. Devuelve (ids alineados con items, errores)."""
+    def build(item):
+        row = _parse(Pedido, PEDIDO_FIELDS, item)
+        detalles = _detalles(item)
+        row['estado'] = row['estado'] or 'pendiente'
+        row['prioridad'] = row['prioridad'] or 'normal'
+        # Igual que create_pedido: manda la suma de los subtotales, si no el total recibido
+        row['total'] = _detalles_total(detalles) or row['total'] or 0
+        return row, detalles
+
+    entries, errors = _validate(items, build)
+    _check_refs(session, entries, errors, [
+        (_pedido_field('cliente_id'), Cliente, 'Cliente {} no existe'),
+        (_detalle_productos, Producto, 'Producto {} no existe'),
+    ])
+    if atomic and errors:
+        return _result(items, entries, errors)
+    valid = [entries[i] for i in entries if i not in errors]
+    ids = insert_returning_ids(session, Pedido, [row for row, _ in valid])
+    insert_detalles(session, [dict(d, pedido_id=pk) for pk, (_, detalles) in zip(ids, valid) for d in detalles])
+    return _result(items, entries, errors, ids)
+
+
+def update_pedidos(session, items, atomic=False):
+    """
+    Actualización en bloque por id. Si el ítem trae 'detalles' se reemplazan
+    todos los del pedido y el total pasa a ser la suma de los subtotales.
+    Devuelve (ids, errores).
+    """
+    seen = set()
+
+    def build(item):
+        pk = _item_id(item, seen)
+        row = _parse(Pedido, PEDIDO_FIELDS, item, partial=True)
+        _require(Pedido, row)
+        detalles = None
+        if 'detalles' in item:
+            detalles = _detalles(item)
+            row['total'] = _detalles_total(detalles)
+        return dict(row, id=pk), detalles
+
+    entries, errors = _validate(items, build)
+    _check_refs(session, entries, errors, [
+        (_pedido_field('id'), Pedido, 'Pedido {} no encontrado'),
+        (_pedido_field('cliente_id'), Cliente, 'Cliente {} no existe'),
+        (_detalle_productos, Producto, 'Producto {} no existe'),
+    ])
+    if atomic and errors:
+        return _result(items, entries, errors)
+    valid = [entries[i] for i in entries if i not in errors]
+    changed = [row for row, _ in valid if len(row) > 1]
+    if changed:
+        session.execute(update(Pedido), changed)
+    replaced = [(row['id'], detalles) for row, detalles in valid if detalles is not None]
+    if replaced:
+        session.execute(delete(PedidoDetalle).where(PedidoDetalle.pedido_id.in_([pk for pk, _ in replaced])),
+                        execution_options={'synchronize_session': False})
+        insert_detalles(session, [dict(d, pedido_id=pk) for pk, detalles in replaced for d in detalles])
+    return _result(items, entries, errors, [row['id'] for row, _ in valid])
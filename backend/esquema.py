@@ -0,0 +1,98 @@
+"""
+esquema.py
+
+- Actualización del esquema de bases ya creadas. El repo no usa migraciones:
+  db.create_all() crea las tablas que faltan, pero no agrega columnas ni
+  índices nuevos a tablas que ya existen.
+- upgrade_schema() corre después de create_all() (ver create_tables en app.py)
+  y aplica cada paso con DDL idempotente de PostgreSQL (ADD COLUMN IF NOT
+  EXISTS, CREATE INDEX IF NOT EXISTS, ...): en una base al día no cambia nada.
+- Todo va en una transacción bajo un advisory lock, así dos procesos que
+  arrancan a la vez no aplican los mismos pasos en paralelo.
+- En otros motores (SQLite de desarrollo) no hace nada: ahí create_all() sobre
+  una base nueva ya deja el esquema completo.
+"""
+
+SCHEMA_LOCK_ID = 4210515  # pg_advisory_xact_lock
+
+
+def _modelo_ml_versiones(conn):
+    """Registro de modelos: versión, artefacto compilado, hash, métricas y esquema; una versión activa por nombre."""
+    conn.exec_driver_sql("""
+        ALTER TABLE modelo_ml
+            ADD COLUMN IF NOT EXISTS version INTEGER,
+            ADD COLUMN IF NOT EXISTS ruta_compilado VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS hash_artefacto VARCHAR(64),
+            ADD COLUMN IF NOT EXISTS metricas JSON,
+            ADD COLUMN IF NOT EXISTS esquema JSON
+    """)
+    # Filas anteriores al registro: versiones 1..n por nombre, en orden de id
+    conn.exec_driver_sql("""
+        UPDATE modelo_ml m SET version = v.version
+        FROM (SELECT id, row_number() OVER (PARTITION BY nombre ORDER BY id) AS version
+              FROM modelo_ml) v
+        WHERE m.id = v.id AND m.version IS NULL
+    """)
+    conn.exec_driver_sql("ALTER TABLE modelo_ml ALTER COLUMN version SET NOT NULL")
+    # Antes activo era True por defecto: queda activa solo la fila más reciente de cada nombre
+    conn.exec_driver_sql("""
+        UPDATE modelo_ml SET activo = false
+        WHERE activo AND id NOT IN (SELECT max(id) FROM modelo_ml WHERE activo GROUP BY nombre)
+    """)
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_modelo_ml_nombre_version ON modelo_ml (nombre, version)")
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_modelo_ml_activo ON modelo_ml (nombre) WHERE activo")
+
+
+def _pedidos_indices(conn):
+    """Índices del listado de pedidos paginado por (fecha_pedido, id) y de sus detalles."""
+    for name, columns in (('ix_pedidos_fecha_id', ''),
+                          ('ix_pedidos_estado_fecha', 'estado, '),
+                          ('ix_pedidos_cliente_fecha', 'cliente_id, ')):
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} "
+                             f"ON pedidos ({columns}fecha_pedido DESC NULLS LAST, id DESC)")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_pedido_detalles_pedido_id ON pedido_detalles (pedido_id)")
+
+
+def _column_type(conn, table, column):
+    """(data_type, precision, escala) de la columna en el esquema actual, o None."""
+    return conn.exec_driver_sql(
+        "SELECT data_type, numeric_precision, numeric_scale FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %(table)s AND column_name = %(column)s",
+        {'table': table, 'column': column}).first()
+
+
+def _inventario_saldos(conn):
+    """Libro mayor de inventario por (producto, sucursal, estado) con cantidades decimales."""
+    conn.exec_driver_sql("""
+        ALTER TABLE inventario_movimientos
+            ADD COLUMN IF NOT EXISTS sucursal_id INTEGER REFERENCES sucursales (id),
+            ADD COLUMN IF NOT EXISTS estado VARCHAR(50)
+    """)
+    # Solo si hace falta: cambiar el tipo reescribe la tabla
+    if tuple(_column_type(conn, 'inventario_movimientos', 'cantidad') or ()) != ('numeric', 12, 3):
+        conn.exec_driver_sql(
+            "ALTER TABLE inventario_movimientos ALTER COLUMN cantidad TYPE NUMERIC(12,3) USING cantidad::numeric(12,3)")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_movimientos_prod_suc_estado "
+        "ON inventario_movimientos (producto_id, sucursal_id, estado)")
+
+
+UPGRADES = (
+    _modelo_ml_versiones,
+    _pedidos_indices,
+    _inventario_saldos,
+)
+
+
+def upgrade_schema(engine):
+    """Aplica UPGRADES en PostgreSQL (idempotente). Devuelve True si corrió."""
+    if engine.dialect.name != 'postgresql':
+        return False
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({SCHEMA_LOCK_ID})")
+        for step in UPGRADES:
+            step(conn)
+    return True
@@ -0,0 +1,36 @@
+# =========================
+# CONFIGURACIÓN DE GUNICORN
+# =========================
+# Uso: gunicorn -c gunicorn.conf.py app:app
+#
+# Con preload_app el master importa la app y carga el grafo de ruteo (snapshot
+# memory-mapped) y el índice espacial una sola vez; los workers los heredan por
+# fork sin copiarlos, así la RSS por worker no crece con el grafo.
+# Ver /api/metrics/memory para la memoria compartida vs privada de cada worker.
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8080')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '2'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+
+
+def when_ready(server):
+    """Se ejecuta en el master antes de crear los workers."""
+    if preload_app:
+        from app import preload_routing, preload_ml_model
+        preload_ml_model()
+        preload_routing()
+        server.log.info("Grafo de ruteo y modelo ML precargados en el master")
+
+
+def post_fork(server, worker):
+    """
+    Con preload_app el engine (y su pool) se creó en el master: cada worker
+    arma su propio pool sin cerrar las conexiones heredadas, que son del master.
+    """
+    if preload_app:
+        from app import app, db
+        with app.app_context():
+            db.engine.dispose(close=False)
@@ -0,0 +1,174 @@
+"""
+inventario.py
+
+- Servicio de inventario sobre el libro mayor InventarioMovimiento y el saldo
+  materializado InventarioSaldo (producto, sucursal, estado).
+- Registrar movimientos: inserta en el libro mayor y, en la misma transacción,
+  suma los deltas al saldo con un único upsert (INSERT ... ON CONFLICT DO
+  UPDATE) con las claves en orden fijo para no cruzar bloqueos entre requests.
+  Una salida que deja un saldo negativo aborta todo el lote.
+- Consultas de stock: lectura por clave primaria del saldo, sin recorrer el
+  historial.
+- Reconstrucción: recalcula todos los saldos desde el libro mayor con un
+  INSERT ... SELECT ... GROUP BY (bloqueando escrituras de saldos mientras dura).
+"""
+
+import datetime
+import decimal
+
+from sqlalchemy import case, delete, func, insert, select, text
+
+from carga_masiva import insert_returning_ids
+from models import InventarioMovimiento, InventarioSaldo
+
+ESTADO_DEFAULT = 'disponible'
+SIGNOS = {'entrada': 1, 'salida': -1}
+SALDO_KEY = ('producto_id', 'sucursal_id', 'estado')
+
+
+class StockInsuficiente(ValueError):
+    """Salidas que dejarían saldo negativo. `faltantes`: [{producto_id, sucursal_id, estado, saldo}]."""
+
+    def __init__(self, faltantes):
+        super().__init__('Stock insuficiente')
+        self.faltantes = faltantes
+
+
+def parse_movimiento(item):
+    """Fila de InventarioMovimiento a partir del JSON. ValueError si no es válido."""
+    if not isinstance(item, dict):
+        raise ValueError('El movimiento debe ser un objeto')
+    row = {}
+    for field in ('producto_id', 'sucursal_id'):
+        value = item.get(field)
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"'{field}' es obligatorio y debe ser entero")
+        row[field] = value
+    if item.get('tipo') not in SIGNOS:
+        raise ValueError(f"'tipo' debe ser uno de {list(SIGNOS)}")
+    row['tipo'] = item['tipo']
+    estado = item.get('estado', ESTADO_DEFAULT)
+    if not isinstance(estado, str) or not estado or len(estado) > 50:
+        raise ValueError("'estado' debe ser texto de hasta 50 caracteres")
+    row['estado'] = estado
+    try:
+        cantidad = decimal.Decimal(str(item.get('cantidad')))
+    except decimal.InvalidOperation:
+        raise ValueError("'cantidad' debe ser numérica")
+    if not cantidad.is_finite() or cantidad <= 0:
+        raise ValueError("'cantidad' debe ser positiva")
+    row['cantidad'] = cantidad
+    return row
+
+
+def _upsert_insert(dialect):
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _aplicar_deltas(session, deltas, ahora):
+    """Suma {(producto, sucursal, estado): (delta, último movimiento)} al saldo. Devuelve los saldos nuevos."""
+    table = InventarioSaldo.__table__
+    values = [{'producto_id': p, 'sucursal_id': s, 'estado': e, 'cantidad': delta,
+               'actualizado': ahora, 'ultimo_movimiento_id': mid}
+              for (p, s, e), (delta, mid) in sorted(deltas.items())]
+    dialect_insert = _upsert_insert(session.connection().dialect.name)
+    if dialect_insert is None:
+        # Sin ON CONFLICT: fila por fila con SELECT ... FOR UPDATE
+        saldos = {}
+        for v in values:
+            key = tuple(v[k] for k in SALDO_KEY)
+            actual = session.execute(select(table.c.cantidad).where(
+                *[table.c[k] == v[k] for k in SALDO_KEY]).with_for_update()).scalar()
+            if actual is None:
+                session.execute(insert(table).values(**v))
+                saldos[key] = v['cantidad']
+            else:
+                saldos[key] = actual + v['cantidad']
+                session.execute(table.update().where(*[table.c[k] == v[k] for k in SALDO_KEY]).values(
+                    cantidad=saldos[key], actualizado=ahora, ultimo_movimiento_id=v['ultimo_movimiento_id']))
+        return saldos
+    stmt = dialect_insert(table).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c[k] for k in SALDO_KEY],
+        set_={'cantidad': table.c.cantidad + stmt.excluded.cantidad,
+              'actualizado': stmt.excluded.actualizado,
+              'ultimo_movimiento_id': stmt.excluded.ultimo_movimiento_id}
+    ).returning(*[table.c[k] for k in SALDO_KEY], table.c.cantidad)
+    return {tuple(r[:3]): r[3] for r in session.execute(stmt)}
+
+
+def registrar_movimientos(session, movimientos, permitir_negativo=False):
+    """
+    Inserta `movimientos` (filas de parse_movimiento) en el libro mayor y
+    actualiza los saldos, sin commit. Devuelve (ids, saldos nuevos por clave).
+    StockInsuficiente si alguna salida deja saldo negativo: quien llama debe
+    hacer rollback.
+    """
+    ahora = datetime.datetime.now()
+    rows = [dict(m, fecha=ahora) for m in movimientos]
+    ids = insert_returning_ids(session, InventarioMovimiento, rows)
+    deltas = {}
+    for row, mid in zip(rows, ids):
+        key = tuple(row[k] for k in SALDO_KEY)
+        delta, _ = deltas.get(key, (0, None))
+        deltas[key] = (delta + SIGNOS[row['tipo']] * row['cantidad'], mid)
+    saldos = _aplicar_deltas(session, deltas, ahora)
+    if not permitir_negativo:
+        faltantes = [dict(zip(SALDO_KEY, key), saldo=float(saldo))
+                     for key, saldo in sorted(saldos.items()) if saldo < 0 and deltas[key][0] < 0]
+        if faltantes:
+            raise StockInsuficiente(faltantes)
+    return ids, saldos
+
+
+def stock(session, producto_id, sucursal_id, estado=ESTADO_DEFAULT):
+    """Saldo de (producto, sucursal, estado): una lectura por clave primaria (0 si no hay fila)."""
+    cantidad = session.execute(select(InventarioSaldo.cantidad).where(
+        InventarioSaldo.producto_id == producto_id,
+        InventarioSaldo.sucursal_id == sucursal_id,
+        InventarioSaldo.estado == estado)).scalar()
+    return cantidad if cantidad is not None else decimal.Decimal(0)
+
+
+def saldos_query(producto_id=None, sucursal_id=None, estados=None):
+    """Consulta de saldos filtrada, ordenada por clave."""
+    query = select(InventarioSaldo)
+    if producto_id is not None:
+        query = query.where(InventarioSaldo.producto_id == producto_id)
+    if sucursal_id is not None:
+        query = query.where(InventarioSaldo.sucursal_id == sucursal_id)
+    if estados:
+        query = query.where(InventarioSaldo.estado.in_(estados))
+    return query.order_by(InventarioSaldo.producto_id, InventarioSaldo.sucursal_id, InventarioSaldo.estado)
+
+
+def reconstruir_saldos(session):
+    """
+    Recalcula todos los saldos desde el libro mayor, sin commit. Los movimientos
+    antiguos sin sucursal no tienen saldo y solo se cuentan. En PostgreSQL se
+    bloquean las escrituras de saldos (no las lecturas) hasta el commit, así no
+    se pierde un movimiento que llegue a mitad de la reconstrucción.
+    """
+    if session.connection().dialect.name == 'postgresql':
+        session.execute(text(f"LOCK TABLE {InventarioSaldo.__tablename__} IN EXCLUSIVE MODE"))
+    m = InventarioMovimiento.__table__
+    estado = func.coalesce(m.c.estado, ESTADO_DEFAULT)
+    signed = case((m.c.tipo == 'entrada', m.c.cantidad), (m.c.tipo == 'salida', -m.c.cantidad), else_=0)
+    por_clave = (select(m.c.producto_id, m.c.sucursal_id, estado, func.sum(signed), func.max(m.c.fecha),
+                        func.max(m.c.id))
+                 .where(m.c.producto_id.isnot(None), m.c.sucursal_id.isnot(None))
+                 .group_by(m.c.producto_id, m.c.sucursal_id, estado))
+    session.execute(delete(InventarioSaldo))
+    session.execute(insert(InventarioSaldo.__table__).from_select(
+        [*SALDO_KEY, 'cantidad', 'actualizado', 'ultimo_movimiento_id'], por_clave))
+    return {
+        'saldos': session.scalar(select(func.count()).select_from(InventarioSaldo)),
+        'movimientos_sin_sucursal': session.scalar(
+            select(func.count()).select_from(m).where(m.c.sucursal_id.is_(None))),
+    }
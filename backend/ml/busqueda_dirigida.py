@@ -0,0 +1,286 @@
+"""
+busqueda_dirigida.py
+
+- Cotas inferiores para búsqueda dirigida (A*) sobre el grafo CSR, sin el
+  preprocesamiento pesado de las jerarquías de contracción.
+- GeoBound: distancia haversine al destino por un factor k = mínimo de
+  peso / haversine sobre todos los arcos (metros por metro para 'length',
+  1 / velocidad máxima de la red para 'travel_time'). Es consistente.
+- LandmarkBound (ALT): distancias desde y hacia unos pocos landmarks elegidos
+  por el más lejano; por desigualdad triangular
+  d(v, t) >= max(d(v, L) - d(t, L), d(L, t) - d(L, v)).
+- Las tablas de landmarks se guardan como float32 junto al snapshot (mmap);
+  a la cota se le resta el peor error de redondeo, así sigue siendo admisible.
+- Las cotas se calculan con los pesos base: valen para perfiles que solo
+  cierran arcos o los penalizan (pesos >= base), como el de ferias.
+
+Uso: python -m ml.busqueda_dirigida build [--weight length] [--landmarks 8]
+     python -m ml.busqueda_dirigida bench [--pairs 200] [--min-km 5]
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra
+
+from ml.directorios import temp_dir_for, publish_dir
+from ml.snap import EARTH_RADIUS_M
+
+ALT_VERSION = 1
+ALT_META_FILE = "meta.json"
+DEFAULT_LANDMARKS = 8
+ACTIVE_LANDMARKS = 3
+# Margen relativo contra el redondeo de la haversine en punto flotante
+GEO_SAFETY = 1.0 - 1e-9
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distancia de círculo máximo en metros (escalares o arreglos)."""
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_scalar_m(lat1, lon1, lat2, lon2):
+    """haversine_m para un solo par de puntos, con math (sin el costo de NumPy por llamada)."""
+    lat1, lon1, lat2, lon2 = (math.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def edge_geo_factor(w, lat_u, lon_u, lat_v, lon_v):
+    """Mayor k tal que k * haversine(u, v) <= w en todas las aristas (u, v) dadas."""
+    w = np.asarray(w, dtype=np.float64)
+    hav = haversine_m(lat_u, lon_u, lat_v, lon_v)
+    ok = (hav > 0) & np.isfinite(w)
+    if not ok.any():
+        return 0.0
+    return float(np.min(w[ok] / hav[ok])) * GEO_SAFETY
+
+
+def geo_factor(graph, weight="length"):
+    """Mayor k tal que k * haversine(u, v) <= peso(u, v) en todos los arcos."""
+    return edge_geo_factor(graph.weight_array(weight), graph.y[graph.tails], graph.x[graph.tails],
+                           graph.y[graph.heads], graph.x[graph.heads])
+
+
+class GeoBound:
+    """Cota haversine hacia un destino fijo."""
+
+    def __init__(self, graph, target, factor):
+        self.y, self.x = graph.y, graph.x
+        self.factor = factor
+        self.lat_t = math.radians(float(graph.y[target]))
+        self.lon_t = math.radians(float(graph.x[target]))
+        self.cos_t = math.cos(self.lat_t)
+        self._cache = {}
+
+    def __call__(self, v):
+        h = self._cache.get(v)
+        if h is None:
+            lat = math.radians(float(self.y[v]))
+            lon = math.radians(float(self.x[v]))
+            a = (math.sin((self.lat_t - lat) / 2) ** 2
+                 + math.cos(lat) * self.cos_t * math.sin((self.lon_t - lon) / 2) ** 2)
+            h = self._cache[v] = self.factor * 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+        return h
+
+
+class LandmarkIndex:
+    """Tablas ALT de un peso: from_l[v, i] = d(L_i, v) y to_l[v, i] = d(v, L_i), float32."""
+
+    def __init__(self, weight, landmarks, from_l, to_l, slack, meta=None):
+        self.weight = weight
+        self.landmarks = landmarks
+        self.from_l = from_l
+        self.to_l = to_l
+        self.slack = slack      # peor error de redondeo de una diferencia de la tabla
+        self.meta = meta or {}
+
+    @property
+    def nbytes(self):
+        return int(self.from_l.nbytes + self.to_l.nbytes)
+
+    def bound(self, target, source=None, active=ACTIVE_LANDMARKS):
+        """Cota hacia target con los `active` landmarks que mejor acotan desde source."""
+        return LandmarkBound(self, target, source, active)
+
+
+class LandmarkBound:
+    """Cota ALT hacia un destino fijo (inf si el destino no es alcanzable desde v)."""
+
+    def __init__(self, index, target, source=None, active=ACTIVE_LANDMARKS):
+        self.from_l, self.to_l = index.from_l, index.to_l
+        self.from_t = np.asarray(index.from_l[target], dtype=np.float64).tolist()
+        self.to_t = np.asarray(index.to_l[target], dtype=np.float64).tolist()
+        self.slack = index.slack
+        self.active = range(len(self.from_t))
+        if source is not None and active < len(self.from_t):
+            to_s, from_s = index.to_l[source].tolist(), index.from_l[source].tolist()
+            score = [self._term(to_s, from_s, i) for i in self.active]
+            self.active = sorted(self.active, key=lambda i: -score[i])[:active]
+        self._cache = {}
+
+    def _term(self, to_v, from_v, i):
+        # inf - inf = nan no gana ninguna comparación: ese landmark no acota
+        a = to_v[i] - self.to_t[i]
+        b = self.from_t[i] - from_v[i]
+        return a if a > b else b if b == b else a if a == a else 0.0
+
+    def __call__(self, v):
+        h = self._cache.get(v)
+        if h is None:
+            to_v, from_v = self.to_l[v].tolist(), self.from_l[v].tolist()
+            h = 0.0
+            for i in self.active:
+                term = self._term(to_v, from_v, i)
+                if term > h:
+                    h = term
+            h = self._cache[v] = max(h - self.slack, 0.0)
+        return h
+
+
+def _csgraph(graph, weight):
+    w = np.asarray(graph.weight_array(weight), dtype=np.float64)
+    ok = np.isfinite(w)
+    return sp.csr_matrix((w[ok], (graph.tails[ok], graph.heads[ok])), shape=(graph.n_nodes, graph.n_nodes))
+
+
+def build_landmarks(graph, weight="length", n_landmarks=DEFAULT_LANDMARKS, seed=0):
+    """Landmarks por el más lejano y sus tablas de distancia (desde y hacia cada uno)."""
+    A = _csgraph(graph, weight)
+    AT = A.T.tocsr()
+    rng = np.random.default_rng(seed)
+    start = int(rng.integers(graph.n_nodes))
+    d0 = csgraph_dijkstra(A, directed=True, indices=[start])[0]
+    reach = np.isfinite(d0)
+    score = np.where(reach, d0, -np.inf)
+    nearest = np.full(graph.n_nodes, np.inf)
+    landmarks, from_rows, to_rows = [], [], []
+    for _ in range(n_landmarks):
+        lm = int(np.argmax(score))
+        if not np.isfinite(score[lm]):
+            break
+        d_from = csgraph_dijkstra(A, directed=True, indices=[lm])[0]
+        d_to = csgraph_dijkstra(AT, directed=True, indices=[lm])[0]
+        landmarks.append(lm)
+        from_rows.append(d_from)
+        to_rows.append(d_to)
+        # Siguiente: el nodo alcanzable más lejos del landmark más cercano
+        nearest = np.minimum(nearest, d_from)
+        score = np.where(reach & np.isfinite(nearest), nearest, -np.inf)
+        score[landmarks] = -np.inf
+    from_l = np.ascontiguousarray(np.array(from_rows).T)
+    to_l = np.ascontiguousarray(np.array(to_rows).T)
+    from_32, to_32 = from_l.astype(np.float32), to_l.astype(np.float32)
+    # Cada término resta dos entradas de la misma tabla: su error es a lo sumo 2 * el máximo
+    err = 0.0
+    for exact, rounded in ((from_l, from_32), (to_l, to_32)):
+        finite = np.isfinite(exact)
+        if finite.any():
+            err = max(err, float(np.max(np.abs(rounded[finite].astype(np.float64) - exact[finite]))))
+    return LandmarkIndex(weight, landmarks, from_32, to_32, slack=2 * err,
+                         meta={"version": ALT_VERSION, "weight": weight, "seed": seed})
+
+
+def alt_fingerprint(graph, weight="length"):
+    h = hashlib.sha256()
+    h.update(json.dumps([ALT_VERSION, graph.version, weight], default=str).encode())
+    h.update(np.ascontiguousarray(graph.weight_array(weight)).tobytes())
+    return h.hexdigest()[:16]
+
+
+def _alt_dir(snapshot_dir, fp):
+    return os.path.join(snapshot_dir, f"alt_{fp}")
+
+
+def save_landmarks(index, out_dir):
+    tmp_dir = temp_dir_for(out_dir)
+    np.save(os.path.join(tmp_dir, "from_l.npy"), index.from_l)
+    np.save(os.path.join(tmp_dir, "to_l.npy"), index.to_l)
+    with open(os.path.join(tmp_dir, ALT_META_FILE), "w") as f:
+        json.dump({**index.meta, "landmarks": index.landmarks, "slack": index.slack}, f, indent=2)
+    publish_dir(tmp_dir, out_dir)
+
+
+def load_landmarks(graph, snapshot_dir, weight="length"):
+    """Tablas ALT de este grafo y peso si fueron construidas (mmap), si no None."""
+    out_dir = _alt_dir(snapshot_dir, alt_fingerprint(graph, weight))
+    meta_path = os.path.join(out_dir, ALT_META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    from_l = np.load(os.path.join(out_dir, "from_l.npy"), mmap_mode="r")
+    to_l = np.load(os.path.join(out_dir, "to_l.npy"), mmap_mode="r")
+    return LandmarkIndex(weight, meta["landmarks"], from_l, to_l, meta["slack"], meta=meta)
+
+
+def build_and_save_landmarks(graph, snapshot_dir, weight="length", n_landmarks=DEFAULT_LANDMARKS):
+    index = build_landmarks(graph, weight, n_landmarks)
+    save_landmarks(index, _alt_dir(snapshot_dir, alt_fingerprint(graph, weight)))
+    return index
+
+
+# --------------------------
+# CLI
+# --------------------------
+
+def benchmark(graph, weight="length", n_pairs=200, min_km=5.0, seed=0):
+    """Nodos expandidos y tiempo por modo en pares O-D separados al menos min_km."""
+    rng = np.random.default_rng(seed)
+    pairs = []
+    while len(pairs) < n_pairs:
+        s, t = (int(v) for v in rng.integers(0, graph.n_nodes, size=2))
+        if haversine_m(graph.y[s], graph.x[s], graph.y[t], graph.x[t]) >= min_km * 1000:
+            pairs.append((s, t))
+    methods = ["dijkstra", "astar"] + (["alt"] if weight in graph.landmarks else [])
+    report = {"pairs": n_pairs, "min_km": min_km}
+    reference = None
+    for method in methods:
+        t0 = time.perf_counter()
+        expanded = 0
+        stats = []
+        for s, t in pairs:
+            arcs, n = graph.search_arcs(s, t, weight=weight, method=method)
+            expanded += n
+            stats.append(None if arcs is None else graph.arcs_stats(s, arcs, weight)[1:])
+        report[f"{method}_ms"] = round(1000 * (time.perf_counter() - t0) / n_pairs, 3)
+        report[f"{method}_expanded"] = expanded // n_pairs
+        if reference is None:
+            reference = stats
+        else:
+            report[f"{method}_mismatches"] = sum(a != b for a, b in zip(reference, stats))
+    return report
+
+
+def main():
+    from ml.snapshot import SNAPSHOT_DIR, load_snapshot
+    parser = argparse.ArgumentParser(description="Landmarks (ALT) y A* sobre el grafo de ruteo.")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("--weight", default="length", choices=["length", "travel_time"])
+    parser.add_argument("--landmarks", type=int, default=DEFAULT_LANDMARKS)
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--min-km", type=float, default=5.0)
+    args = parser.parse_args()
+    graph = load_snapshot(SNAPSHOT_DIR)
+    if args.command == "build":
+        t0 = time.perf_counter()
+        index = build_and_save_landmarks(graph, SNAPSHOT_DIR, args.weight, args.landmarks)
+        print(f"{len(index.landmarks)} landmarks ({index.nbytes} bytes) en {time.perf_counter() - t0:.1f} s")
+        return
+    index = load_landmarks(graph, SNAPSHOT_DIR, args.weight)
+    if index is not None:
+        graph.add_landmarks(index)
+    for key, value in benchmark(graph, args.weight, args.pairs, args.min_km).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+cache_pares.py
+
+- Caché de distancias/tiempos entre pares de nodos, compartida entre requests
+  de TSP (mismo depósito y clientes frecuentes).
+- Tabla de direccionamiento abierto en arreglos NumPy: clave int64 con el par
+  (origen, destino) de índices internos, dist y tiempo en float32 y un bit de
+  referencia por celda. Sondeo lineal y borrado con corrimiento hacia atrás.
+- Memoria acotada: cada tabla tiene capacidad fija; al llegar a su carga máxima
+  se desaloja con CLOCK (segunda oportunidad).
+- Una tabla por (versión del grafo, perfil del día, peso); al cambiar la versión
+  del grafo se descartan las tablas de la versión anterior.
+- Solo rutas sin hora de salida: con hora, el costo depende del instante.
+"""
+
+import threading
+
+import numpy as np
+
+DEFAULT_MAX_PAIRS = 100000
+MAX_LOAD = 0.75
+EMPTY = -1
+_HASH_MULT = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+
+
+def pair_key(s, t):
+    """Clave int64 de un par de índices internos (ambos < 2**31)."""
+    return (int(s) << 32) | int(t)
+
+
+class PairTable:
+    """Tabla hash de pares -> (dist, tiempo) con capacidad fija y desalojo CLOCK."""
+
+    def __init__(self, max_pairs=DEFAULT_MAX_PAIRS):
+        capacity = 1 << max(4, int(np.ceil(np.log2(max_pairs / MAX_LOAD))))
+        self.capacity = capacity
+        self.max_pairs = max_pairs
+        self._bits = capacity.bit_length() - 1
+        self._mask = capacity - 1
+        self.keys = np.full(capacity, EMPTY, dtype=np.int64)
+        self.dist = np.zeros(capacity, dtype=np.float32)
+        self.time = np.zeros(capacity, dtype=np.float32)
+        self.ref = np.zeros(capacity, dtype=np.bool_)
+        self.size = 0
+        self.evictions = 0
+        self._hand = 0
+
+    @property
+    def nbytes(self):
+        return int(self.keys.nbytes + self.dist.nbytes + self.time.nbytes + self.ref.nbytes)
+
+    def _home(self, key):
+        return ((key * _HASH_MULT) & _MASK64) >> (64 - self._bits)
+
+    def _slot(self, key):
+        """Celda de la clave o, si no está, la celda vacía donde iría (negada - 1)."""
+        keys, mask = self.keys, self._mask
+        i = self._home(key)
+        while True:
+            k = keys[i]
+            if k == key:
+                return i
+            if k == EMPTY:
+                return -i - 1
+            i = (i + 1) & mask
+
+    def get(self, key):
+        """(dist, tiempo) o None."""
+        i = self._slot(key)
+        if i < 0:
+            return None
+        self.ref[i] = True
+        return float(self.dist[i]), float(self.time[i])
+
+    def put(self, key, dist, time):
+        i = self._slot(key)
+        if i < 0:
+            if self.size >= self.max_pairs:
+                self._evict()
+                i = self._slot(key)
+            i = -i - 1
+            self.keys[i] = key
+            self.size += 1
+        self.dist[i] = dist
+        self.time[i] = time
+        self.ref[i] = False
+
+    def _evict(self):
+        # CLOCK: la aguja limpia bits de referencia hasta dar con una celda sin usar
+        keys, ref, mask = self.keys, self.ref, self._mask
+        while True:
+            i = self._hand
+            if keys[i] != EMPTY:
+                if not ref[i]:
+                    self._delete(i)
+                    self.evictions += 1
+                    return
+                ref[i] = False
+            self._hand = (i + 1) & mask
+
+    def _delete(self, i):
+        # Corrimiento hacia atrás: no deja lápidas en el sondeo lineal
+        keys, mask = self.keys, self._mask
+        j = i
+        while True:
+            j = (j + 1) & mask
+            k = keys[j]
+            if k == EMPTY:
+                break
+            home = self._home(int(k))
+            if (i <= j and i < home <= j) or (i > j and (home > i or home <= j)):
+                continue
+            keys[i] = k
+            self.dist[i] = self.dist[j]
+            self.time[i] = self.time[j]
+            self.ref[i] = self.ref[j]
+            i = j
+        keys[i] = EMPTY
+        self.ref[i] = False
+        self.size -= 1
+
+
+class PairDistanceCache:
+    """Tablas de pares por (versión del grafo, perfil, peso), todas con el mismo límite."""
+
+    def __init__(self, max_pairs=DEFAULT_MAX_PAIRS):
+        self.max_pairs = max_pairs
+        self._tables = {}
+        self._graph_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _table(self, graph_version, profile, weight):
+        if graph_version != self._graph_version:
+            self._tables.clear()
+            self._graph_version = graph_version
+        namespace = (profile or "normal", weight)
+        table = self._tables.get(namespace)
+        if table is None:
+            table = self._tables[namespace] = PairTable(self.max_pairs)
+        return table
+
+    def lookup(self, graph_version, profile, weight, src_idx, dst_idx):
+        """
+        Matrices (dist, tiempo) con lo cacheado y máscara de pares faltantes
+        (la diagonal nunca falta: vale 0).
+        """
+        dist = np.full((len(src_idx), len(dst_idx)), np.inf)
+        tsec = np.full((len(src_idx), len(dst_idx)), np.inf)
+        missing = np.zeros((len(src_idx), len(dst_idx)), dtype=bool)
+        with self._lock:
+            table = self._table(graph_version, profile, weight)
+            for i, s in enumerate(src_idx):
+                for j, t in enumerate(dst_idx):
+                    if s == t:
+                        dist[i, j] = tsec[i, j] = 0.0
+                        continue
+                    value = table.get(pair_key(s, t))
+                    if value is None:
+                        missing[i, j] = True
+                        self.misses += 1
+                    else:
+                        dist[i, j], tsec[i, j] = value
+                        self.hits += 1
+        return dist, tsec, missing
+
+    def store(self, graph_version, profile, weight, pairs):
+        """Guarda [(s, t, dist, tiempo), ...] (pares sin ruta con inf)."""
+        with self._lock:
+            table = self._table(graph_version, profile, weight)
+            for s, t, d, tt in pairs:
+                table.put(pair_key(s, t), d, tt)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        tables = list(self._tables.values())
+        return {
+            "pairs": sum(t.size for t in tables),
+            "max_pairs_per_table": self.max_pairs,
+            "tables": len(tables),
+            "bytes": sum(t.nbytes for t in tables),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": sum(t.evictions for t in tables),
+        }
@@ -0,0 +1,170 @@
+"""
+cache_rutas.py
+
+- Caché de resultados de /api/find-route.
+- Clave: nodos ajustados (en orden), perfil del día, minuto de salida, solver y
+  presupuesto del TSP, más la versión del grafo (snapshot) y del modelo ML.
+  Si cambia la versión del grafo o del modelo se vacía el nivel en memoria, y
+  las claves viejas del nivel compartido dejan de coincidir.
+- Nivel 1: LRU en memoria por proceso, con tamaño máximo y TTL.
+- Nivel 2 (opcional): SQLite en disco compartido entre workers (WAL).
+- Contadores de aciertos / fallos por nivel para dimensionarla.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL_SECONDS = 6 * 3600
+SHARED_MAX_ROWS = 100000
+SHARED_CLEANUP_EVERY = 500
+
+
+def route_cache_key(nodes, profile, departure_sec, solver, time_budget_ms):
+    """Clave de la ruta (sin versiones); la salida se agrupa por minuto."""
+    minute = None if departure_sec is None else int(departure_sec // 60)
+    return (tuple(int(n) for n in nodes), profile or "normal", minute, solver, time_budget_ms)
+
+
+class SharedRouteStore:
+    """Nivel compartido en SQLite: una conexión por hilo y proceso."""
+
+    def __init__(self, path, max_rows=SHARED_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._puts = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS route_cache "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_route_cache_expires ON route_cache (expires)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM route_cache WHERE key = ? AND expires > ?",
+                                   (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value, ttl):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO route_cache (key, value, expires) VALUES (?, ?, ?)",
+                     (key, json.dumps(value), time.time() + ttl))
+        self._puts += 1
+        if self._puts % SHARED_CLEANUP_EVERY == 0:
+            self.cleanup()
+
+    def cleanup(self):
+        """Borra lo vencido y, si sobra, las entradas que vencen antes."""
+        conn = self._conn()
+        conn.execute("DELETE FROM route_cache WHERE expires <= ?", (time.time(),))
+        conn.execute("DELETE FROM route_cache WHERE key IN (SELECT key FROM route_cache "
+                     "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_rows,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM route_cache")
+
+
+class RouteCache:
+    """LRU + TTL en memoria con nivel compartido opcional; todo versionado por grafo y modelo."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, shared_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared = SharedRouteStore(shared_path) if shared_path else None
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._versions = None
+        self.stats_counters = collections.Counter()
+
+    def _check_versions(self, versions):
+        # Cambió el grafo o el modelo: lo guardado ya no sirve
+        if versions != self._versions:
+            if self._versions is not None:
+                self._entries.clear()
+                self.stats_counters["invalidations"] += 1
+            self._versions = versions
+
+    @staticmethod
+    def _shared_key(key, versions):
+        return hashlib.sha1(repr((versions, key)).encode()).hexdigest()
+
+    def get(self, key, versions):
+        """Resultado cacheado (dict) o None."""
+        now = time.monotonic()
+        with self._lock:
+            self._check_versions(versions)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.stats_counters["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+                self.stats_counters["expired"] += 1
+        if self.shared is not None:
+            try:
+                value = self.shared.get(self._shared_key(key, versions))
+            except sqlite3.Error as e:
+                print(f"Caché de rutas compartida no disponible: {e}")
+                value = None
+            if value is not None:
+                self.stats_counters["shared_hits"] += 1
+                self._put_local(key, value, versions)
+                return value
+            self.stats_counters["shared_misses"] += 1
+        self.stats_counters["misses"] += 1
+        return None
+
+    def _put_local(self, key, value, versions):
+        with self._lock:
+            self._check_versions(versions)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats_counters["evictions"] += 1
+
+    def put(self, key, value, versions):
+        self._put_local(key, value, versions)
+        if self.shared is not None:
+            try:
+                self.shared.put(self._shared_key(key, versions), value, self.ttl_seconds)
+            except sqlite3.Error as e:
+                print(f"No se pudo guardar en la caché de rutas compartida: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        c = self.stats_counters
+        hits = c["hits"] + c["shared_hits"]
+        lookups = hits + c["misses"]
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": c["hits"],
+            "misses": c["misses"],
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "shared_enabled": self.shared is not None,
+            "shared_hits": c["shared_hits"],
+            "shared_misses": c["shared_misses"],
+            "expired": c["expired"],
+            "evictions": c["evictions"],
+            "invalidations": c["invalidations"],
+        }
@@ -0,0 +1,463 @@
+"""
+contraccion.py
+
+- Jerarquías de contracción (CH) sobre el grafo CSR, construidas offline desde
+  el snapshot (el mismo grafo que produce load_graph_z16).
+- Orden de contracción por diferencia de aristas + vecinos ya contraídos, con
+  actualización perezosa y búsquedas de testigo acotadas.
+- Todo en arreglos: rango de cada nodo, aristas (arcos originales + atajos con
+  sus dos hijos) y listas CSR de aristas hacia arriba / desde arriba.
+- Consultas: Dijkstra bidireccional solo hacia nodos de mayor rango, y desarme
+  de atajos hasta los arcos originales (mismas estadísticas que Dijkstra).
+- Matrices many-to-many con buckets para el TSP.
+- Un índice por (peso, perfil); se guarda junto al snapshot, identificado por
+  la huella de (grafo, peso, pesos del perfil), y se carga memory-mapped.
+
+Uso:
+  python -m ml.contraccion build [--weight length] [--feria [--buffer M]]
+  python -m ml.contraccion bench [--pairs 200] [--matrix 12] [--feria]
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from ml.directorios import temp_dir_for, publish_dir
+
+CH_VERSION = 1
+CH_META_FILE = "meta.json"
+WITNESS_MAX_SETTLED = 60
+CH_ARRAYS = ("rank", "e_tail", "e_head", "e_w", "e_aux", "sc_first", "sc_second",
+             "up_indptr", "up_edges", "up_heads", "up_w",
+             "down_indptr", "down_edges", "down_tails", "down_w")
+
+
+def ch_fingerprint(graph, weight="length", profile=None):
+    """Huella del índice: versión de CH, del grafo y los pesos efectivos del perfil."""
+    h = hashlib.sha256()
+    h.update(json.dumps([CH_VERSION, graph.version, weight, profile], default=str).encode())
+    h.update(np.ascontiguousarray(graph.weight_array(weight, profile)).tobytes())
+    return h.hexdigest()[:16]
+
+
+def _ch_dir(snapshot_dir, fp):
+    return os.path.join(snapshot_dir, f"ch_{fp}")
+
+
+class ContractionHierarchy:
+    """
+    Índice CH de un (peso, perfil). Aristas 0..n_arcs-1 son los arcos del grafo;
+    las siguientes son atajos, con sus dos aristas hijas en sc_first / sc_second.
+    e_w es el peso de búsqueda y e_aux el otro atributo (tiempo si se busca por
+    distancia, distancia si se busca por tiempo), sumado a lo largo del atajo.
+    """
+
+    def __init__(self, n_arcs, weight, profile, meta=None, **arrays):
+        self.n_arcs = n_arcs
+        self.weight = weight
+        self.profile = profile
+        self.meta = meta or {}
+        for name in CH_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def n_shortcuts(self):
+        return len(self.sc_first)
+
+    @property
+    def nbytes(self):
+        return int(sum(getattr(self, name).nbytes for name in CH_ARRAYS))
+
+    # --------------------------
+    # BÚSQUEDA
+    # --------------------------
+
+    def _upward(self, source, indptr, nbrs, weights, edges):
+        """Búsqueda completa hacia arriba (sin criterio de parada): (dist, pred de aristas)."""
+        dist = {source: 0.0}
+        pred = {source: -1}
+        settled = set()
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            start, end = int(indptr[u]), int(indptr[u + 1])
+            for v, wv, e in zip(nbrs[start:end].tolist(), weights[start:end].tolist(),
+                                edges[start:end].tolist()):
+                nd = d + wv
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap, (nd, v))
+        return {v: dist[v] for v in settled}, pred
+
+    def query_edges(self, s, t):
+        """
+        Dijkstra bidireccional hacia arriba entre índices internos. Retorna la lista
+        de aristas CH de s a t (sin desarmar) o None si no hay ruta.
+        """
+        if s == t:
+            return []
+        sides = (
+            (self.up_indptr, self.up_heads, self.up_w, self.up_edges),
+            (self.down_indptr, self.down_tails, self.down_w, self.down_edges),
+        )
+        dist = ({s: 0.0}, {t: 0.0})
+        pred = ({s: -1}, {t: -1})
+        settled = (set(), set())
+        heaps = ([(0.0, s)], [(0.0, t)])
+        best, meet = math.inf, -1
+        while True:
+            # Una dirección termina cuando su mínimo ya no puede mejorar la mejor ruta
+            live = [k for k in (0, 1) if heaps[k] and heaps[k][0][0] < best]
+            if not live:
+                break
+            k = min(live, key=lambda side: heaps[side][0][0])
+            d, u = heapq.heappop(heaps[k])
+            if u in settled[k]:
+                continue
+            settled[k].add(u)
+            other = dist[1 - k].get(u)
+            if other is not None and d + other < best:
+                best, meet = d + other, u
+            indptr, nbrs, weights, edges = sides[k]
+            start, end = int(indptr[u]), int(indptr[u + 1])
+            for v, wv, e in zip(nbrs[start:end].tolist(), weights[start:end].tolist(),
+                                edges[start:end].tolist()):
+                nd = d + wv
+                if nd < dist[k].get(v, math.inf):
+                    dist[k][v] = nd
+                    pred[k][v] = e
+                    heapq.heappush(heaps[k], (nd, v))
+        if meet == -1:
+            return None
+        return self._edge_chain(pred[0], meet, forward=True) + self._edge_chain(pred[1], meet, forward=False)
+
+    def _edge_chain(self, pred, node, forward):
+        """Aristas CH desde la raíz de la búsqueda hasta `node` (en orden de recorrido)."""
+        chain = []
+        e = pred[node]
+        while e != -1:
+            chain.append(e)
+            node = int(self.e_tail[e]) if forward else int(self.e_head[e])
+            e = pred[node]
+        if forward:
+            chain.reverse()
+        return chain
+
+    def unpack(self, edges):
+        """Desarma atajos: lista de aristas CH -> lista de arcos del grafo, en orden."""
+        m = self.n_arcs
+        sc_first, sc_second = self.sc_first, self.sc_second
+        arcs = []
+        stack = list(reversed(edges))
+        while stack:
+            e = stack.pop()
+            if e < m:
+                arcs.append(e)
+            else:
+                stack.append(int(sc_second[e - m]))
+                stack.append(int(sc_first[e - m]))
+        return arcs
+
+    def path_arcs(self, s, t):
+        """Arcos del camino mínimo de s a t (índices internos), o None si no hay ruta."""
+        edges = self.query_edges(s, t)
+        return None if edges is None else self.unpack(edges)
+
+    def many_to_many(self, src_idx, dst_idx):
+        """
+        Matriz con buckets: una búsqueda hacia abajo por destino llena los buckets de
+        los nodos que alcanza; una búsqueda hacia arriba por origen los recorre.
+        """
+        buckets = {}
+        bwd_preds = []
+        for j, t in enumerate(dst_idx):
+            dist, pred = self._upward(t, self.down_indptr, self.down_tails, self.down_w, self.down_edges)
+            bwd_preds.append(pred)
+            for v, d in dist.items():
+                buckets.setdefault(v, []).append((j, d))
+        best = np.full((len(src_idx), len(dst_idx)), np.inf)
+        meet = np.full((len(src_idx), len(dst_idx)), -1, dtype=np.int64)
+        fwd_preds = []
+        for i, s in enumerate(src_idx):
+            dist, pred = self._upward(s, self.up_indptr, self.up_heads, self.up_w, self.up_edges)
+            fwd_preds.append(pred)
+            row, meet_row = best[i], meet[i]
+            for v, d in dist.items():
+                for j, db in buckets.get(v, ()):
+                    if d + db < row[j]:
+                        row[j] = d + db
+                        meet_row[j] = v
+        return CHMatrix(self, best, meet, fwd_preds, bwd_preds)
+
+
+class CHMatrix:
+    """Resultado de many_to_many: costos por el peso del índice y caminos por par."""
+
+    def __init__(self, ch, cost, meet, fwd_preds, bwd_preds):
+        self.ch = ch
+        self.cost = cost
+        self.meet = meet
+        self.fwd_preds = fwd_preds
+        self.bwd_preds = bwd_preds
+
+    def path_arcs(self, i, j):
+        v = int(self.meet[i, j])
+        if v == -1:
+            return None
+        edges = (self.ch._edge_chain(self.fwd_preds[i], v, forward=True)
+                 + self.ch._edge_chain(self.bwd_preds[j], v, forward=False))
+        return self.ch.unpack(edges)
+
+
+# --------------------------
+# CONSTRUCCIÓN
+# --------------------------
+
+def build_ch(graph, weight="length", profile=None, max_settled=WITNESS_MAX_SETTLED, verbose=True):
+    """Contrae todos los nodos del grafo y retorna el ContractionHierarchy."""
+    t0 = time.perf_counter()
+    n, m = graph.n_nodes, graph.n_arcs
+    length, travel_time = graph.arcs[weight]
+    e_w = np.asarray(graph.weight_array(weight, profile), dtype=np.float64).tolist()
+    e_aux = np.asarray(travel_time if weight == "length" else length, dtype=np.float64).tolist()
+    e_tail = graph.tails.tolist()
+    e_head = graph.heads.tolist()
+    sc_first, sc_second = [], []
+
+    out_adj = [dict() for _ in range(n)]
+    in_adj = [dict() for _ in range(n)]
+    for a in range(m):
+        u, v, w = e_tail[a], e_head[a], e_w[a]
+        if u == v or not math.isfinite(w):
+            continue  # lazos y arcos cerrados por el perfil
+        cur = out_adj[u].get(v)
+        if cur is None or w < e_w[cur]:
+            out_adj[u][v] = a
+            in_adj[v][u] = a
+
+    def witness(u, skip, targets, limit):
+        dist = {u: 0.0}
+        heap = [(0.0, u)]
+        remaining = set(targets)
+        settled = 0
+        while heap and remaining:
+            d, x = heapq.heappop(heap)
+            if d > dist[x]:
+                continue
+            if d > limit or settled >= max_settled:
+                break
+            settled += 1
+            remaining.discard(x)
+            for y, e in out_adj[x].items():
+                if y == skip:
+                    continue
+                nd = d + e_w[e]
+                if nd < dist.get(y, math.inf):
+                    dist[y] = nd
+                    heapq.heappush(heap, (nd, y))
+        return dist
+
+    def shortcuts_for(v):
+        found = []
+        outs = list(out_adj[v].items())
+        for u, e1 in in_adj[v].items():
+            targets = [(x, e2) for x, e2 in outs if x != u]
+            if not targets:
+                continue
+            w1 = e_w[e1]
+            limit = w1 + max(e_w[e2] for _, e2 in targets)
+            dist = witness(u, v, [x for x, _ in targets], limit)
+            for x, e2 in targets:
+                via = w1 + e_w[e2]
+                if dist.get(x, math.inf) > via:
+                    found.append((u, x, e1, e2, via))
+        return found
+
+    deleted = [0] * n
+
+    def priority(v):
+        return len(shortcuts_for(v)) - len(in_adj[v]) - len(out_adj[v]) + deleted[v]
+
+    heap = [(priority(v), v) for v in range(n)]
+    heapq.heapify(heap)
+    rank = np.full(n, -1, dtype=np.int32)
+    up_lists = [None] * n
+    down_lists = [None] * n
+    order = 0
+    while heap:
+        _, v = heapq.heappop(heap)
+        if rank[v] != -1:
+            continue
+        p = priority(v)
+        if heap and p > heap[0][0]:
+            heapq.heappush(heap, (p, v))  # actualización perezosa
+            continue
+        for u, x, e1, e2, via in shortcuts_for(v):
+            cur = out_adj[u].get(x)
+            if cur is None or via < e_w[cur]:
+                e = len(e_w)
+                e_tail.append(u)
+                e_head.append(x)
+                e_w.append(via)
+                e_aux.append(e_aux[e1] + e_aux[e2])
+                sc_first.append(e1)
+                sc_second.append(e2)
+                out_adj[u][x] = e
+                in_adj[x][u] = e
+        # Aristas de v hacia / desde nodos aún no contraídos (de mayor rango)
+        up_lists[v] = list(out_adj[v].values())
+        down_lists[v] = list(in_adj[v].values())
+        for u in in_adj[v]:
+            del out_adj[u][v]
+            deleted[u] += 1
+        for x in out_adj[v]:
+            del in_adj[x][v]
+            deleted[x] += 1
+        out_adj[v] = {}
+        in_adj[v] = {}
+        rank[v] = order
+        order += 1
+        if verbose and order % 10000 == 0:
+            print(f"[ch] {order}/{n} nodos contraídos, {len(sc_first)} atajos")
+
+    e_tail = np.array(e_tail, dtype=np.int32)
+    e_head = np.array(e_head, dtype=np.int32)
+    e_w = np.array(e_w, dtype=np.float64)
+
+    def csr(lists, ends):
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(lst) for lst in lists], out=indptr[1:])
+        edges = np.array([e for lst in lists for e in lst], dtype=np.int32)
+        return indptr, edges, ends[edges], e_w[edges]
+
+    up_indptr, up_edges, up_heads, up_w = csr(up_lists, e_head)
+    down_indptr, down_edges, down_tails, down_w = csr(down_lists, e_tail)
+    meta = {"version": CH_VERSION, "weight": weight, "profile": profile, "n_shortcuts": len(sc_first),
+            "build_seconds": round(time.perf_counter() - t0, 1)}
+    if verbose:
+        print(f"[ch] listo: {n} nodos, {len(sc_first)} atajos en {meta['build_seconds']} s")
+    return ContractionHierarchy(
+        m, weight, profile, meta=meta,
+        rank=rank, e_tail=e_tail, e_head=e_head, e_w=e_w, e_aux=np.array(e_aux, dtype=np.float64),
+        sc_first=np.array(sc_first, dtype=np.int32), sc_second=np.array(sc_second, dtype=np.int32),
+        up_indptr=up_indptr, up_edges=up_edges, up_heads=up_heads, up_w=up_w,
+        down_indptr=down_indptr, down_edges=down_edges, down_tails=down_tails, down_w=down_w,
+    )
+
+
+def save_ch(ch, out_dir):
+    """Escribe el índice en un directorio temporal y lo renombra de forma atómica."""
+    tmp_dir = temp_dir_for(out_dir)
+    for name in CH_ARRAYS:
+        np.save(os.path.join(tmp_dir, name + ".npy"), getattr(ch, name))
+    with open(os.path.join(tmp_dir, CH_META_FILE), "w") as f:
+        json.dump({**ch.meta, "n_arcs": ch.n_arcs}, f, indent=2)
+    publish_dir(tmp_dir, out_dir)
+
+
+def load_ch(graph, snapshot_dir, weight="length", profile=None):
+    """Índice CH de (peso, perfil) para este grafo si fue construido (mmap), si no None."""
+    out_dir = _ch_dir(snapshot_dir, ch_fingerprint(graph, weight, profile))
+    meta_path = os.path.join(out_dir, CH_META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(out_dir, name + ".npy"), mmap_mode="r") for name in CH_ARRAYS}
+    return ContractionHierarchy(meta["n_arcs"], weight, profile, meta=meta, **arrays)
+
+
+def build_and_save_ch(graph, snapshot_dir, weight="length", profile=None):
+    ch = build_ch(graph, weight, profile)
+    save_ch(ch, _ch_dir(snapshot_dir, ch_fingerprint(graph, weight, profile)))
+    return ch
+
+
+# --------------------------
+# CLI
+# --------------------------
+
+def _load_graph(feria, buffer_m):
+    from ml.ferias import FERIA_PROFILE, load_feria_mask
+    from ml.ruta_modelo import FERIA_POINTS
+    from ml.snapshot import SNAPSHOT_DIR, load_snapshot
+    graph = load_snapshot(SNAPSHOT_DIR)
+    profile = None
+    if feria:
+        graph.add_closure_profile(FERIA_PROFILE, load_feria_mask(graph, FERIA_POINTS, buffer_m, SNAPSHOT_DIR))
+        profile = FERIA_PROFILE
+    return graph, profile, SNAPSHOT_DIR
+
+
+def benchmark(graph, ch, n_pairs=200, matrix_size=12, seed=0):
+    """Compara CH contra Dijkstra en pares O-D aleatorios; retorna tiempos y diferencias."""
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, graph.n_nodes, size=(n_pairs, 2)).tolist()
+    weight, profile = ch.weight, ch.profile
+    t0 = time.perf_counter()
+    reference = []
+    for s, t in pairs:
+        _, pred = graph.dijkstra(s, weight=weight, targets=[t], profile=profile)
+        reference.append(graph.path_arcs(pred, t))
+    t_dijkstra = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    results = [ch.path_arcs(s, t) for s, t in pairs]
+    t_ch = time.perf_counter() - t0
+    mismatches = 0
+    for (s, _), ref, arcs in zip(pairs, reference, results):
+        if (ref is None) != (arcs is None):
+            mismatches += 1
+        elif ref is not None and graph.arcs_stats(s, ref, weight)[1:] != graph.arcs_stats(s, arcs, weight)[1:]:
+            mismatches += 1
+    nodes = rng.choice(graph.n_nodes, size=matrix_size, replace=False).tolist()
+    t0 = time.perf_counter()
+    for s in nodes:
+        graph.dijkstra(s, weight=weight, targets=nodes, profile=profile)
+    t_matrix_dijkstra = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ch.many_to_many(nodes, nodes)
+    t_matrix_ch = time.perf_counter() - t0
+    return {
+        "pairs": n_pairs,
+        "dijkstra_ms": round(1000 * t_dijkstra / n_pairs, 3),
+        "ch_ms": round(1000 * t_ch / n_pairs, 3),
+        "speedup": round(t_dijkstra / t_ch, 1),
+        "mismatches": mismatches,
+        "matrix_size": matrix_size,
+        "matrix_dijkstra_ms": round(1000 * t_matrix_dijkstra, 2),
+        "matrix_ch_ms": round(1000 * t_matrix_ch, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jerarquías de contracción del grafo de ruteo.")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("--weight", default="length", choices=["length", "travel_time"])
+    parser.add_argument("--feria", action="store_true", help="índice del perfil de jueves (cierres por ferias)")
+    parser.add_argument("--buffer", type=float, default=500, help="buffer de ferias en metros (FERIA_BUFFER_M)")
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--matrix", type=int, default=12)
+    args = parser.parse_args()
+    graph, profile, snapshot_dir = _load_graph(args.feria, args.buffer)
+    if args.command == "build":
+        build_and_save_ch(graph, snapshot_dir, args.weight, profile)
+        return
+    ch = load_ch(graph, snapshot_dir, args.weight, profile)
+    if ch is None:
+        raise SystemExit("No hay índice CH para este grafo: ejecute primero 'build'")
+    for key, value in benchmark(graph, ch, args.pairs, args.matrix).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+directorios.py
+
+- Escritura de índices en disco (snapshot, CH, ALT) segura entre workers: cada
+  proceso escribe en su propio directorio temporal junto al destino y recién
+  al final lo publica con rename.
+- Si dos workers construyen el mismo índice a la vez, ninguno pisa archivos
+  que el otro está escribiendo; si el rename final choca con el directorio que
+  otro acaba de publicar (equivalente), el propio se descarta.
+"""
+
+import os
+import shutil
+import tempfile
+
+
+def temp_dir_for(out_dir):
+    """Directorio temporal único (por proceso y llamada) en el mismo sistema de archivos que out_dir."""
+    parent, name = os.path.split(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(dir=parent, prefix=f"{name}.tmp-")
+
+
+def publish_dir(tmp_dir, out_dir):
+    """Reemplaza out_dir por tmp_dir (quien ya tenga abiertos por mmap los archivos viejos los sigue leyendo)."""
+    old_dir = f"{out_dir}.old-{os.getpid()}"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    try:
+        os.rename(out_dir, old_dir)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rename(tmp_dir, out_dir)
+    except OSError:
+        # Otro proceso publicó entre los dos rename
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
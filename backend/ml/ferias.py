@@ -0,0 +1,78 @@
+"""
+ferias.py
+
+- Cierres por ferias como máscara booleana sobre los arcos del grafo de ruteo,
+  en lugar de una segunda copia del grafo.
+- Un arco se cierra si su punto medio cae dentro del buffer de alguna feria
+  (consulta STRtree contra los buffers de FERIA_POINTS).
+- La máscara se guarda junto al snapshot, identificada por la huella de
+  (snapshot, puntos, buffer), y se carga memory-mapped.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from ml.snap import project_local
+
+FERIA_PROFILE = "feria"
+THURSDAY = 3
+
+
+def feria_fingerprint(feria_points, buffer_m, graph_meta=None):
+    """Huella de las entradas de la máscara (cambia si cambian puntos, buffer o grafo)."""
+    payload = {
+        "points": [[float(lat), float(lon)] for lat, lon in feria_points],
+        "buffer_m": float(buffer_m),
+        "graph": (graph_meta or {}).get("source_checksum"),
+        "graph_created": (graph_meta or {}).get("created"),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def feria_edge_mask(graph, feria_points, buffer_m=500):
+    """Máscara bool (n_arcs): True si el punto medio del arco cae en el buffer de una feria."""
+    lat0, lon0 = float(np.mean(graph.y)), float(np.mean(graph.x))
+    xy = project_local(graph.y, graph.x, lat0, lon0)
+    mid = (xy[graph.tails] + xy[graph.heads]) / 2.0
+    centers = project_local([p[0] for p in feria_points], [p[1] for p in feria_points], lat0, lon0)
+    tree = STRtree(shapely.buffer(shapely.points(centers), buffer_m))
+    arc_idx, _ = tree.query(shapely.points(mid), predicate="within")
+    mask = np.zeros(graph.n_arcs, dtype=bool)
+    mask[arc_idx] = True
+    return mask
+
+
+def load_feria_mask(graph, feria_points, buffer_m=500, snapshot_dir=None):
+    """
+    Máscara de ferias desde el directorio del snapshot (mmap) o calculada y guardada
+    si no existe para esta huella. Sin snapshot_dir solo se calcula.
+    """
+    if snapshot_dir is None:
+        return feria_edge_mask(graph, feria_points, buffer_m)
+    fp = feria_fingerprint(feria_points, buffer_m, graph.meta)
+    path = os.path.join(snapshot_dir, f"feria_mask_{fp}.npy")
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+    mask = feria_edge_mask(graph, feria_points, buffer_m)
+    tmp = None
+    try:
+        # Temporal propio de este proceso: dos workers pueden calcularla a la vez
+        fd, tmp = tempfile.mkstemp(dir=snapshot_dir, prefix=f"feria_mask_{fp}.", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, mask)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"No se pudo guardar la máscara de ferias: {e}")
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+    return mask
+
+
+def day_profile(is_thursday):
+    """Perfil de ruteo para el día: cierres de feria los jueves, red normal el resto."""
+    return FERIA_PROFILE if is_thursday else None
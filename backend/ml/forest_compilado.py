@@ -0,0 +1,270 @@
+"""
+forest_compilado.py
+
+- Exporta el RandomForestRegressor entrenado a arreglos NumPy empaquetados
+  (feature, threshold, hijos izquierdo/derecho, valor de hoja) de todos los árboles.
+- Predicción vectorizada: todas las filas recorren todos los árboles a la vez,
+  un nivel por iteración (las hojas apuntan a sí mismas).
+- Umbrales en float64 o float32 (redondeados hacia abajo: mismas decisiones
+  que sklearn, que compara X en float32).
+- Valores faltantes (NaN) como sklearn: cada nodo manda el NaN al hijo de
+  missing_go_to_left. Si la versión de sklearn no los admite en predict, el
+  bosque compilado los rechaza igual (ValueError); infinitos, siempre.
+- La exportación verifica paridad contra model.predict antes de guardar.
+
+Uso: python -m ml.forest_compilado [--model RUTA.pkl] [--out RUTA.npz] [--float32]
+     python -m ml.forest_compilado --check   (solo verifica el .npz guardado)
+Sale con código 1 si falla la paridad.
+"""
+
+import argparse
+import os
+import sys
+import numpy as np
+
+COMPILED_VERSION = 1
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPILED_MODEL_PATH = os.path.join(ML_DIR, "model_rf.npz")
+PREDICT_CHUNK_ROWS = 256
+MISSING_CHECK_ROWS = 1000
+PARITY_RTOL = {np.dtype(np.float64): 1e-9, np.dtype(np.float32): 1e-5}
+
+
+class CompiledForest:
+    """
+    Bosque compilado. Los nodos de todos los árboles van en arreglos planos;
+    roots[i] es el índice del nodo raíz del árbol i.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth, n_features,
+                 feature_names=None, missing_left=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.missing_left = missing_left  # bool por nodo: NaN va a la izquierda; None = NaN no admitido
+        self.max_depth = int(max_depth)
+        self.feature_names_in_ = None if feature_names is None else np.asarray(feature_names, dtype=object)
+        self.n_features_in_ = int(n_features)
+        # Hijos intercalados: _children[2 * nodo + va_a_la_izquierda]
+        self._children = np.stack([right, left], axis=1).ravel()
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @property
+    def dtype(self):
+        return self.threshold.dtype
+
+    @property
+    def nbytes(self):
+        arrays = (self.feature, self.threshold, self.left, self.right, self.value, self.roots, self.missing_left)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def predict(self, X):
+        """Predicción (N,) para X (N, n_features) en array o DataFrame."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        nan = np.isnan(X)
+        if np.isinf(X).any():
+            raise ValueError("X contiene valores infinitos")
+        if self.missing_left is None and nan.any():
+            raise ValueError("X contiene NaN y el modelo no admite valores faltantes")
+        out = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), PREDICT_CHUNK_ROWS):
+            chunk = slice(start, start + PREDICT_CHUNK_ROWS)
+            out[chunk] = self._predict_chunk(X[chunk], nan[chunk].any())
+        return out
+
+    def _predict_chunk(self, X, has_nan=False):
+        flat_x = X.ravel()
+        row_offset = (np.arange(len(X)) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            x = np.take(flat_x, row_offset + np.take(self.feature, node))
+            go_left = x <= np.take(self.threshold, node)
+            if has_nan:
+                go_left |= np.isnan(x) & np.take(self.missing_left, node)
+            node = np.take(self._children, 2 * node + go_left)
+        return np.take(self.value, node).astype(np.float64).mean(axis=1)
+
+
+def _float32_floor(threshold):
+    """Mayor float32 <= threshold: x32 <= t32 equivale a x32 <= t (float64)."""
+    t32 = threshold.astype(np.float32)
+    above = t32.astype(np.float64) > threshold
+    t32[above] = np.nextafter(t32[above], np.float32(-np.inf))
+    return t32
+
+
+def supports_missing(model):
+    """True si model.predict acepta NaN (sklearn >= 1.4 con árboles que guardan missing_go_to_left)."""
+    if not hasattr(model.estimators_[0].tree_, "missing_go_to_left"):
+        return False
+    X = np.full((1, model.n_features_in_), np.nan)
+    names = getattr(model, "feature_names_in_", None)
+    if names is not None:
+        import pandas as pd
+        X = pd.DataFrame(X, columns=names)
+    try:
+        model.predict(X)
+    except ValueError:
+        return False
+    return True
+
+
+def compile_forest(model, dtype=np.float64):
+    """RandomForestRegressor (una salida) ajustado -> CompiledForest."""
+    dtype = np.dtype(dtype)
+    with_missing = supports_missing(model)
+    features, thresholds, lefts, rights, values, roots, missing = [], [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for est in model.estimators_:
+        tree = est.tree_
+        n = tree.node_count
+        ids = np.arange(n, dtype=np.int32)
+        leaf = tree.children_left == -1
+        # Hojas: feature 0, umbral +inf y ambos hijos a sí mismas (recorrido de largo fijo)
+        features.append(np.where(leaf, 0, tree.feature))
+        thresholds.append(np.where(leaf, np.inf, tree.threshold))
+        lefts.append(np.where(leaf, ids, tree.children_left) + offset)
+        rights.append(np.where(leaf, ids, tree.children_right) + offset)
+        values.append(tree.value[:, 0, 0])
+        if with_missing:
+            missing.append(~leaf & (np.asarray(tree.missing_go_to_left) != 0))
+        roots.append(offset)
+        offset += n
+        max_depth = max(max_depth, tree.max_depth)
+
+    threshold = np.concatenate(thresholds)
+    threshold = _float32_floor(threshold) if dtype == np.float32 else threshold.astype(np.float64)
+    index_dtype = np.int32 if offset < 2 ** 31 else np.int64
+    return CompiledForest(
+        feature=np.concatenate(features).astype(np.int16 if model.n_features_in_ < 2 ** 15 else np.int32),
+        threshold=threshold,
+        left=np.concatenate(lefts).astype(index_dtype),
+        right=np.concatenate(rights).astype(index_dtype),
+        value=np.concatenate(values).astype(dtype),
+        roots=np.asarray(roots, dtype=index_dtype),
+        max_depth=max_depth,
+        n_features=model.n_features_in_,
+        feature_names=getattr(model, "feature_names_in_", None),
+        missing_left=np.concatenate(missing) if with_missing else None,
+    )
+
+
+def check_parity(model, compiled, X):
+    """Máxima diferencia relativa entre model.predict y compiled.predict; ValueError si excede la tolerancia."""
+    expected = model.predict(X)
+    got = compiled.predict(X)
+    rel = np.abs(got - expected) / np.maximum(np.abs(expected), 1e-12)
+    max_rel = float(rel.max()) if len(rel) else 0.0
+    if max_rel > PARITY_RTOL[compiled.dtype]:
+        raise ValueError(f"Bosque compilado difiere de sklearn: error relativo máximo {max_rel:.3g}")
+    return max_rel
+
+
+def parity_rows(model, n_rows=10000, seed=0):
+    """
+    Filas de prueba para la paridad: por feature, umbrales reales del bosque (la
+    mitad exactos, la mitad con ruido) para ejercitar ambos lados de cada corte.
+    Si el modelo admite NaN, la primera fila es toda NaN y ~2% de las celdas también.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.zeros((n_rows, model.n_features_in_))
+    for f in range(model.n_features_in_):
+        pool = np.concatenate([est.tree_.threshold[est.tree_.feature == f] for est in model.estimators_])
+        pool = pool[np.isfinite(pool)]  # corte "solo NaN" de sklearn: umbral inf
+        if len(pool) == 0:
+            continue
+        col = rng.choice(pool, size=n_rows)
+        noisy = rng.random(n_rows) < 0.5
+        col[noisy] += rng.normal(scale=np.abs(col[noisy]) * 1e-3 + 1e-6)
+        X[:, f] = col
+    if supports_missing(model):
+        X[rng.random(X.shape) < 0.02] = np.nan
+        X[0] = np.nan
+    names = getattr(model, "feature_names_in_", None)
+    if names is not None:
+        import pandas as pd
+        return pd.DataFrame(X, columns=names)
+    return X
+
+
+def save_compiled(compiled, path=COMPILED_MODEL_PATH):
+    """Guarda el bosque compilado en un .npz (escritura atómica)."""
+    tmp = path + ".tmp.npz"
+    names = compiled.feature_names_in_ if compiled.feature_names_in_ is not None else []
+    extra = {} if compiled.missing_left is None else {"missing_left": compiled.missing_left}
+    np.savez(tmp, version=COMPILED_VERSION, feature=compiled.feature, threshold=compiled.threshold,
+             left=compiled.left, right=compiled.right, value=compiled.value, roots=compiled.roots,
+             max_depth=compiled.max_depth, n_features=compiled.n_features_in_,
+             feature_names=np.asarray(names, dtype=str), **extra)
+    os.replace(tmp, path)
+
+
+def load_compiled(path=COMPILED_MODEL_PATH):
+    """Carga un bosque compilado (ValueError si es de otra versión del formato)."""
+    with np.load(path) as data:
+        if int(data["version"]) != COMPILED_VERSION:
+            raise ValueError(f"Versión de bosque compilado {int(data['version'])} != {COMPILED_VERSION}")
+        names = data["feature_names"].tolist()
+        return CompiledForest(
+            feature=data["feature"], threshold=data["threshold"], left=data["left"],
+            right=data["right"], value=data["value"], roots=data["roots"],
+            max_depth=int(data["max_depth"]), n_features=int(data["n_features"]),
+            feature_names=names or None,
+            # .npz anteriores sin missing_left: rechazan NaN
+            missing_left=data["missing_left"] if "missing_left" in data.files else None,
+        )
+
+
+def export_compiled_model(model, X_check, path=COMPILED_MODEL_PATH, dtype=np.float64):
+    """
+    Compila el modelo, verifica paridad sobre X_check (y sobre filas con NaN si
+    el modelo los admite) y lo guarda. Devuelve el CompiledForest.
+    """
+    compiled = compile_forest(model, dtype=dtype)
+    max_rel = check_parity(model, compiled, X_check)
+    if compiled.missing_left is not None:
+        # X_check (p. ej. el set de entrenamiento) puede no traer NaN
+        max_rel = max(max_rel, check_parity(model, compiled, parity_rows(model, MISSING_CHECK_ROWS)))
+    save_compiled(compiled, path)
+    print(f"Bosque compilado guardado en: {path} ({compiled.nbytes / 1e6:.1f} MB, "
+          f"error relativo máximo {max_rel:.2g})")
+    return compiled
+
+
+def main():
+    import joblib
+    from ml.ruta_modelo import MODEL_PATH
+    parser = argparse.ArgumentParser(description="Compila el RandomForest entrenado a arreglos NumPy.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--out", default=COMPILED_MODEL_PATH)
+    parser.add_argument("--float32", action="store_true", help="umbrales y hojas en float32")
+    parser.add_argument("--check-rows", type=int, default=10000, help="filas aleatorias para la paridad")
+    parser.add_argument("--check", action="store_true",
+                        help="no exporta: verifica la paridad del .npz de --out contra --model")
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    X_check = parity_rows(model, args.check_rows)
+    try:
+        if args.check:
+            compiled = load_compiled(args.out)
+            max_rel = check_parity(model, compiled, X_check)
+            print(f"Paridad OK: {args.out} ({compiled.dtype}), error relativo máximo {max_rel:.2g}")
+        else:
+            export_compiled_model(model, X_check, args.out, np.float32 if args.float32 else np.float64)
+    except ValueError as e:
+        print(f"Paridad fallida: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
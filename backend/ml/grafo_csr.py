@@ -0,0 +1,523 @@
+"""
+grafo_csr.py
+
+- Grafo de ruteo compacto construido una sola vez a partir del MultiDiGraph de osmnx.
+- Nodos renumerados a enteros contiguos (ordenados por osmid).
+- Aristas en arreglos CSR de NumPy (length, travel_time); las aristas paralelas
+  se colapsan de antemano a la de menor peso.
+- Dijkstra con heap sobre esos arreglos (mismo resultado que shortest_route_stats).
+- Matrices many-to-many (distancia y tiempo) con una búsqueda por origen.
+- Perfiles de ruteo (p. ej. cierres por feria) como máscaras sobre los mismos arcos.
+- Búsqueda dependiente del tiempo (hora de salida) con SpeedProfiles.
+- Caché opcional de pares ya calculados entre matrices (ver ml/cache_pares.py).
+- Si hay jerarquía de contracción para el peso y perfil (ver ml/contraccion.py),
+  las búsquedas sin hora de salida la usan en lugar de Dijkstra.
+- Búsqueda dirigida A* con cota haversine o ALT con landmarks
+  (ver ml/busqueda_dirigida.py).
+"""
+
+import heapq
+import numpy as np
+
+from ml.busqueda_dirigida import GeoBound, geo_factor
+from ml.contraccion import CH_ARRAYS
+from ml.velocidades import highway_classes
+
+
+class CSRGraph:
+    """
+    Grafo dirigido en formato CSR.
+
+    Para cada nodo i, sus arcos salientes son indptr[i]:indptr[i+1]; heads/tails
+    guardan los nodos destino/origen de cada arco. Por cada peso se guarda el par
+    (length, travel_time) de la arista paralela elegida con ese peso, igual que
+    hace shortest_route_stats al recorrer G[u][v].
+    """
+
+    def __init__(self, node_ids, y, x, indptr, heads, tails, arcs, edge_attrs=None, meta=None):
+        self.node_ids = node_ids        # int64, osmid ordenado (posición = índice interno)
+        self.y = y                      # lat
+        self.x = x                      # lon
+        self.indptr = indptr            # int64 (n+1)
+        self.heads = heads              # int32 (m)
+        self.tails = tails              # int32 (m)
+        self.arcs = arcs                # {weight: (length, travel_time)}
+        self.edge_attrs = edge_attrs or {}  # speed_kph (float32), highway_class / highway_class_tt (uint8) por arco
+        self.meta = meta or {}          # cabecera del snapshot (ver ml/snapshot.py)
+        self.masks = {}                 # perfil -> bool por arco (arcos afectados)
+        self.profiles = {}              # perfil -> {weight: pesos con cierres/penalización}
+        self.speed_profiles = None      # SpeedProfiles (ver ml/perfiles_velocidad.py)
+        self.contractions = {}          # (weight, perfil) -> ContractionHierarchy
+        self.landmarks = {}             # weight -> LandmarkIndex (ALT)
+        self._geo_factors = {}          # weight -> k de la cota haversine
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_arcs(self):
+        return len(self.heads)
+
+    @property
+    def version(self):
+        """Versión del grafo: checksum de origen y fecha del snapshot (o la identidad del objeto)."""
+        if self.meta:
+            return self.meta.get("source_checksum"), self.meta.get("created")
+        return id(self)
+
+    def memory_footprint(self):
+        """
+        Bytes de los arreglos del grafo: 'shared' los memory-mapped desde el snapshot
+        (page cache compartida entre workers) y 'private' los que viven en este proceso.
+        """
+        arrays = [self.node_ids, self.y, self.x, self.indptr, self.heads, self.tails]
+        arrays += [arr for values in self.arcs.values() for arr in values]
+        arrays += list(self.edge_attrs.values())
+        arrays += list(self.masks.values())
+        arrays += [arr for weights in self.profiles.values() for arr in weights.values()]
+        arrays += [getattr(ch, name) for ch in self.contractions.values() for name in CH_ARRAYS]
+        arrays += [arr for lm in self.landmarks.values() for arr in (lm.from_l, lm.to_l)]
+        shared = sum(a.nbytes for a in arrays if isinstance(a, np.memmap))
+        private = sum(a.nbytes for a in arrays if not isinstance(a, np.memmap))
+        return {"shared": int(shared), "private": int(private)}
+
+    # --------------------------
+    # NODOS
+    # --------------------------
+
+    def node_index(self, osmid):
+        """Índice interno de un osmid (KeyError si no existe)."""
+        i = int(np.searchsorted(self.node_ids, osmid))
+        if i >= len(self.node_ids) or self.node_ids[i] != osmid:
+            raise KeyError(osmid)
+        return i
+
+    def coords(self, path):
+        """Lista [[lat, lon], ...] para una ruta de osmids."""
+        idx = [self.node_index(n) for n in path]
+        return [[float(self.y[i]), float(self.x[i])] for i in idx]
+
+    # --------------------------
+    # BÚSQUEDA
+    # --------------------------
+
+    def add_closure_profile(self, name, mask, penalty=None):
+        """
+        Registra un perfil de ruteo sobre los mismos arcos, sin copiar el grafo:
+        los arcos en `mask` quedan cerrados (peso inf) o, con `penalty`, con su
+        peso multiplicado por ese factor.
+        """
+        mask = np.asanyarray(mask, dtype=bool)
+        if len(mask) != self.n_arcs:
+            raise ValueError(f"La máscara tiene {len(mask)} arcos, el grafo {self.n_arcs}")
+        weights = {}
+        for weight in self.arcs:
+            base = self.weight_array(weight)
+            weights[weight] = np.where(mask, np.inf if penalty is None else base * float(penalty), base)
+        self.masks[name] = mask
+        self.profiles[name] = weights
+
+    def add_contraction(self, ch):
+        """Registra un índice CH; se usa para su (peso, perfil) en búsquedas sin hora de salida."""
+        if ch.n_arcs != self.n_arcs:
+            raise ValueError(f"El índice CH tiene {ch.n_arcs} arcos, el grafo {self.n_arcs}")
+        self.contractions[(ch.weight, ch.profile)] = ch
+
+    def add_landmarks(self, index):
+        """Registra tablas ALT para su peso (válidas también con perfiles de cierres)."""
+        if len(index.from_l) != self.n_nodes:
+            raise ValueError(f"Las tablas ALT tienen {len(index.from_l)} nodos, el grafo {self.n_nodes}")
+        self.landmarks[index.weight] = index
+
+    def weight_array(self, weight="length", profile=None):
+        """Arreglo de pesos por arco para 'length' o 'travel_time' (opcionalmente de un perfil)."""
+        if weight not in self.arcs:
+            raise ValueError(f"Peso no soportado: {weight}")
+        if profile is not None:
+            if profile not in self.profiles:
+                raise ValueError(f"Perfil de ruteo no registrado: {profile}")
+            return self.profiles[profile][weight]
+        length, travel_time = self.arcs[weight]
+        return length if weight == "length" else travel_time
+
+    def dijkstra(self, source, weight="length", targets=None, profile=None):
+        """
+        Dijkstra desde el índice interno `source`.
+        Si se pasan `targets` (índices), se detiene cuando todos están asentados.
+        Retorna (dist, pred): dict nodo -> costo y dict nodo -> arco de llegada.
+        """
+        w = self.weight_array(weight, profile)
+        indptr, heads = self.indptr, self.heads
+        dist = {source: 0.0}
+        pred = {source: -1}
+        settled = set()
+        remaining = set(targets) if targets is not None else None
+        if remaining is not None:
+            remaining.discard(source)
+            if not remaining:
+                return dist, pred
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if remaining is not None:
+                remaining.discard(u)
+                if not remaining:
+                    break
+            start, end = int(indptr[u]), int(indptr[u + 1])
+            for a, v, wa in zip(range(start, end), heads[start:end].tolist(), w[start:end].tolist()):
+                nd = d + wa
+                if nd < dist.get(v, float("inf")):
+                    dist[v] = nd
+                    pred[v] = a
+                    heapq.heappush(heap, (nd, v))
+        return dist, pred
+
+    def astar(self, source, target, bound, weight="length", profile=None):
+        """
+        A* desde `source` hasta `target` con bound(v), cota inferior admisible del
+        costo de v a target (inf si target no es alcanzable desde v).
+        Retorna (dist, pred) como dijkstra.
+        """
+        w = self.weight_array(weight, profile)
+        indptr, heads = self.indptr, self.heads
+        inf = float("inf")
+        dist = {source: 0.0}
+        pred = {source: -1}
+        heap = [(bound(source), 0.0, source)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u == target:
+                break
+            start, end = int(indptr[u]), int(indptr[u + 1])
+            for a, v, wa in zip(range(start, end), heads[start:end].tolist(), w[start:end].tolist()):
+                nd = d + wa
+                if nd < dist.get(v, inf):
+                    h = bound(v)
+                    if h == inf:
+                        continue
+                    dist[v] = nd
+                    pred[v] = a
+                    heapq.heappush(heap, (nd + h, nd, v))
+        return dist, pred
+
+    def search_arcs(self, source, target, weight="length", profile=None, method=None):
+        """
+        Arcos del camino mínimo entre índices internos (None si no hay ruta) y nodos
+        alcanzados por la búsqueda (None con CH). method: 'ch', 'alt', 'astar' o
+        'dijkstra'; por defecto el mejor disponible (CH, luego ALT, luego Dijkstra).
+        """
+        if method is None:
+            if (weight, profile) in self.contractions:
+                method = "ch"
+            elif weight in self.landmarks:
+                method = "alt"
+            else:
+                method = "dijkstra"
+        if method == "ch":
+            return self.contractions[(weight, profile)].path_arcs(source, target), None
+        if method == "alt":
+            bound = self.landmarks[weight].bound(target, source)
+        elif method == "astar":
+            if weight not in self._geo_factors:
+                self._geo_factors[weight] = geo_factor(self, weight)
+            bound = GeoBound(self, target, self._geo_factors[weight])
+        elif method == "dijkstra":
+            _, pred = self.dijkstra(source, weight=weight, targets=[target], profile=profile)
+            return self.path_arcs(pred, target), len(pred)
+        else:
+            raise ValueError(f"Método de búsqueda no soportado: {method}")
+        _, pred = self.astar(source, target, bound, weight=weight, profile=profile)
+        return self.path_arcs(pred, target), len(pred)
+
+    def dijkstra_td(self, source, departure, targets=None, profile=None):
+        """
+        Dijkstra dependiente del tiempo sobre travel_time: el costo de cada arco se
+        evalúa con el factor de velocidad del instante en que se entra al arco.
+        departure: segundos desde el lunes 00:00. Retorna (llegada relativa, pred).
+        """
+        speeds = self.speed_profiles
+        if speeds is None:
+            raise ValueError("El grafo no tiene perfiles de velocidad")
+        w = self.weight_array("travel_time", profile)
+        indptr, heads = self.indptr, self.heads
+        arc_class, feria_zone = speeds.arc_class, speeds.feria_zone
+        dist = {source: 0.0}
+        pred = {source: -1}
+        settled = set()
+        remaining = set(targets) if targets is not None else None
+        if remaining is not None:
+            remaining.discard(source)
+            if not remaining:
+                return dist, pred
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if remaining is not None:
+                remaining.discard(u)
+                if not remaining:
+                    break
+            factors, feria = speeds.at(departure + d)
+            start, end = int(indptr[u]), int(indptr[u + 1])
+            for a, v, wa, c, z in zip(range(start, end), heads[start:end].tolist(), w[start:end].tolist(),
+                                      arc_class[start:end].tolist(), feria_zone[start:end].tolist()):
+                nd = d + wa / (factors[c] * (feria if z else 1.0))
+                if nd < dist.get(v, float("inf")):
+                    dist[v] = nd
+                    pred[v] = a
+                    heapq.heappush(heap, (nd, v))
+        return dist, pred
+
+    def path_arcs(self, pred, target):
+        """Reconstruye la lista de arcos hasta `target` a partir de pred (None si no se alcanzó)."""
+        if target not in pred:
+            return None
+        arcs = []
+        a = pred[target]
+        while a != -1:
+            arcs.append(a)
+            a = pred[int(self.tails[a])]
+        arcs.reverse()
+        return arcs
+
+    def arcs_stats(self, source, arcs, weight="length"):
+        """Convierte una lista de arcos en (path de osmids, dist m, tiempo s)."""
+        length, travel_time = self.arcs[weight]
+        path = [int(self.node_ids[source])]
+        dist = 0.0
+        tsec = 0.0
+        for a in arcs:
+            path.append(int(self.node_ids[self.heads[a]]))
+            dist += float(length[a])
+            tsec += float(travel_time[a])
+        return path, float(dist), float(tsec)
+
+    def arcs_stats_td(self, source, arcs, departure):
+        """Como arcs_stats, pero el tiempo se acumula con los factores de cada instante."""
+        speeds = self.speed_profiles
+        length, travel_time = self.arcs["travel_time"]
+        path = [int(self.node_ids[source])]
+        dist = 0.0
+        tsec = 0.0
+        for a in arcs:
+            factors, feria = speeds.at(departure + tsec)
+            path.append(int(self.node_ids[self.heads[a]]))
+            dist += float(length[a])
+            tsec += float(travel_time[a]) / (factors[int(speeds.arc_class[a])] * (feria if speeds.feria_zone[a] else 1.0))
+        return path, float(dist), float(tsec)
+
+    def shortest_path(self, orig_node, dest_node, weight="length", profile=None, departure=None, method=None):
+        """
+        Equivalente a shortest_route_stats: retorna path (osmids), dist (m), t (seg).
+        Con departure (segundos desde el lunes 00:00) la ruta minimiza el tiempo
+        dependiente de la hora (weight y method se ignoran). method: ver search_arcs.
+        """
+        try:
+            s = self.node_index(orig_node)
+            t = self.node_index(dest_node)
+        except KeyError:
+            return None, np.nan, np.nan
+        if departure is None:
+            arcs, _ = self.search_arcs(s, t, weight=weight, profile=profile, method=method)
+        else:
+            arcs = self.path_arcs(self.dijkstra_td(s, departure, targets=[t], profile=profile)[1], t)
+        if arcs is None:
+            return None, np.nan, np.nan
+        if departure is not None:
+            return self.arcs_stats_td(s, arcs, departure)
+        return self.arcs_stats(s, arcs, weight=weight)
+
+    def route_matrix(self, sources, targets=None, weight="length", profile=None, departure=None, cache=None):
+        """
+        Matrices de distancia y tiempo entre osmids: una búsqueda por origen que se
+        detiene al asentar todos los destinos. Pares sin ruta quedan en inf.
+        Con departure, todas las búsquedas salen a esa hora (dependientes del tiempo).
+        Con cache (PairDistanceCache, solo sin departure) se buscan únicamente los
+        pares que falten y los nuevos se guardan; los valores quedan en float32.
+        """
+        targets = sources if targets is None else targets
+        src_idx = [self.node_index(n) for n in sources]
+        dst_idx = [self.node_index(n) for n in targets]
+        if cache is not None and departure is None:
+            dist, tsec, missing = cache.lookup(self.version, profile, weight, src_idx, dst_idx)
+        else:
+            cache = None
+            dist = np.full((len(src_idx), len(dst_idx)), np.inf)
+            tsec = np.full((len(src_idx), len(dst_idx)), np.inf)
+            missing = np.ones((len(src_idx), len(dst_idx)), dtype=bool)
+        trees = []
+        result = RouteMatrix(self, src_idx, dst_idx, dist, tsec, trees, weight, departure, profile,
+                             cached=~missing)
+        ch = self.contractions.get((weight, profile)) if departure is None else None
+        if ch is not None and missing.any():
+            # Buckets many-to-many; los caminos se desarman desde el resultado
+            result.ch_paths = ch.many_to_many(src_idx, dst_idx)
+        found = []
+        for i, s in enumerate(src_idx):
+            cols = np.flatnonzero(missing[i])
+            if not len(cols):
+                trees.append(None)  # todo cacheado: los tramos se buscan punto a punto
+                continue
+            wanted = [dst_idx[j] for j in cols]
+            if result.ch_paths is not None:
+                pred = None
+            elif departure is None:
+                _, pred = self.dijkstra(s, weight=weight, targets=wanted, profile=profile)
+            else:
+                _, pred = self.dijkstra_td(s, departure, targets=wanted, profile=profile)
+            trees.append(pred)
+            for j in cols.tolist():
+                path, d, t = result.path(i, j)
+                if path is not None:
+                    dist[i, j], tsec[i, j] = d, t
+                found.append((s, dst_idx[j], dist[i, j], tsec[i, j]))
+        if cache is not None:
+            # Mismo redondeo para lo recién calculado que para lo leído de la caché
+            dist[missing] = dist[missing].astype(np.float32)
+            tsec[missing] = tsec[missing].astype(np.float32)
+            cache.store(self.version, profile, weight, [pair for pair in found if pair[0] != pair[1]])
+        return result
+
+
+class RouteMatrix:
+    """
+    Resultado de CSRGraph.route_matrix: matrices dist (m) y time (s) y los árboles
+    de predecesores de cada origen, para reconstruir segmentos sin nuevas búsquedas.
+    """
+
+    def __init__(self, graph, src_idx, dst_idx, dist, time, trees, weight, departure=None, profile=None,
+                 cached=None):
+        self.graph = graph
+        self.src_idx = src_idx
+        self.dst_idx = dst_idx
+        self.dist = dist
+        self.time = time
+        self.trees = trees
+        self.weight = weight
+        self.departure = departure
+        self.profile = profile
+        self.cached = cached            # bool (i, j): el par vino de la caché, sin árbol
+        self.ch_paths = None            # CHMatrix si la matriz salió de la jerarquía de contracción
+        self.cached_arcs = {}           # (i, j) cacheado -> arcos, ver prepare_paths
+
+    def prepare_paths(self, pairs):
+        """
+        Arcos de los pares (i, j) que vinieron de la caché, todos en una pasada:
+        many-to-many de CH sobre esos orígenes y destinos, o una búsqueda por origen
+        que se detiene en sus destinos pedidos. Llamar con los tramos del tour antes
+        de path() evita una búsqueda punto a punto por tramo.
+        """
+        if self.cached is None:
+            return
+        todo = sorted({(int(i), int(j)) for i, j in pairs
+                       if self.cached[i, j] and (int(i), int(j)) not in self.cached_arcs})
+        if not todo:
+            return
+        rows = sorted({i for i, _ in todo})
+        cols = sorted({j for _, j in todo})
+        ch = self.graph.contractions.get((self.weight, self.profile)) if self.departure is None else None
+        if ch is not None:
+            m = ch.many_to_many([self.src_idx[i] for i in rows], [self.dst_idx[j] for j in cols])
+            for i, j in todo:
+                self.cached_arcs[i, j] = m.path_arcs(rows.index(i), cols.index(j))
+            return
+        for i in rows:
+            wanted = [j for r, j in todo if r == i]
+            targets = [self.dst_idx[j] for j in wanted]
+            if self.departure is None:
+                _, pred = self.graph.dijkstra(self.src_idx[i], weight=self.weight, targets=targets,
+                                              profile=self.profile)
+            else:
+                _, pred = self.graph.dijkstra_td(self.src_idx[i], self.departure, targets=targets,
+                                                 profile=self.profile)
+            for j, t in zip(wanted, targets):
+                self.cached_arcs[i, j] = self.graph.path_arcs(pred, t)
+
+    def path(self, i, j):
+        """Segmento origen i -> destino j: (path de osmids, dist m, tiempo s)."""
+        s, t = self.src_idx[i], self.dst_idx[j]
+        if self.cached is not None and self.cached[i, j]:
+            # Par que vino de la caché: sin árbol propio, arcos de prepare_paths
+            if (i, j) not in self.cached_arcs:
+                self.prepare_paths([(i, j)])
+            arcs = self.cached_arcs[i, j]
+        elif self.ch_paths is not None:
+            arcs = self.ch_paths.path_arcs(i, j)
+        else:
+            arcs = self.graph.path_arcs(self.trees[i], t)
+        if arcs is None:
+            return None, np.nan, np.nan
+        if self.departure is not None:
+            return self.graph.arcs_stats_td(s, arcs, self.departure)
+        return self.graph.arcs_stats(s, arcs, weight=self.weight)
+
+
+# --------------------------
+# CONSTRUCCIÓN
+# --------------------------
+
+def _collapse_parallel(u, v, order_weight):
+    """
+    Índices (en el arreglo de aristas) de la arista ganadora para cada par (u, v):
+    menor peso y, en empate, la primera en el orden original (como shortest_route_stats).
+    """
+    pos = np.arange(len(u))
+    order = np.lexsort((pos, order_weight, v, u))
+    us, vs = u[order], v[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (us[1:] != us[:-1]) | (vs[1:] != vs[:-1])
+    return order[first]
+
+
+def build_csr_graph(G):
+    """Construye un CSRGraph desde un MultiDiGraph con length y travel_time (ver ensure_edge_speeds)."""
+    node_ids = np.array(sorted(G.nodes), dtype=np.int64)
+    y = np.array([G.nodes[n]["y"] for n in node_ids.tolist()], dtype=np.float64)
+    x = np.array([G.nodes[n]["x"] for n in node_ids.tolist()], dtype=np.float64)
+
+    m = G.number_of_edges()
+    u = np.empty(m, dtype=np.int64)
+    v = np.empty(m, dtype=np.int64)
+    length = np.empty(m, dtype=np.float64)
+    travel_time = np.empty(m, dtype=np.float64)
+    speed_kph = np.empty(m, dtype=np.float32)
+    highway = []
+    for i, (a, b, data) in enumerate(G.edges(data=True)):
+        u[i] = a
+        v[i] = b
+        length[i] = data.get("length", np.inf)
+        travel_time[i] = data.get("travel_time", np.inf)
+        speed_kph[i] = data.get("speed_kph", np.nan)
+        highway.append(data.get("highway"))
+    u = np.searchsorted(node_ids, u)
+    v = np.searchsorted(node_ids, v)
+
+    # Topología común: un arco por par (u, v), ordenado por u
+    keep = _collapse_parallel(u, v, length)
+    tails = u[keep].astype(np.int32)
+    heads = v[keep].astype(np.int32)
+    indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=len(node_ids)), out=indptr[1:])
+
+    arcs = {"length": (length[keep], travel_time[keep])}
+    # Para travel_time la arista paralela elegida puede ser otra; mismo orden (u, v)
+    keep_tt = _collapse_parallel(u, v, travel_time)
+    arcs["travel_time"] = (length[keep_tt], travel_time[keep_tt])
+
+    # Velocidad ya parseada y tipo de vía de la arista elegida (se guardan en el snapshot);
+    # highway_class_tt es el de la arista elegida para travel_time (perfiles de velocidad)
+    classes = highway_classes(highway)
+    edge_attrs = {
+        "speed_kph": speed_kph[keep],
+        "highway_class": classes[keep],
+        "highway_class_tt": classes[keep_tt],
+    }
+    return CSRGraph(node_ids, y, x, indptr, heads, tails, arcs, edge_attrs=edge_attrs)
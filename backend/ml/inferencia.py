@@ -0,0 +1,101 @@
+"""
+inferencia.py
+
+- Micro-batching de predicciones del modelo de tiempos de ruta.
+- Las solicitudes concurrentes de un worker se juntan durante una ventana corta
+  (o hasta max_batch_rows filas) y se resuelven con un solo model.predict sobre
+  una matriz (N, 3).
+- Con window_ms = 0 se predice directamente en el hilo del request.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+FEATURES = ["dist_m", "base_time_sec", "is_thursday"]
+DEFAULT_WINDOW_MS = 2.0
+DEFAULT_MAX_BATCH_ROWS = 1024
+
+
+def rows_to_matrix(rows):
+    """
+    Lista de dicts con FEATURES -> matriz float64 (N, 3). ValueError si falta un
+    campo o hay un infinito (lo rechazaría el modelo y con él todo el lote).
+    """
+    X = np.empty((len(rows), len(FEATURES)), dtype=np.float64)
+    for i, row in enumerate(rows):
+        if row.get("dist_m") is None or row.get("base_time_sec") is None:
+            raise ValueError(f"Fila {i}: se requieren dist_m y base_time_sec")
+        X[i] = [row["dist_m"], row["base_time_sec"], row.get("is_thursday", 0) or 0]
+        if np.isinf(X[i]).any():
+            raise ValueError(f"Fila {i}: valores infinitos")
+    return X
+
+
+class MicroBatcher:
+    """Agrupa llamadas concurrentes a predict_fn(X) en un hilo de fondo por proceso."""
+
+    def __init__(self, predict_fn, window_ms=DEFAULT_WINDOW_MS, max_batch_rows=DEFAULT_MAX_BATCH_ROWS):
+        self.predict_fn = predict_fn
+        self.window_s = window_ms / 1000.0
+        self.max_batch_rows = max_batch_rows
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self.batches = 0
+        self.rows = 0
+
+    def _ensure_worker(self):
+        # Tras un fork (gunicorn) el hilo del padre no existe: se crea uno por proceso
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, args=(self._queue,), daemon=True,
+                                 name="ml-microbatch").start()
+                self._pid = os.getpid()
+
+    def predict(self, X, timeout=10.0):
+        """Predicción para la matriz X (N, 3); bloquea hasta que su lote se resuelva."""
+        X = np.asarray(X, dtype=np.float64)
+        if self.window_s <= 0:
+            return np.asarray(self.predict_fn(X))
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((X, future))
+        return future.result(timeout=timeout)
+
+    def _run(self, q):
+        while True:
+            batch = [q.get()]
+            n_rows = len(batch[0][0])
+            deadline = time.monotonic() + self.window_s
+            while n_rows < self.max_batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+            self._predict_batch(batch)
+
+    def _predict_batch(self, batch):
+        try:
+            y = np.asarray(self.predict_fn(np.vstack([X for X, _ in batch])))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(y)
+        offset = 0
+        for X, future in batch:
+            future.set_result(y[offset:offset + len(X)])
+            offset += len(X)
@@ -0,0 +1,148 @@
+"""
+jobs.py
+
+- Trabajos de entrenamiento asíncronos: submit_training_job devuelve un id al
+  instante y el pipeline corre en un pool de procesos aparte (spawn), fuera del
+  worker de Flask/gunicorn.
+- El estado de cada trabajo (etapas, tiempos, resultado o error) vive en un JSON
+  en JOBS_DIR, así cualquier worker de gunicorn puede responder /api/jobs/<id>.
+- Un lock de archivo serializa los entrenamientos entre workers: un trabajo
+  queda en "queued" hasta que termine el anterior.
+"""
+
+import datetime
+import fcntl
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from ml.snapshot import ML_DIR
+
+JOBS_DIR = os.path.join(ML_DIR, "artifacts", "jobs")
+TRAIN_LOCK_PATH = os.path.join(JOBS_DIR, "train.lock")
+TERMINAL_STATUSES = ("succeeded", "failed")
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_EXECUTOR = None
+_EXECUTOR_PID = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _now():
+    return datetime.datetime.now().isoformat()
+
+
+def _job_path(job_id):
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _write_job(job):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    path = _job_path(job["id"])
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(job, f, indent=2)
+    os.replace(tmp, path)
+
+
+def read_job(job_id):
+    """Estado del trabajo (dict) o None si el id no existe."""
+    if not _JOB_ID_RE.match(job_id or ""):
+        return None
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _executor():
+    # Un pool por proceso (y recreado tras un fork); spawn no hereda hilos ni conexiones
+    global _EXECUTOR, _EXECUTOR_PID
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+            _EXECUTOR = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            _EXECUTOR_PID = os.getpid()
+        return _EXECUTOR
+
+
+def _run_training_job(job_id, params):
+    """Cuerpo del trabajo en el proceso del pool: espera el lock, corre el pipeline y reporta."""
+    from ml import ruta_modelo
+    job = read_job(job_id)
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    with open(TRAIN_LOCK_PATH, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        job.update(status="running", started=_now())
+        _write_job(job)
+        t0 = time.perf_counter()
+        stage_t0 = {}
+
+        def progress(stage, event):
+            entry = job["stages"].setdefault(stage, {})
+            if event == "started":
+                stage_t0[stage] = time.perf_counter()
+                entry.update(status="running", started=_now())
+            else:
+                entry.update(status="finished", finished=_now(),
+                             seconds=round(time.perf_counter() - stage_t0[stage], 3))
+            job["current_stage"] = stage
+            _write_job(job)
+
+        try:
+            fingerprints = ruta_modelo.main(progress=progress, **params)
+        except Exception as e:
+            job.update(status="failed", error=str(e), traceback=traceback.format_exc())
+            raise
+        else:
+            job.update(status="succeeded", result={"fingerprints": fingerprints})
+            return job["result"]
+        finally:
+            job.update(finished=_now(), seconds=round(time.perf_counter() - t0, 3), current_stage=None)
+            _write_job(job)
+
+
+def submit_training_job(params=None, on_success=None):
+    """
+    Encola un entrenamiento y devuelve el job (dict) sin esperar. on_success(result)
+    se llama en este proceso (hilo del pool) cuando el trabajo termina bien.
+    """
+    job = {
+        "id": uuid.uuid4().hex,
+        "kind": "train-route-model",
+        "status": "queued",
+        "params": params or {},
+        "submitted": _now(),
+        "started": None,
+        "finished": None,
+        "current_stage": None,
+        "stages": {},
+        "result": None,
+        "error": None,
+    }
+    _write_job(job)
+    future = _executor().submit(_run_training_job, job["id"], job["params"])
+
+    def done(fut):
+        exc = fut.exception()
+        if exc is None:
+            if on_success:
+                try:
+                    on_success(fut.result())
+                except Exception as e:
+                    print(f"Error al activar el resultado del trabajo {job['id']}: {e}")
+            return
+        # El proceso pudo morir antes de reportar (p. ej. BrokenProcessPool)
+        current = read_job(job["id"]) or job
+        if current.get("status") not in TERMINAL_STATUSES:
+            current.update(status="failed", error=str(exc), finished=_now())
+            _write_job(current)
+
+    future.add_done_callback(done)
+    return job
@@ -0,0 +1,125 @@
+"""
+log_predicciones.py
+
+- Registro de predicciones en PrediccionML sin tocar la latencia del request.
+- El camino caliente solo agrega (modelo, X, y, fecha) a una cola en memoria;
+  un hilo de fondo arma las filas y las inserta en bloque cada batch_size filas
+  o cada flush_seconds, lo que ocurra primero.
+- Memoria acotada: si la cola llega a max_rows, las predicciones nuevas se
+  descartan y se cuentan (dropped). Al salir el proceso se vacía la cola.
+"""
+
+import atexit
+import collections
+import datetime
+import os
+import threading
+
+from sqlalchemy import insert
+
+from ml.inferencia import FEATURES
+
+DEFAULT_MAX_ROWS = 50000
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_FLUSH_SECONDS = 2.0
+
+
+class PredictionLogger:
+    """Cola acotada de predicciones con escritura en bloque a PrediccionML."""
+
+    def __init__(self, app, db, max_rows=DEFAULT_MAX_ROWS, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS):
+        self.app = app
+        self.db = db
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = collections.deque()
+        self._queued_rows = 0
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def log(self, modelo_id, X, y):
+        """Encola las predicciones y (N,) para X (N, 3). O(1): no arma filas aquí."""
+        n = len(y)
+        self._ensure_started()
+        with self._count_lock:
+            if self._queued_rows + n > self.max_rows:
+                self.dropped += n
+                return
+            self._queued_rows += n
+            self._queue.append((modelo_id, X, y, datetime.datetime.now()))
+            full = self._queued_rows >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _ensure_started(self):
+        # Un hilo por proceso (gunicorn hace fork después de importar la app)
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue.clear()
+                self._queued_rows = 0
+                threading.Thread(target=self._run, daemon=True, name="ml-prediction-log").start()
+                atexit.register(self.flush)
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error registrando predicciones: {e}")
+
+    def _take_rows(self):
+        rows = []
+        while self._queue and len(rows) < self.batch_size:
+            modelo_id, X, y, fecha = self._queue.popleft()
+            with self._count_lock:
+                self._queued_rows -= len(y)
+            for x_row, pred in zip(X.tolist(), y.tolist()):
+                rows.append({
+                    'modelo_id': modelo_id,
+                    'entrada': dict(zip(FEATURES, x_row)),
+                    'resultado': f"{pred:.3f}",
+                    'fecha': fecha,
+                })
+        return rows
+
+    def flush(self):
+        """Inserta en bloque todo lo encolado. Un lote que falla se descarta y se cuenta."""
+        from models import PrediccionML
+        with self._flush_lock:
+            while self._queue:
+                rows = self._take_rows()
+                try:
+                    with self.app.app_context():
+                        self.db.session.execute(insert(PrediccionML), rows)
+                        self.db.session.commit()
+                    self.written += len(rows)
+                    self.flushes += 1
+                except Exception as e:
+                    self.failed += len(rows)
+                    print(f"No se pudieron guardar {len(rows)} predicciones: {e}")
+
+    def stats(self):
+        return {
+            'queued': self._queued_rows,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'max_rows': self.max_rows,
+            'batch_size': self.batch_size,
+            'flush_seconds': self.flush_seconds,
+        }
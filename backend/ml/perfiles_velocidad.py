@@ -0,0 +1,94 @@
+"""
+perfiles_velocidad.py
+
+- Perfiles de velocidad por arco en arreglos compactos para ruteo dependiente del tiempo.
+- Tabla de factores (tipo de vía x 168 buckets día-de-semana x hora), float32.
+- Perfil adicional de día de feria: factor por hora para los arcos de la zona de
+  ferias (alrededor de FERIA_POINTS) el día de feria (jueves).
+- Factor 1.0 = flujo libre (travel_time del snapshot); 0.5 = la mitad de velocidad.
+- Se pueden reemplazar los factores por defecto con speed_profiles.npz en el snapshot.
+"""
+
+import os
+import numpy as np
+
+from ml.velocidades import HIGHWAY_CLASSES
+from ml.ferias import THURSDAY
+
+HOURS_PER_WEEK = 7 * 24
+FERIA_CONGESTION_BUFFER_M = 1000
+PROFILES_FILE = "speed_profiles.npz"
+
+
+def _hourly(overrides):
+    """Lista de 24 factores (1.0 salvo las horas indicadas)."""
+    factors = [1.0] * 24
+    for hour, factor in overrides.items():
+        factors[hour] = factor
+    return factors
+
+
+# Factor por hora en días hábiles y fines de semana (horas pico de El Alto)
+WEEKDAY_HOURLY = _hourly({6: 0.85, 7: 0.65, 8: 0.65, 9: 0.8, 12: 0.8, 13: 0.8,
+                          17: 0.7, 18: 0.65, 19: 0.7, 20: 0.85})
+WEEKEND_HOURLY = _hourly({10: 0.85, 11: 0.85, 12: 0.85, 13: 0.85, 18: 0.9})
+# Factor extra para la zona de ferias el día de feria, por hora
+FERIA_HOURLY = _hourly({hour: 0.5 for hour in range(6, 16)})
+
+# Qué tanto sufre la congestión cada tipo de vía (1.0 = todo el efecto de la hora pico)
+CONGESTION_SENSITIVITY = {
+    "motorway": 1.0, "trunk": 1.0, "primary": 1.0, "secondary": 0.9,
+    "tertiary": 0.7, "unclassified": 0.6, "residential": 0.5,
+    "living_street": 0.3, "service": 0.3,
+}
+DEFAULT_SENSITIVITY = 0.6
+
+
+def default_speed_factors():
+    """Tabla (n_clases, 168) float32 de factores de velocidad por tipo de vía y bucket."""
+    week = np.array(WEEKDAY_HOURLY * 5 + WEEKEND_HOURLY * 2, dtype=np.float32)
+    factors = np.empty((len(HIGHWAY_CLASSES), HOURS_PER_WEEK), dtype=np.float32)
+    for i, name in enumerate(HIGHWAY_CLASSES):
+        sensitivity = CONGESTION_SENSITIVITY.get(name.replace("_link", ""), DEFAULT_SENSITIVITY)
+        factors[i] = 1.0 - sensitivity * (1.0 - week)
+    return factors
+
+
+def seconds_into_week(when):
+    """datetime -> segundos desde el lunes 00:00."""
+    return when.weekday() * 86400 + when.hour * 3600 + when.minute * 60 + when.second
+
+
+class SpeedProfiles:
+    """
+    Factores de velocidad dependientes del tiempo para los arcos de un CSRGraph.
+    arc_class: uint8 por arco (índice en factors), de la arista que quedó para
+    travel_time entre las paralelas; feria_zone: bool por arco.
+    """
+
+    def __init__(self, factors, feria_factors, arc_class, feria_zone, feria_weekday=THURSDAY):
+        self.factors = np.asarray(factors, dtype=np.float32)
+        self.feria_factors = np.asarray(feria_factors, dtype=np.float32)
+        self.arc_class = arc_class
+        self.feria_zone = feria_zone
+        self.feria_weekday = feria_weekday
+        # Columnas por bucket como listas: la búsqueda las consulta en cada nodo
+        self._columns = self.factors.T.tolist()
+        self._feria = self.feria_factors.tolist()
+
+    def at(self, t_week_sec):
+        """Para un instante (segundos en la semana): (factor por clase, factor zona feria)."""
+        bucket = int(t_week_sec // 3600) % HOURS_PER_WEEK
+        weekday, hour = divmod(bucket, 24)
+        feria = self._feria[hour] if weekday == self.feria_weekday else 1.0
+        return self._columns[bucket], feria
+
+
+def load_speed_profiles(graph, feria_zone, snapshot_dir=None):
+    """SpeedProfiles del grafo: factores de speed_profiles.npz si existe o los por defecto."""
+    factors, feria_factors = default_speed_factors(), np.array(FERIA_HOURLY, dtype=np.float32)
+    path = os.path.join(snapshot_dir, PROFILES_FILE) if snapshot_dir else None
+    if path and os.path.exists(path):
+        with np.load(path) as data:
+            factors, feria_factors = data["factors"], data["feria_factors"]
+    return SpeedProfiles(factors, feria_factors, graph.edge_attrs["highway_class_tt"], feria_zone)
@@ -0,0 +1,275 @@
+"""
+pipeline.py
+
+- Pipeline de entrenamiento por etapas: graph -> mask -> dataset -> model -> geojson.
+- Cada etapa calcula la huella de sus entradas (incluida la huella de la etapa
+  anterior) y escribe su artefacto bajo esa huella; si el artefacto de la huella
+  actual ya existe, la etapa se salta.
+- Huellas: checksum del GraphML (snapshot OSM) y configuración de velocidades,
+  FERIA_POINTS y buffer_m, parámetros de simulación y de entrenamiento.
+- manifest.json registra la huella y el artefacto vigentes de cada etapa.
+
+Uso: python -m ml.pipeline [--from-stage ETAPA] [--pairs N] [--seed S] [--workers W]
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from ml import simulacion
+from ml.ferias import feria_fingerprint, load_feria_mask
+from ml.forest_compilado import COMPILED_MODEL_PATH
+from ml.ruta_modelo import (FEATURES, FERIA_POINTS, MODEL_DIR, MODEL_PATH, N_PAIRS, TARGET,
+                            model_metrics, prepared_graph_loader, train_and_save_model)
+from ml.snapshot import (GRAPHML_PATH, ML_DIR, SNAPSHOT_DIR, SNAPSHOT_VERSION, SnapshotError,
+                         build_snapshot, file_checksum, load_snapshot)
+from ml.velocidades import HIGHWAY_SPEEDS_KPH
+
+STAGES = ("graph", "mask", "dataset", "model", "geojson")
+ARTIFACTS_DIR = os.path.join(ML_DIR, "artifacts")
+MANIFEST_PATH = os.path.join(ARTIFACTS_DIR, "manifest.json")
+MODEL_METADATA_FILE = "metadata.json"
+FALLBACK_KPH = 30.0
+
+DEFAULT_PARAMS = {
+    "feria_points": FERIA_POINTS,
+    "buffer_m": 500,
+    "n_pairs": N_PAIRS,
+    "seed": simulacion.DEFAULT_SEED,
+    "workers": None,
+    "n_estimators": 200,
+    "random_state": 42,
+}
+
+
+def fingerprint(*parts):
+    """Huella corta (sha256) de las entradas de una etapa."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _is_current(manifest, stage, fp, artifact):
+    entry = manifest.get(stage, {})
+    return entry.get("fingerprint") == fp and os.path.exists(artifact)
+
+
+def _record(manifest, stage, fp, artifact, inputs):
+    manifest[stage] = {
+        "fingerprint": fp,
+        "artifact": artifact,
+        "inputs": inputs,
+        "updated": datetime.datetime.now().isoformat(),
+    }
+    save_manifest(manifest)
+
+
+def _copy_atomic(src, dst):
+    tmp = dst + ".tmp"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+# --------------------------
+# ETAPAS
+# --------------------------
+
+def stage_graph(ctx, params, manifest, force):
+    """Snapshot CSR del grafo (GraphML + velocidades)."""
+    G = None
+    if not os.path.exists(GRAPHML_PATH):
+        G = prepared_graph_loader()  # descarga de OSM y guarda el GraphML
+    inputs = {"graphml": file_checksum(GRAPHML_PATH), "snapshot_version": SNAPSHOT_VERSION,
+              "highway_speeds": HIGHWAY_SPEEDS_KPH, "fallback_kph": FALLBACK_KPH}
+    fp = fingerprint("graph", inputs)
+    graph = None
+    if not force and _is_current(manifest, "graph", fp, SNAPSHOT_DIR):
+        try:
+            graph = load_snapshot(SNAPSHOT_DIR, expected_checksum=inputs["graphml"])
+        except SnapshotError:
+            graph = None
+    if graph is None:
+        print("[graph] construyendo snapshot...")
+        graph = build_snapshot(GRAPHML_PATH, SNAPSHOT_DIR, G=G if G is not None else prepared_graph_loader())
+        _record(manifest, "graph", fp, SNAPSHOT_DIR, inputs)
+    else:
+        print("[graph] sin cambios, se reutiliza el snapshot")
+    ctx["graph"] = graph
+    return fp
+
+
+def stage_mask(ctx, params, manifest, force):
+    """Máscara de cierres por ferias sobre los arcos del snapshot."""
+    graph = ctx["graph"]
+    inputs = {"graph": manifest["graph"]["fingerprint"], "feria_points": params["feria_points"],
+              "buffer_m": params["buffer_m"]}
+    fp = fingerprint("mask", inputs)
+    mask_fp = feria_fingerprint(params["feria_points"], params["buffer_m"], graph.meta)
+    artifact = os.path.join(SNAPSHOT_DIR, f"feria_mask_{mask_fp}.npy")
+    current = _is_current(manifest, "mask", fp, artifact)
+    if force or not current:
+        print("[mask] calculando máscara de ferias...")
+        if os.path.exists(artifact):
+            os.remove(artifact)
+    else:
+        print("[mask] sin cambios")
+    ctx["mask"] = load_feria_mask(graph, params["feria_points"], params["buffer_m"], SNAPSHOT_DIR)
+    if force or not current:
+        _record(manifest, "mask", fp, artifact, inputs)
+    return fp
+
+
+def stage_dataset(ctx, params, manifest, force):
+    """Dataset O-D simulado (Parquet). El número de procesos no cambia el resultado."""
+    inputs = {
+        "mask": manifest["mask"]["fingerprint"], "n_pairs": params["n_pairs"], "seed": params["seed"],
+        "shard_pairs": simulacion.SHARD_PAIRS, "dests_per_origin": simulacion.DESTS_PER_ORIGIN,
+        "od_pool": [simulacion.OD_POOL_NODES, simulacion.OD_POOL_RADIUS_M],
+        "thursday_share": simulacion.THURSDAY_SHARE, "center": params["feria_points"][0],
+    }
+    fp = fingerprint("dataset", inputs)
+    artifact = os.path.join(ARTIFACTS_DIR, "dataset", f"{fp}.parquet")
+    if not force and _is_current(manifest, "dataset", fp, artifact):
+        print("[dataset] sin cambios")
+    else:
+        print("[dataset] simulando pares O-D...")
+        os.makedirs(os.path.dirname(artifact), exist_ok=True)
+        simulacion.simulate_to_parquet(
+            ctx["graph"], params["feria_points"], params["n_pairs"], artifact, seed=params["seed"],
+            workers=params["workers"], buffer_m=params["buffer_m"], center=params["feria_points"][0],
+            snapshot_dir=SNAPSHOT_DIR)
+        _record(manifest, "dataset", fp, artifact, inputs)
+    ctx["dataset"] = artifact
+    return fp
+
+
+def stage_model(ctx, params, manifest, force):
+    """RandomForest + bosque compilado; se publican en MODEL_PATH / COMPILED_MODEL_PATH."""
+    import sklearn
+    inputs = {"dataset": manifest["dataset"]["fingerprint"], "n_estimators": params["n_estimators"],
+              "random_state": params["random_state"], "sklearn": sklearn.__version__}
+    fp = fingerprint("model", inputs)
+    out_dir = model_artifact_dir(fp)
+    model_path = os.path.join(out_dir, os.path.basename(MODEL_PATH))
+    compiled_path = os.path.join(out_dir, os.path.basename(COMPILED_MODEL_PATH))
+    metadata_path = os.path.join(out_dir, MODEL_METADATA_FILE)
+    trained = force or not _is_current(manifest, "model", fp, metadata_path)
+    if not trained:
+        print("[model] sin cambios")
+    else:
+        print("[model] entrenando RandomForest...")
+        os.makedirs(out_dir, exist_ok=True)
+        df = pd.read_parquet(ctx["dataset"])
+        print("Filas del dataset:", len(df))
+        model = train_and_save_model(df, model_path, compiled_path, n_estimators=params["n_estimators"],
+                                     random_state=params["random_state"])
+        metadata = {
+            "fingerprint": fp,
+            "tipo": type(model).__name__,
+            "metricas": model_metrics(model, df[TARGET]),
+            "esquema": {"features": FEATURES, "target": TARGET},
+        }
+        with open(metadata_path, "w") as f:
+            json.dump(metadata, f, indent=2)
+        print("[model] métricas:", metadata["metricas"])
+        _record(manifest, "model", fp, out_dir, inputs)
+    if trained or manifest.get("published_model") != fp or not os.path.exists(COMPILED_MODEL_PATH):
+        _copy_atomic(model_path, MODEL_PATH)
+        _copy_atomic(compiled_path, COMPILED_MODEL_PATH)
+        manifest["published_model"] = fp
+        save_manifest(manifest)
+        print("[model] publicado en:", MODEL_PATH)
+    ctx["model"] = out_dir
+    return fp
+
+
+def stage_geojson(ctx, params, manifest, force):
+    """Puntos de ferias en GeoJSON."""
+    import geopandas as gpd
+    from shapely.geometry import Point
+    inputs = {"feria_points": params["feria_points"]}
+    fp = fingerprint("geojson", inputs)
+    artifact = os.path.join(MODEL_DIR, "ferias.geojson")
+    if not force and _is_current(manifest, "geojson", fp, artifact):
+        print("[geojson] sin cambios")
+        return fp
+    gdf_ferias = gpd.GeoDataFrame({
+        "id": list(range(1, len(params["feria_points"]) + 1)),
+        "geometry": [Point(lon, lat) for lat, lon in params["feria_points"]]
+    }, crs="EPSG:4326")
+    gdf_ferias.to_file(artifact, driver="GeoJSON")
+    print("[geojson] ferias guardadas en:", artifact)
+    _record(manifest, "geojson", fp, artifact, inputs)
+    return fp
+
+
+STAGE_FUNCS = {
+    "graph": stage_graph,
+    "mask": stage_mask,
+    "dataset": stage_dataset,
+    "model": stage_model,
+    "geojson": stage_geojson,
+}
+
+
+def model_artifact_dir(fp):
+    """Directorio de artefactos del modelo con huella fp (pkl, npz y metadata.json)."""
+    return os.path.join(ARTIFACTS_DIR, "model", fp)
+
+
+def run_pipeline(from_stage=None, progress=None, **params):
+    """
+    Ejecuta las etapas en orden saltando las que no cambiaron. Con from_stage se
+    fuerza esa etapa y las siguientes. progress(etapa, evento) se llama con
+    "started" y "finished" alrededor de cada etapa. Retorna {etapa: huella}.
+    """
+    if from_stage is not None and from_stage not in STAGES:
+        raise ValueError(f"Etapa desconocida: {from_stage} (opciones: {', '.join(STAGES)})")
+    params = {**DEFAULT_PARAMS, **{k: v for k, v in params.items() if v is not None}}
+    forced = set(STAGES[STAGES.index(from_stage):]) if from_stage else set()
+    manifest = load_manifest()
+    ctx = {}
+    fingerprints = {}
+    for stage in STAGES:
+        if progress:
+            progress(stage, "started")
+        fingerprints[stage] = STAGE_FUNCS[stage](ctx, params, manifest, stage in forced)
+        if progress:
+            progress(stage, "finished")
+    return fingerprints
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline de entrenamiento del modelo de tiempos de ruta.")
+    parser.add_argument("--from-stage", choices=STAGES, default=None,
+                        help="rehace esta etapa y las siguientes aunque no hayan cambiado")
+    parser.add_argument("--pairs", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    fingerprints = run_pipeline(args.from_stage, n_pairs=args.pairs, seed=args.seed, workers=args.workers)
+    for stage, fp in fingerprints.items():
+        print(f"{stage}: {fp}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+registro.py
+
+- Registro de versiones del modelo de tiempos de ruta sobre la tabla ModeloML.
+- Cada versión apunta a sus artefactos (pkl + bosque compilado .npz) con su
+  hash, métricas y esquema de features; solo una versión activa por nombre.
+- ModelWatcher: un hilo por proceso consulta la versión activa cada pocos
+  segundos; si cambió, carga el artefacto en segundo plano y lo entrega a
+  on_change, que lo activa con una sola asignación de referencia.
+"""
+
+import json
+import os
+import threading
+import time
+
+import joblib
+from sqlalchemy import func
+
+from ml.forest_compilado import load_compiled
+from ml.snapshot import file_checksum
+
+MODEL_NAME = "tiempo_ruta"
+POLL_SECONDS = 5.0
+
+
+class LoadedModel:
+    """Modelo listo para predecir junto con la versión del registro de la que viene."""
+
+    def __init__(self, model, modelo_id=None, version=None, artifact_hash=None):
+        self.model = model
+        self.modelo_id = modelo_id
+        self.version = version
+        self.artifact_hash = artifact_hash
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+    def info(self):
+        return {'modelo_id': self.modelo_id, 'version': self.version, 'hash': self.artifact_hash,
+                'tipo': type(self.model).__name__}
+
+
+def read_artifact(compiled_path=None, pickle_path=None):
+    """Bosque compilado si existe; si no, el pickle de sklearn."""
+    if compiled_path and os.path.exists(compiled_path):
+        return load_compiled(compiled_path)
+    return joblib.load(pickle_path)
+
+
+def register_model(session, model_dir, nombre=MODEL_NAME, activate=True):
+    """
+    Registra como nueva versión el modelo de model_dir (model_rf.pkl, model_rf.npz y
+    metadata.json del pipeline). Si ya existe una versión con el mismo artefacto,
+    la reutiliza. Con activate=True la deja como la única activa.
+    """
+    from models import ModeloML
+    compiled_path = os.path.join(model_dir, "model_rf.npz")
+    artifact_hash = file_checksum(compiled_path)
+    if artifact_hash is None:
+        raise FileNotFoundError(f"No existe el modelo compilado en {model_dir}")
+    record = ModeloML.query.filter_by(nombre=nombre, hash_artefacto=artifact_hash).first()
+    if record is None:
+        metadata = {}
+        metadata_path = os.path.join(model_dir, "metadata.json")
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        last = session.query(func.max(ModeloML.version)).filter(ModeloML.nombre == nombre).scalar()
+        record = ModeloML(
+            nombre=nombre,
+            version=(last or 0) + 1,
+            tipo=metadata.get('tipo', 'RandomForestRegressor'),
+            ruta_archivo=os.path.join(model_dir, "model_rf.pkl"),
+            ruta_compilado=compiled_path,
+            hash_artefacto=artifact_hash,
+            metricas=metadata.get('metricas'),
+            esquema=metadata.get('esquema'),
+            activo=False,
+        )
+        session.add(record)
+        session.flush()
+    if activate:
+        activate_version(session, record.version, nombre, commit=False)
+    session.commit()
+    return record
+
+
+def activate_version(session, version, nombre=MODEL_NAME, commit=True):
+    """Deja activa solo `version` (misma transacción). ValueError si no existe."""
+    from models import ModeloML
+    record = ModeloML.query.filter_by(nombre=nombre, version=version).first()
+    if record is None:
+        raise ValueError(f"No existe la versión {version} de {nombre}")
+    # Primero desactivar: el índice único parcial admite una sola fila activa
+    ModeloML.query.filter(ModeloML.nombre == nombre, ModeloML.id != record.id,
+                          ModeloML.activo.is_(True)).update({'activo': False}, synchronize_session=False)
+    session.flush()
+    record.activo = True
+    if commit:
+        session.commit()
+    return record
+
+
+def active_record(nombre=MODEL_NAME):
+    """Fila activa de ModeloML para `nombre` (None si no hay)."""
+    from models import ModeloML
+    return ModeloML.query.filter_by(nombre=nombre, activo=True).first()
+
+
+def load_record(record):
+    """Carga los artefactos de una fila de ModeloML verificando su hash."""
+    if record.ruta_compilado and record.hash_artefacto:
+        if file_checksum(record.ruta_compilado) != record.hash_artefacto:
+            raise ValueError(f"El artefacto de la versión {record.version} no coincide con su hash")
+    model = read_artifact(record.ruta_compilado, record.ruta_archivo)
+    return LoadedModel(model, record.id, record.version, record.hash_artefacto)
+
+
+class ModelWatcher:
+    """Hilo de fondo (uno por proceso) que sigue la versión activa del registro."""
+
+    def __init__(self, app, on_change, nombre=MODEL_NAME, poll_seconds=POLL_SECONDS):
+        self.app = app
+        self.on_change = on_change
+        self.nombre = nombre
+        self.poll_seconds = poll_seconds
+        self.current_id = None
+        self._start_lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        # Tras el fork de gunicorn el hilo del master no existe: uno por worker
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, daemon=True, name="ml-model-watcher").start()
+                self._pid = os.getpid()
+
+    def check_once(self):
+        """Consulta la versión activa; si cambió, la carga y llama a on_change. True si cambió."""
+        with self._check_lock:
+            with self.app.app_context():
+                record = active_record(self.nombre)
+                if record is None or record.id == self.current_id:
+                    return False
+                loaded = load_record(record)
+            self.current_id = loaded.modelo_id
+            self.on_change(loaded)
+            return True
+
+    def _run(self):
+        while True:
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"Error consultando el registro de modelos: {e}")
+            time.sleep(self.poll_seconds)
@@ -3,26 +3,37 @@ ruta_modelo.py
 
 - Construye / descarga la red vial (zona El Alto).
 - Aplica restricciones (cerrado parcial) alrededor de una lista de ferias.
-- Genera dataset O-D simulado (normal vs. feria).
-- Entrena RandomForest y guarda el modelo (joblib).
+- Genera dataset O-D simulado (normal vs. feria) en paralelo a Parquet
+  (ml/simulacion.py, sobre el snapshot CSR del grafo).
+- main() corre el pipeline por etapas con artefactos cacheados (ml/pipeline.py).
+- Entrena RandomForest y guarda el modelo (joblib) y su versión compilada
+  a arreglos NumPy (ml/forest_compilado.py) que usa la API.
 - Exporta opcionalmente geojson con puntos de ferias.
 """
 
 import os
+import weakref
 import joblib
 import numpy as np
-import pandas as pd
 import geopandas as gpd
 import networkx as nx
 import osmnx as ox
 from shapely.geometry import Point
 
+from ml.velocidades import edge_speed_columns
+from ml.busqueda_dirigida import edge_geo_factor, haversine_scalar_m
+from ml.forest_compilado import export_compiled_model, COMPILED_MODEL_PATH
+
 # --------------------------
 # CONFIG
 # --------------------------
 MODEL_DIR = os.path.join(os.path.dirname(__file__), "")
 MODEL_PATH = os.path.join(MODEL_DIR, "model_rf.pkl")
 G_CACHE_PATH = os.path.join(MODEL_DIR, "graph_gpkg.gpkg")  # opcional cache
+N_PAIRS = 100000
+FEATURES = ["dist_m", "base_time_sec", "is_thursday"]
+TARGET = "time_real_sec"
+_GEO_FACTORS = weakref.WeakKeyDictionary()  # grafo -> {weight: k de la cota A*}
 
 # Lista de 14 ferias (usar tus coordenadas georreferenciadas reales si las tienes)
 # Formato: (lat, lon)
@@ -68,46 +79,36 @@ def load_graph_z16(use_cache=True):
         pass
     return G
 
-def ensure_edge_speeds(G, fallback_kph=30.0):
-    """Asegura speed_kph y travel_time en cada arista."""
-    for u, v, k, data in G.edges(keys=True, data=True):
-        length_m = data.get("length", None)
-        if length_m is None:
-            # longitud en metros aproximada
-            if "geometry" in data:
-                length_m = data["geometry"].length
-            else:
-                length_m = 20.0
-            data["length"] = float(length_m)
-
-        speed = data.get("speed_kph", None)
-        if speed is None:
-            maxspeed = data.get("maxspeed", None)
-            if isinstance(maxspeed, list) and len(maxspeed) > 0:
-                try:
-                    speed = float(str(maxspeed[0]).split()[0])
-                except:
-                    speed = fallback_kph
-            elif isinstance(maxspeed, (int, float)):
-                speed = float(maxspeed)
-            elif isinstance(maxspeed, str):
-                import re
-                nums = re.findall(r"\d+\.?\d*", maxspeed)
-                if nums:
-                    speed = float(nums[0])
-                else:
-                    speed = fallback_kph
-            else:
-                speed = fallback_kph
-        data["speed_kph"] = float(speed)
-        speed_mps = data["speed_kph"] * 1000.0 / 3600.0
-        data["travel_time"] = data["length"] / max(speed_mps, 1e-3)
+def ensure_edge_speeds(G, fallback_kph=30.0, highway_speeds=None):
+    """
+    Asegura length, speed_kph y travel_time en cada arista.
+    Trabaja sobre la tabla de aristas como columnas (ver ml/velocidades.py):
+    maxspeed parseado en bloque, velocidad por tipo de vía si falta y
+    escritura de resultados en bloque.
+    """
+    datas = [data for _, _, data in G.edges(data=True)]
+    if not datas:
+        return
+    length, speed_kph, travel_time = edge_speed_columns(
+        length=[d.get("length", np.nan) for d in datas],
+        speed_kph=[d.get("speed_kph", np.nan) for d in datas],
+        maxspeed=[d.get("maxspeed") for d in datas],
+        highway=[d.get("highway") for d in datas],
+        geometry_length=[d["geometry"].length if "geometry" in d else np.nan for d in datas],
+        fallback_kph=fallback_kph,
+        highway_speeds=highway_speeds,
+    )
+    for data, L, s, t in zip(datas, length.tolist(), speed_kph.tolist(), travel_time.tolist()):
+        data["length"] = L
+        data["speed_kph"] = s
+        data["travel_time"] = t
 
 def graph_with_ferias_restrictions(G, feria_points, buffer_m=500):
     """
     Crea una copia del grafo y elimina aristas cuyo midpoint cae dentro de
     cualquiera de los buffers alrededor de las ferias (lista de (lat,lon)).
-    Devuelve grafo modificado.
+    Devuelve grafo modificado. Para rutear en la API se usa en su lugar la
+    máscara de arcos de ml/ferias.py, que no copia el grafo.
     """
     # Proyectar
     G_proj = ox.projection.project_graph(G)
@@ -122,16 +123,10 @@ def graph_with_ferias_restrictions(G, feria_points, buffer_m=500):
 
     edges_proj = edges_proj.copy()
     edges_proj["midpoint"] = edges_proj.geometry.interpolate(0.5, normalized=True)
-    to_remove = edges_proj[edges_proj["midpoint"].within(combined)].reset_index()
+    to_remove = edges_proj[edges_proj["midpoint"].within(combined)].index
 
     G_mod = G_proj.copy()
-    for idx, row in to_remove.iterrows():
-        u, v, k = row["u"], row["v"], row["key"]
-        if G_mod.has_edge(u, v, k):
-            try:
-                G_mod.remove_edge(u, v, k)
-            except Exception:
-                pass
+    G_mod.remove_edges_from(to_remove.tolist())
 
     # reproyectar a WGS84 y devolver
     G_mod_wgs = ox.projection.project_graph(G_mod, to_crs="EPSG:4326")
@@ -139,10 +134,33 @@ def graph_with_ferias_restrictions(G, feria_points, buffer_m=500):
         G_mod_wgs = ox.utils_graph.get_largest_component(G_mod_wgs, strongly=False)
     return G_mod_wgs
 
-def shortest_route_stats(G, orig_node, dest_node, weight="length"):
-    """Calcula ruta más corta entre nodos; retorna path, dist (m), t (seg)."""
+def _geo_heuristic(G, weight):
+    """Cota A* haversine(u, destino) * k, con k de edge_geo_factor sobre las aristas de G."""
+    k = _GEO_FACTORS.get(G, {}).get(weight)
+    if k is None:
+        us, vs, ws = zip(*[(u, v, d.get(weight, np.inf)) for u, v, d in G.edges(data=True)])
+        ys = {n: d["y"] for n, d in G.nodes(data=True)}
+        xs = {n: d["x"] for n, d in G.nodes(data=True)}
+        k = edge_geo_factor(ws, np.array([ys[u] for u in us]), np.array([xs[u] for u in us]),
+                            np.array([ys[v] for v in vs]), np.array([xs[v] for v in vs]))
+        _GEO_FACTORS.setdefault(G, {})[weight] = k
+    nodes = G.nodes
+
+    def heuristic(u, target):
+        return k * haversine_scalar_m(nodes[u]["y"], nodes[u]["x"], nodes[target]["y"], nodes[target]["x"])
+    return heuristic
+
+def shortest_route_stats(G, orig_node, dest_node, weight="length", astar=False):
+    """
+    Calcula ruta más corta entre nodos; retorna path, dist (m), t (seg).
+    Con astar=True usa A* con cota haversine (para travel_time, a la velocidad
+    máxima de la red); la ruta es la misma.
+    """
     try:
-        path = nx.shortest_path(G, orig_node, dest_node, weight=weight)
+        if astar:
+            path = nx.astar_path(G, orig_node, dest_node, heuristic=_geo_heuristic(G, weight), weight=weight)
+        else:
+            path = nx.shortest_path(G, orig_node, dest_node, weight=weight)
         dist = 0.0
         tsec = 0.0
         for i in range(len(path)-1):
@@ -162,100 +180,52 @@ def shortest_route_stats(G, orig_node, dest_node, weight="length"):
     except (nx.NetworkXNoPath, nx.NodeNotFound):
         return None, np.nan, np.nan
 
-def pick_random_nodes(G, center=None, max_nodes=200, radius_m=1200):
-    """Elige hasta max_nodes nodos aleatorios dentro de radius_m del centro."""
-    nodes_gdf, edges = ox.graph_to_gdfs(G, nodes=True, edges=True)
-    
-    # proyectar automáticamente a UTM correcto
-    nodes_proj = ox.projection.project_gdf(nodes_gdf)
-    utm_crs = nodes_proj.crs
-    
-    if center is None:
-        center = nodes_proj.unary_union.centroid
-    else:
-        center = gpd.GeoSeries([Point(center[1], center[0])], crs="EPSG:4326").to_crs(utm_crs).geometry.values[0]
-    
-    nodes_proj["dist_center"] = nodes_proj.geometry.distance(center)
-    sub = nodes_proj[nodes_proj["dist_center"] <= radius_m]
-    if len(sub) < 10:
-        sub = nodes_proj
-    choices = sub.sample(min(max_nodes, len(sub)), random_state=42).index.tolist()
-    return choices
-
-def simulate_dataset(G_normal, G_feria, n_pairs=200, feria_center_latlon=None):
-    """Genera pares O-D simulados (dist, tiempo base, time_real) con thursday/no."""
-    od_nodes = pick_random_nodes(G_normal, center=feria_center_latlon, max_nodes=300, radius_m=1500)
-    rows = []
-    attempts = 0
-    while len(rows) < n_pairs and attempts < n_pairs*20:
-        attempts += 1
-        o, d = np.random.choice(od_nodes, 2, replace=False)
-        p_norm, dist_norm_m, t_norm_sec = shortest_route_stats(G_normal, o, d, weight="length")
-        if p_norm is None or not np.isfinite(dist_norm_m):
-            continue
-        # decide si es jueves
-        is_thursday = np.random.choice([0,1], p=[0.7,0.3])  # más no-jueves
-        G_used = G_feria if is_thursday else G_normal
-        p_used, dist_used_m, t_used_sec = shortest_route_stats(G_used, o, d, weight="length")
-        if p_used is None or not np.isfinite(dist_used_m):
-            continue
-        feria_factor = 1.0 + (0.2 + 0.4*np.random.rand()) if is_thursday else 1.0 + (0.0 + 0.1*np.random.rand())
-        noise = np.random.normal(loc=1.0, scale=0.05)
-        time_real_sec = t_used_sec * feria_factor * max(noise, 0.8)
-        rows.append({
-            "orig": int(o), "dest": int(d),
-            "dist_m": float(dist_used_m),
-            "base_time_sec": float(t_used_sec),
-            "time_real_sec": float(time_real_sec),
-            "is_thursday": int(is_thursday)
-        })
-    df = pd.DataFrame(rows)
-    return df
+def prepared_graph_loader():
+    """Red vial (cache GraphML u OSM) con length / speed_kph / travel_time listos."""
+    G = load_graph_z16()
+    ensure_edge_speeds(G, fallback_kph=30.0)
+    return G
 
 # --------------------------
 # ENTRENAMIENTO
 # --------------------------
 
-def train_and_save_model(df, model_path=MODEL_PATH):
+def train_and_save_model(df, model_path=MODEL_PATH, compiled_path=COMPILED_MODEL_PATH,
+                         n_estimators=200, random_state=42):
     from sklearn.ensemble import RandomForestRegressor
-    features = ["dist_m", "base_time_sec", "is_thursday"]
-    target = "time_real_sec"
-    X = df[features]
-    y = df[target]
-    model = RandomForestRegressor(n_estimators=200, random_state=42, n_jobs=-1)
+    X = df[FEATURES]
+    y = df[TARGET]
+    # oob_score no cambia los árboles: solo deja predicciones out-of-bag para las métricas
+    model = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=-1,
+                                  oob_score=True)
     model.fit(X, y)
     joblib.dump(model, model_path)
     print("Modelo guardado en:", model_path)
+    # Versión compilada para inferencia (verifica paridad sobre el set de entrenamiento)
+    if compiled_path:
+        export_compiled_model(model, X, compiled_path)
     return model
 
+def model_metrics(model, y):
+    """MAE / RMSE / R2 out-of-bag del bosque entrenado (segundos)."""
+    err = np.asarray(model.oob_prediction_) - np.asarray(y)
+    return {
+        "mae_sec": float(np.mean(np.abs(err))),
+        "rmse_sec": float(np.sqrt(np.mean(err ** 2))),
+        "r2_oob": float(model.oob_score_),
+        "n_rows": int(len(err)),
+    }
+
 # --------------------------
 # MAIN: pipeline completo
 # --------------------------
-def main():
-    print("Cargando grafo...")
-    G_normal = load_graph_z16()
-    ensure_edge_speeds(G_normal, fallback_kph=30.0)
-
-    print("Aplicando restricciones por ferias...")
-    # Crea grafo con restricciones por todas las ferias
-    G_feria = graph_with_ferias_restrictions(G_normal, FERIA_POINTS, buffer_m=500)
-    ensure_edge_speeds(G_feria, fallback_kph=30.0)
-
-    print("Generando dataset simulado...")
-    df = simulate_dataset(G_normal, G_feria, n_pairs=300, feria_center_latlon=FERIA_POINTS[0])
-    print("Filas generadas:", len(df))
-
-    print("Entrenando modelo RandomForest...")
-    model = train_and_save_model(df)
-
-    # exportar ferias a GeoJSON (opcional)
-    gdf_ferias = gpd.GeoDataFrame({
-        "id": list(range(1, len(FERIA_POINTS)+1)),
-        "geometry": [Point(lon, lat) for lat, lon in FERIA_POINTS]
-    }, crs="EPSG:4326")
-    out_geojson = os.path.join(MODEL_DIR, "ferias.geojson")
-    gdf_ferias.to_file(out_geojson, driver="GeoJSON")
-    print("Ferias guardadas en:", out_geojson)
+def main(n_pairs=None, workers=None, seed=None, from_stage=None, progress=None):
+    """
+    Pipeline por etapas (ml/pipeline.py): grafo, máscara de ferias, dataset,
+    modelo y GeoJSON; solo se rehacen las etapas cuyas entradas cambiaron.
+    """
+    from ml.pipeline import run_pipeline
+    return run_pipeline(from_stage, progress=progress, n_pairs=n_pairs, workers=workers, seed=seed)
 
 if __name__ == "__main__":
     main()
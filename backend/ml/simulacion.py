@@ -0,0 +1,177 @@
+"""
+simulacion.py
+
+- Dataset O-D simulado (normal vs. feria) sobre el grafo de ruteo CSR.
+- Pares O-D sorteados en bloque con un Generator sembrado: cada origen se
+  empareja con varios destinos y se resuelve con una búsqueda por origen
+  (route_matrix), más una con el perfil de feria para los pares de jueves.
+- El trabajo se reparte en shards con semilla propia (SeedSequence.spawn) sobre
+  un pool de procesos que cargan el snapshot memory-mapped; el resultado es el
+  mismo para la misma semilla sin importar el número de procesos.
+- Las filas se escriben a Parquet por shard a medida que llegan.
+
+Uso: python -m ml.simulacion --pairs 100000 [--workers N] [--seed S] [--out RUTA.parquet]
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ml.ferias import FERIA_PROFILE, load_feria_mask
+from ml.snap import project_local
+from ml.snapshot import ML_DIR, SNAPSHOT_DIR, SnapshotError, load_snapshot, read_meta
+
+DATASET_PATH = os.path.join(ML_DIR, "dataset_od.parquet")
+DEFAULT_SEED = 42
+SHARD_PAIRS = 2000
+DESTS_PER_ORIGIN = 25
+OD_POOL_NODES = 300
+OD_POOL_RADIUS_M = 1500
+THURSDAY_SHARE = 0.3
+MAX_ATTEMPTS_FACTOR = 20
+
+DATASET_SCHEMA = pa.schema([
+    ("orig", pa.int64()),
+    ("dest", pa.int64()),
+    ("dist_m", pa.float64()),
+    ("base_time_sec", pa.float64()),
+    ("time_real_sec", pa.float64()),
+    ("is_thursday", pa.int8()),
+])
+
+# Grafo de ruteo de cada proceso del pool (se carga en _init_worker)
+_WORKER_GRAPH = None
+
+
+def od_node_pool(graph, rng, center=None, max_nodes=OD_POOL_NODES, radius_m=OD_POOL_RADIUS_M):
+    """Hasta max_nodes osmids al azar dentro de radius_m del centro (lat, lon); toda la red si hay < 10."""
+    lat0, lon0 = (float(np.mean(graph.y)), float(np.mean(graph.x))) if center is None else center
+    xy = project_local(graph.y, graph.x, lat0, lon0)
+    candidates = np.flatnonzero(np.hypot(xy[:, 0], xy[:, 1]) <= radius_m)
+    if len(candidates) < 10:
+        candidates = np.arange(graph.n_nodes)
+    chosen = rng.choice(candidates, size=min(max_nodes, len(candidates)), replace=False)
+    return np.asarray(graph.node_ids)[np.sort(chosen)]
+
+
+def simulate_shard(graph, od_nodes, n_pairs, seed, dests_per_origin=DESTS_PER_ORIGIN,
+                   thursday_share=THURSDAY_SHARE):
+    """
+    Genera hasta n_pairs filas con el Generator de `seed`. Los pares sin ruta (en la
+    red normal o, los jueves, con cierres de feria) se descartan.
+    """
+    rng = np.random.default_rng(seed)
+    od_nodes = np.asarray(od_nodes)
+    parts = []
+    produced, attempts = 0, 0
+    while produced < n_pairs and attempts < n_pairs * MAX_ATTEMPTS_FACTOR:
+        o = od_nodes[rng.integers(len(od_nodes))]
+        k = min(dests_per_origin, len(od_nodes) - 1, n_pairs - produced)
+        dests = rng.choice(od_nodes[od_nodes != o], size=k, replace=False)
+        is_thursday = rng.random(k) < thursday_share
+        feria_factor = np.where(is_thursday, 1.2 + 0.4 * rng.random(k), 1.0 + 0.1 * rng.random(k))
+        noise = np.maximum(rng.normal(loc=1.0, scale=0.05, size=k), 0.8)
+        attempts += k
+
+        normal = graph.route_matrix([o], dests, weight="length")
+        dist, tsec = normal.dist[0].copy(), normal.time[0].copy()
+        ok = np.isfinite(dist)
+        if is_thursday.any():
+            feria = graph.route_matrix([o], dests[is_thursday], weight="length", profile=FERIA_PROFILE)
+            dist[is_thursday], tsec[is_thursday] = feria.dist[0], feria.time[0]
+            ok &= np.isfinite(dist)
+
+        parts.append(pd.DataFrame({
+            "orig": np.full(ok.sum(), o, dtype=np.int64),
+            "dest": dests[ok].astype(np.int64),
+            "dist_m": dist[ok],
+            "base_time_sec": tsec[ok],
+            "time_real_sec": tsec[ok] * feria_factor[ok] * noise[ok],
+            "is_thursday": is_thursday[ok].astype(np.int8),
+        }))
+        produced += int(ok.sum())
+    if not parts:
+        return pd.DataFrame({name: pd.Series(dtype=field.type.to_pandas_dtype())
+                             for name, field in zip(DATASET_SCHEMA.names, DATASET_SCHEMA)})
+    return pd.concat(parts, ignore_index=True)
+
+
+def _init_worker(snapshot_dir, feria_points, buffer_m):
+    """Inicializador del pool: snapshot (mmap) + perfil de cierres de feria."""
+    global _WORKER_GRAPH
+    graph = load_snapshot(snapshot_dir)
+    graph.add_closure_profile(FERIA_PROFILE, load_feria_mask(graph, feria_points, buffer_m, snapshot_dir))
+    _WORKER_GRAPH = graph
+
+
+def _run_shard(task):
+    od_nodes, n_pairs, seed = task
+    return simulate_shard(_WORKER_GRAPH, od_nodes, n_pairs, seed)
+
+
+def simulate_to_parquet(graph, feria_points, n_pairs, out_path=DATASET_PATH, seed=DEFAULT_SEED,
+                        workers=None, buffer_m=500, center=None, snapshot_dir=SNAPSHOT_DIR,
+                        shard_pairs=SHARD_PAIRS):
+    """
+    Simula n_pairs filas en shards de shard_pairs y las escribe en out_path (Parquet).
+    `graph` debe venir del snapshot en snapshot_dir: los procesos del pool lo cargan
+    de ahí. Con workers <= 1 todo corre en este proceso.
+    Retorna {"path", "rows", "shards"}.
+    """
+    if FERIA_PROFILE not in graph.profiles:
+        graph.add_closure_profile(FERIA_PROFILE, load_feria_mask(graph, feria_points, buffer_m, snapshot_dir))
+    pool_seed, *shard_seeds = np.random.SeedSequence(seed).spawn(1 + -(-n_pairs // shard_pairs))
+    od_nodes = od_node_pool(graph, np.random.default_rng(pool_seed), center=center)
+    quotas = [min(shard_pairs, n_pairs - i * shard_pairs) for i in range(len(shard_seeds))]
+    tasks = [(od_nodes, quota, s) for quota, s in zip(quotas, shard_seeds)]
+    workers = os.cpu_count() if workers is None else workers
+    try:
+        read_meta(snapshot_dir)
+    except SnapshotError:
+        workers = 1  # sin snapshot en disco los procesos no tienen de dónde cargar el grafo
+
+    tmp_path = out_path + ".tmp"
+    rows = 0
+    with pq.ParquetWriter(tmp_path, DATASET_SCHEMA) as writer:
+        if workers <= 1 or len(tasks) == 1:
+            results = (simulate_shard(graph, *task) for task in tasks)
+            rows = _write_shards(writer, results)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                                     initargs=(snapshot_dir, feria_points, buffer_m)) as executor:
+                # map conserva el orden de los shards: mismo archivo para la misma semilla
+                rows = _write_shards(writer, executor.map(_run_shard, tasks))
+    os.replace(tmp_path, out_path)
+    return {"path": out_path, "rows": rows, "shards": len(tasks)}
+
+
+def _write_shards(writer, results):
+    rows = 0
+    for i, df in enumerate(results):
+        writer.write_table(pa.Table.from_pandas(df, schema=DATASET_SCHEMA, preserve_index=False))
+        rows += len(df)
+        print(f"Shard {i + 1}: {len(df)} filas (total {rows})")
+    return rows
+
+
+def main():
+    from ml.ruta_modelo import FERIA_POINTS, prepared_graph_loader
+    from ml.snapshot import load_routing_graph
+    parser = argparse.ArgumentParser(description="Simula el dataset O-D (normal vs. feria) en Parquet.")
+    parser.add_argument("--pairs", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--out", default=DATASET_PATH)
+    args = parser.parse_args()
+    graph = load_routing_graph(prepared_graph_loader)
+    info = simulate_to_parquet(graph, FERIA_POINTS, args.pairs, args.out, seed=args.seed,
+                               workers=args.workers, center=FERIA_POINTS[0])
+    print(f"Dataset guardado en {info['path']}: {info['rows']} filas en {info['shards']} shards")
+
+
+if __name__ == "__main__":
+    main()
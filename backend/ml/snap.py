@@ -0,0 +1,112 @@
+"""
+snap.py
+
+- Índice espacial persistente para ajustar waypoints (lat, lon) a la red vial.
+- KD-tree sobre coordenadas de nodos proyectadas a metros (equirectangular local).
+- snap(points): todos los waypoints en una sola llamada -> (node_ids, snap_distance_m),
+  rechazando los que quedan demasiado lejos de la red.
+- snap_edges(points): arista más cercana con posición interpolada sobre ella.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6371008.8
+DEFAULT_MAX_SNAP_M = 1000.0
+EDGE_CANDIDATES = 16
+
+
+def project_local(lat, lon, lat0, lon0):
+    """(lat, lon) en grados -> (x, y) en metros, equirectangular alrededor de (lat0, lon0)."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    kx = np.radians(1.0) * EARTH_RADIUS_M * np.cos(np.radians(lat0))
+    ky = np.radians(1.0) * EARTH_RADIUS_M
+    return np.column_stack(((lon - lon0) * kx, (lat - lat0) * ky))
+
+
+class SnapIndex:
+    """Índice de nodos y aristas de un CSRGraph, construido una sola vez."""
+
+    def __init__(self, graph, max_snap_m=DEFAULT_MAX_SNAP_M):
+        self.graph = graph
+        self.max_snap_m = max_snap_m
+        self.lat0 = float(np.mean(graph.y))
+        self.lon0 = float(np.mean(graph.x))
+        self.xy = self.project(graph.y, graph.x)
+        self.node_tree = cKDTree(self.xy)
+        # Segmentos rectos u -> v de cada arco y su punto medio
+        self.seg_a = self.xy[graph.tails]
+        self.seg_b = self.xy[graph.heads]
+        self.edge_tree = cKDTree((self.seg_a + self.seg_b) / 2.0)
+
+    @property
+    def nbytes(self):
+        """Bytes aproximados del índice (coordenadas proyectadas, segmentos y árboles)."""
+        arrays = [self.xy, self.seg_a, self.seg_b, self.node_tree.data, self.node_tree.indices,
+                  self.edge_tree.data, self.edge_tree.indices]
+        return int(sum(a.nbytes for a in arrays))
+
+    def project(self, lat, lon):
+        """(lat, lon) en grados -> (x, y) en metros alrededor del centro del grafo."""
+        return project_local(lat, lon, self.lat0, self.lon0)
+
+    def unproject(self, xy):
+        """(x, y) en metros -> arreglos (lat, lon)."""
+        xy = np.asarray(xy)
+        kx = np.radians(1.0) * EARTH_RADIUS_M * np.cos(np.radians(self.lat0))
+        ky = np.radians(1.0) * EARTH_RADIUS_M
+        return xy[:, 1] / ky + self.lat0, xy[:, 0] / kx + self.lon0
+
+    def snap(self, points, max_distance_m=None):
+        """
+        Nodo más cercano para cada punto [lat, lon].
+        Retorna (node_ids, snap_distance_m); node_id = -1 si supera max_distance_m.
+        """
+        max_distance_m = self.max_snap_m if max_distance_m is None else max_distance_m
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        dist, idx = self.node_tree.query(self.project(pts[:, 0], pts[:, 1]))
+        node_ids = self.graph.node_ids[idx].astype(np.int64)
+        node_ids[dist > max_distance_m] = -1
+        return node_ids, dist
+
+    def snap_edges(self, points, max_distance_m=None, k=EDGE_CANDIDATES):
+        """
+        Arista más cercana para cada punto [lat, lon] (entre las k de punto medio más
+        cercano), con la fracción t en [0, 1] desde u hacia v y el punto interpolado.
+        Retorna dict de arreglos: arc, u, v, t, distance_m, lat, lon (arc = -1 si se rechaza).
+        """
+        max_distance_m = self.max_snap_m if max_distance_m is None else max_distance_m
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        p = self.project(pts[:, 0], pts[:, 1])
+        k = min(k, self.graph.n_arcs)
+        _, cand = self.edge_tree.query(p, k=k)
+        cand = cand.reshape(len(p), k)
+
+        a = self.seg_a[cand]                        # (P, k, 2)
+        ab = self.seg_b[cand] - a
+        ap = p[:, None, :] - a
+        den = np.einsum("pkd,pkd->pk", ab, ab)
+        t = np.where(den > 0, np.einsum("pkd,pkd->pk", ap, ab) / np.maximum(den, 1e-12), 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        proj = a + t[..., None] * ab
+        d = np.linalg.norm(p[:, None, :] - proj, axis=2)
+
+        best = np.argmin(d, axis=1)
+        rows = np.arange(len(p))
+        arc = cand[rows, best].astype(np.int64)
+        dist = d[rows, best]
+        lat, lon = self.unproject(proj[rows, best])
+        rejected = dist > max_distance_m
+        u = np.where(rejected, -1, self.graph.node_ids[self.graph.tails[arc]])
+        v = np.where(rejected, -1, self.graph.node_ids[self.graph.heads[arc]])
+        arc[rejected] = -1
+        return {
+            "arc": arc,
+            "u": u,
+            "v": v,
+            "t": t[rows, best],
+            "distance_m": dist,
+            "lat": lat,
+            "lon": lon,
+        }
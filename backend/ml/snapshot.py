@@ -0,0 +1,158 @@
+"""
+snapshot.py
+
+- Snapshot binario y versionado del grafo de ruteo (CSRGraph) ya preparado.
+- Un directorio con un .npy por arreglo (nodos, aristas, pesos, velocidades ya
+  parseadas y tipo de vía) y un meta.json
+  con la versión del formato y el checksum del GraphML de origen.
+- Los workers lo cargan con np.load(mmap_mode='r'); el GraphML (XML) solo se
+  usa para reconstruir el snapshot cuando falta, cambia el formato o cambia el origen.
+
+Uso: python -m ml.snapshot [--graphml RUTA] [--out DIR]
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import numpy as np
+
+from ml.grafo_csr import CSRGraph, build_csr_graph
+from ml.directorios import temp_dir_for, publish_dir
+
+SNAPSHOT_VERSION = 3
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+GRAPHML_PATH = os.path.join(ML_DIR, "graph_gpkg.graphml")
+SNAPSHOT_DIR = os.path.join(ML_DIR, "graph_snapshot")
+META_FILE = "meta.json"
+
+NODE_ARRAYS = ("node_ids", "y", "x", "indptr", "heads", "tails")
+ARC_ATTRS = ("length", "travel_time")
+
+
+class SnapshotError(Exception):
+    """Snapshot inexistente, de otra versión o desactualizado respecto al GraphML."""
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """sha256 de un archivo (None si no existe)."""
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _arc_file(weight, attr):
+    return f"arcs_{weight}_{attr}.npy"
+
+
+def _edge_file(name):
+    return f"edge_{name}.npy"
+
+
+def save_snapshot(graph, out_dir=SNAPSHOT_DIR, source_checksum=None):
+    """Escribe el snapshot en un directorio temporal y lo reemplaza de forma atómica."""
+    tmp_dir = temp_dir_for(out_dir)
+    for name in NODE_ARRAYS:
+        np.save(os.path.join(tmp_dir, name + ".npy"), getattr(graph, name))
+    for weight, values in graph.arcs.items():
+        for attr, arr in zip(ARC_ATTRS, values):
+            np.save(os.path.join(tmp_dir, _arc_file(weight, attr)), arr)
+    for name, arr in graph.edge_attrs.items():
+        np.save(os.path.join(tmp_dir, _edge_file(name)), arr)
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "source_checksum": source_checksum,
+        "n_nodes": int(graph.n_nodes),
+        "n_arcs": int(graph.n_arcs),
+        "weights": sorted(graph.arcs),
+        "edge_attrs": sorted(graph.edge_attrs),
+        "created": datetime.datetime.now().isoformat(),
+    }
+    with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    publish_dir(tmp_dir, out_dir)
+    return meta
+
+
+def read_meta(snapshot_dir=SNAPSHOT_DIR):
+    """Cabecera del snapshot (SnapshotError si no existe)."""
+    path = os.path.join(snapshot_dir, META_FILE)
+    if not os.path.exists(path):
+        raise SnapshotError(f"No existe snapshot en {snapshot_dir}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR, expected_checksum=None, mmap=True):
+    """
+    Carga un CSRGraph desde el snapshot (arreglos memory-mapped por defecto).
+    Si se pasa expected_checksum, exige que coincida con el del GraphML de origen.
+    """
+    meta = read_meta(snapshot_dir)
+    if meta.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Versión de snapshot {meta.get('version')} != {SNAPSHOT_VERSION}")
+    if expected_checksum is not None and meta.get("source_checksum") != expected_checksum:
+        raise SnapshotError("El GraphML de origen cambió desde que se generó el snapshot")
+    mode = "r" if mmap else None
+
+    def load(name):
+        return np.load(os.path.join(snapshot_dir, name), mmap_mode=mode)
+
+    arrays = {name: load(name + ".npy") for name in NODE_ARRAYS}
+    arcs = {w: tuple(load(_arc_file(w, attr)) for attr in ARC_ATTRS) for w in meta["weights"]}
+    edge_attrs = {name: load(_edge_file(name)) for name in meta.get("edge_attrs", [])}
+    return CSRGraph(arcs=arcs, edge_attrs=edge_attrs, meta=meta, **arrays)
+
+
+def build_snapshot(graphml_path=GRAPHML_PATH, out_dir=SNAPSHOT_DIR, G=None):
+    """Lee el GraphML (o usa G ya preparado), prepara aristas, construye el CSR y guarda el snapshot."""
+    if G is None:
+        import osmnx as ox
+        from ml.ruta_modelo import ensure_edge_speeds
+        G = ox.load_graphml(graphml_path)
+        ensure_edge_speeds(G, fallback_kph=30.0)
+    graph = build_csr_graph(G)
+    graph.meta = save_snapshot(graph, out_dir, source_checksum=file_checksum(graphml_path))
+    return graph
+
+
+def load_routing_graph(graph_loader, graphml_path=GRAPHML_PATH, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Carga el grafo de ruteo desde el snapshot; si no es válido, obtiene el grafo con
+    graph_loader() (GraphML/OSM ya preparado) y regenera el snapshot.
+    """
+    try:
+        graph = load_snapshot(snapshot_dir, expected_checksum=file_checksum(graphml_path))
+        print(f"Grafo de ruteo cargado desde snapshot: {snapshot_dir}")
+        return graph
+    except SnapshotError as e:
+        print(f"Snapshot no válido ({e}); reconstruyendo desde GraphML...")
+    G = graph_loader()
+    try:
+        return build_snapshot(graphml_path, snapshot_dir, G=G)
+    except OSError as e:
+        print(f"No se pudo guardar el snapshot: {e}")
+        graph = build_csr_graph(G)
+        # Versión por contenido (no la identidad del objeto): igual en todos los workers
+        graph.meta = {"version": SNAPSHOT_VERSION, "source_checksum": file_checksum(graphml_path), "created": None}
+        return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera el snapshot binario del grafo de ruteo.")
+    parser.add_argument("--graphml", default=GRAPHML_PATH)
+    parser.add_argument("--out", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+    graph = build_snapshot(args.graphml, args.out)
+    print(f"Snapshot v{SNAPSHOT_VERSION} guardado en {args.out}: "
+          f"{graph.n_nodes} nodos, {graph.n_arcs} arcos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+tsp.py
+
+- Optimización de tours (TSP asimétrico) sobre una matriz de costos.
+- Construcción nearest neighbor (el tour "greedy" de referencia).
+- Mejora local 2-opt y Or-opt con evaluación de deltas en NumPy.
+- Held-Karp exacto (programación dinámica) para pocas paradas.
+- Presupuesto de tiempo (time_budget_ms): se retorna el mejor tour encontrado.
+"""
+
+import time
+import numpy as np
+
+HELD_KARP_MAX_STOPS = 12
+DEFAULT_TIME_BUDGET_MS = 500
+OR_OPT_MAX_SEGMENT = 3
+# Costo finito para pares sin ruta (evita inf - inf en los deltas)
+UNREACHABLE_COST = 1e12
+
+
+def tour_cost(D, tour):
+    """Costo de un tour cerrado [depot, ..., depot]."""
+    return float(sum(D[tour[k]][tour[k + 1]] for k in range(len(tour) - 1)))
+
+
+def _deadline_passed(deadline):
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+# --------------------------
+# CONSTRUCCIÓN
+# --------------------------
+
+def nearest_neighbor(C, depot=0):
+    """Tour greedy: siempre al vecino no visitado más cercano."""
+    n = len(C)
+    unvisited = set(range(n))
+    unvisited.remove(depot)
+    tour = [depot]
+    current = depot
+    while unvisited:
+        next_node = min(unvisited, key=lambda x: C[current][x])
+        tour.append(next_node)
+        unvisited.remove(next_node)
+        current = next_node
+    tour.append(depot)
+    return tour
+
+
+# --------------------------
+# MEJORA LOCAL
+# --------------------------
+
+def _two_opt_pass(C, tour):
+    """
+    Mejor movimiento 2-opt (invertir tour[i+1..j]) para costos asimétricos.
+    Retorna el nuevo tour o None si ninguno mejora.
+    """
+    t = np.asarray(tour)
+    n = len(t) - 1
+    if n < 4:
+        return None
+    f = C[t[:-1], t[1:]]                           # arco k: t[k] -> t[k+1]
+    b = C[t[1:], t[:-1]]                           # mismo arco recorrido al revés
+    F = np.concatenate(([0.0], np.cumsum(f)))
+    B = np.concatenate(([0.0], np.cumsum(b)))
+    i = np.arange(n)[:, None]
+    j = np.arange(n)[None, :]
+    valid = (j >= i + 2) & (j <= n - 1)
+    ii = np.broadcast_to(i, (n, n))[valid]
+    jj = np.broadcast_to(j, (n, n))[valid]
+    delta = (C[t[ii], t[jj]] + C[t[ii + 1], t[jj + 1]] + (B[jj] - B[ii + 1])
+             - (f[ii] + f[jj] + (F[jj] - F[ii + 1])))
+    k = int(np.argmin(delta))
+    if delta[k] >= -1e-9:
+        return None
+    i0, j0 = int(ii[k]), int(jj[k])
+    return tour[:i0 + 1] + tour[i0 + 1:j0 + 1][::-1] + tour[j0 + 1:]
+
+
+def _or_opt_pass(C, tour):
+    """
+    Mejor movimiento Or-opt: mover un segmento de 1..OR_OPT_MAX_SEGMENT paradas
+    a otra posición del tour (sin invertirlo). Retorna el nuevo tour o None.
+    """
+    n = len(tour) - 1
+    best_delta, best_tour = -1e-9, None
+    for L in range(1, min(OR_OPT_MAX_SEGMENT, n - 2) + 1):
+        for p in range(1, n - L + 1):
+            seg = tour[p:p + L]
+            rest = tour[:p] + tour[p + L:]
+            r = np.asarray(rest)
+            prev, nxt = tour[p - 1], tour[p + L]
+            removed = C[prev, seg[0]] + C[seg[-1], nxt] - C[prev, nxt]
+            inserted = C[r[:-1], seg[0]] + C[seg[-1], r[1:]] - C[r[:-1], r[1:]]
+            inserted[p - 1] = np.inf                # posición original
+            q = int(np.argmin(inserted))
+            delta = inserted[q] - removed
+            if delta < best_delta:
+                best_delta = delta
+                best_tour = rest[:q + 1] + seg + rest[q + 1:]
+    return best_tour
+
+
+def local_search(C, tour, deadline=None):
+    """Aplica 2-opt y Or-opt hasta un óptimo local o hasta agotar el tiempo."""
+    while not _deadline_passed(deadline):
+        new_tour = _two_opt_pass(C, tour)
+        if new_tour is None:
+            new_tour = _or_opt_pass(C, tour)
+        if new_tour is None:
+            break
+        tour = new_tour
+    return tour
+
+
+# --------------------------
+# EXACTO
+# --------------------------
+
+def held_karp(C, depot=0, deadline=None):
+    """
+    Tour óptimo por programación dinámica sobre subconjuntos (O(2^n n^2)).
+    Retorna None si se agota el tiempo. ValueError con más de
+    HELD_KARP_MAX_STOPS paradas (la tabla crece como 2^n).
+    """
+    n = len(C)
+    if n > HELD_KARP_MAX_STOPS:
+        raise ValueError(f"held_karp admite hasta {HELD_KARP_MAX_STOPS} paradas (recibió {n})")
+    others = [k for k in range(n) if k != depot]
+    m = len(others)
+    if m == 0:
+        return [depot, depot]
+    sub = C[np.ix_(others, others)]
+    full = 1 << m
+    dp = np.full((full, m), np.inf)
+    parent = np.full((full, m), -1, dtype=np.int64)
+    for j in range(m):
+        dp[1 << j, j] = C[depot, others[j]]
+    bits = 1 << np.arange(m)
+    for mask in range(1, full):
+        if mask & (mask - 1) == 0:
+            continue
+        if mask % 256 == 0 and _deadline_passed(deadline):
+            return None
+        in_mask = (mask & bits) != 0
+        js = np.nonzero(in_mask)[0]
+        # dp[mask, j] = min_k dp[mask sin j, k] + C[k, j]
+        cand = dp[mask ^ bits[js]] + sub[:, js].T
+        cand[:, ~in_mask] = np.inf
+        cand[np.arange(len(js)), js] = np.inf
+        k = np.argmin(cand, axis=1)
+        dp[mask, js] = cand[np.arange(len(js)), k]
+        parent[mask, js] = k
+    last = dp[full - 1] + C[others, depot]
+    j = int(np.argmin(last))
+    order = []
+    mask = full - 1
+    while j != -1:
+        order.append(others[j])
+        prev = int(parent[mask, j])
+        mask ^= 1 << j
+        j = prev
+    return [depot] + order[::-1] + [depot]
+
+
+# --------------------------
+# SOLVERS
+# --------------------------
+
+def _solve_nearest_neighbor(C, depot, deadline):
+    return nearest_neighbor(C, depot)
+
+
+def _solve_local_search(C, depot, deadline):
+    return local_search(C, nearest_neighbor(C, depot), deadline)
+
+
+def _solve_held_karp(C, depot, deadline):
+    return held_karp(C, depot, deadline)
+
+
+SOLVERS = {
+    "nearest_neighbor": _solve_nearest_neighbor,
+    "local_search": _solve_local_search,
+    "held_karp": _solve_held_karp,
+}
+
+
+def solve_tsp(distance_matrix, depot=0, time_budget_ms=DEFAULT_TIME_BUDGET_MS, solver="auto"):
+    """
+    Resuelve el tour desde `depot` sobre la matriz (puede ser asimétrica).
+    solver: 'auto' (local_search y, si hay <= HELD_KARP_MAX_STOPS paradas, held_karp),
+    o uno de SOLVERS ('held_karp' explícito con más de HELD_KARP_MAX_STOPS
+    paradas: ValueError). Retorna dict con tour, cost, solver, greedy_cost,
+    improvement_pct y timed_out.
+    """
+    start = time.perf_counter()
+    deadline = start + time_budget_ms / 1000.0 if time_budget_ms else None
+    D = np.asarray(distance_matrix, dtype=np.float64)
+    C = np.where(np.isfinite(D), D, UNREACHABLE_COST)
+    n = len(C)
+
+    greedy = nearest_neighbor(C, depot)
+    best_tour, best_cost, best_solver = greedy, tour_cost(C, greedy), "nearest_neighbor"
+    if solver == "auto":
+        names = ["local_search"] + (["held_karp"] if n <= HELD_KARP_MAX_STOPS else [])
+    elif solver == "held_karp" and n > HELD_KARP_MAX_STOPS:
+        raise ValueError(f"held_karp admite hasta {HELD_KARP_MAX_STOPS} paradas (recibió {n})")
+    elif solver in SOLVERS:
+        names = [solver]
+    else:
+        raise ValueError(f"Solver no soportado: {solver}")
+
+    for name in names:
+        if _deadline_passed(deadline):
+            break
+        tour = SOLVERS[name](C, depot, deadline)
+        if tour is None:
+            continue
+        cost = tour_cost(C, tour)
+        if cost < best_cost - 1e-9 or name == solver:
+            best_tour, best_cost, best_solver = tour, cost, name
+
+    greedy_cost = tour_cost(D, greedy)
+    cost = tour_cost(D, best_tour)
+    improvement = (greedy_cost - cost) / greedy_cost * 100.0 if np.isfinite(greedy_cost) and greedy_cost > 0 else 0.0
+    return {
+        "tour": [int(k) for k in best_tour],
+        "cost": cost,
+        "solver": best_solver,
+        "greedy_cost": greedy_cost,
+        "improvement_pct": float(improvement),
+        "timed_out": _deadline_passed(deadline),
+        "time_ms": (time.perf_counter() - start) * 1000.0,
+    }
@@ -0,0 +1,96 @@
+"""
+velocidades.py
+
+- Preparación de atributos de aristas como columnas (sin bucles por arista).
+- Parseo vectorizado de maxspeed (str, número o lista de OSM) con caché por valor.
+- Velocidad por defecto según tipo de vía (highway) en lugar de un único fallback.
+- length / travel_time vectorizados.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Velocidad (km/h) cuando la arista no trae maxspeed, según su tipo de vía
+HIGHWAY_SPEEDS_KPH = {
+    "motorway": 80.0,
+    "motorway_link": 50.0,
+    "trunk": 60.0,
+    "trunk_link": 40.0,
+    "primary": 50.0,
+    "primary_link": 40.0,
+    "secondary": 40.0,
+    "secondary_link": 30.0,
+    "tertiary": 35.0,
+    "tertiary_link": 30.0,
+    "unclassified": 30.0,
+    "residential": 25.0,
+    "living_street": 15.0,
+    "service": 15.0,
+}
+# Código compacto (uint8) por tipo de vía; el último es "otro"
+HIGHWAY_CLASSES = list(HIGHWAY_SPEEDS_KPH) + ["other"]
+OTHER_HIGHWAY_CLASS = len(HIGHWAY_CLASSES) - 1
+DEFAULT_EDGE_LENGTH_M = 20.0
+
+# maxspeed crudo (normalizado) -> km/h (nan si no se puede interpretar)
+_MAXSPEED_CACHE = {}
+
+
+def _first(value):
+    """OSM guarda algunos atributos como lista: se usa el primer valor."""
+    if isinstance(value, (list, tuple)):
+        return value[0] if len(value) > 0 else None
+    return value
+
+
+def _maxspeed_key(value):
+    value = _first(value)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return str(value)
+
+
+def parse_maxspeed(values):
+    """Columna de maxspeed crudos -> arreglo float64 de km/h (nan si falta o no es numérico)."""
+    keys = [_maxspeed_key(v) for v in values]
+    new = [k for k in set(keys) if k is not None and k not in _MAXSPEED_CACHE]
+    if new:
+        parsed = pd.Series(new, dtype=object).str.extract(r"(\d+\.?\d*)", expand=False).astype(float)
+        _MAXSPEED_CACHE.update(zip(new, parsed.tolist()))
+    cache = _MAXSPEED_CACHE
+    return np.fromiter((np.nan if k is None else cache[k] for k in keys), dtype=np.float64, count=len(keys))
+
+
+def highway_classes(values):
+    """Columna de highway crudos -> códigos uint8 según HIGHWAY_CLASSES."""
+    codes = {name: i for i, name in enumerate(HIGHWAY_CLASSES)}
+    return np.fromiter((codes.get(_first(v), OTHER_HIGHWAY_CLASS) for v in values),
+                       dtype=np.uint8, count=len(values))
+
+
+def edge_speed_columns(length, speed_kph, maxspeed, highway, geometry_length=None,
+                       fallback_kph=30.0, highway_speeds=None):
+    """
+    Calcula (length, speed_kph, travel_time) para todas las aristas a la vez.
+    - length: nan -> largo de la geometría o DEFAULT_EDGE_LENGTH_M.
+    - speed_kph: se respeta si ya existe; si no, maxspeed parseado; si no, la
+      velocidad del tipo de vía; si no, fallback_kph.
+    """
+    highway_speeds = HIGHWAY_SPEEDS_KPH if highway_speeds is None else highway_speeds
+    length = np.asarray(length, dtype=np.float64)
+    if geometry_length is None:
+        geometry_length = np.full(len(length), np.nan)
+    geometry_length = np.asarray(geometry_length, dtype=np.float64)
+    length = np.where(np.isnan(length), geometry_length, length)
+    length = np.where(np.isnan(length), DEFAULT_EDGE_LENGTH_M, length)
+
+    speed = np.asarray(speed_kph, dtype=np.float64)
+    speed = np.where(np.isnan(speed), parse_maxspeed(maxspeed), speed)
+    by_type = np.fromiter((highway_speeds.get(_first(v), np.nan) for v in highway),
+                          dtype=np.float64, count=len(highway))
+    speed = np.where(np.isnan(speed), by_type, speed)
+    speed = np.where(np.isnan(speed), fallback_kph, speed)
+
+    speed_mps = speed * 1000.0 / 3600.0
+    travel_time = length / np.maximum(speed_mps, 1e-3)
+    return length, speed, travel_time
@@ -127,6 +127,17 @@ class Pedido(db.Model):
     estado = db.Column(db.String(50), default='pendiente')
     prioridad = db.Column(db.String(20), default='normal')
     total = db.Column(db.Numeric(10,2), nullable=False)
+    detalles = db.relationship('PedidoDetalle', backref='pedido', lazy='select',
+                               order_by='PedidoDetalle.id', passive_deletes=True)
+    # Listado paginado por (fecha_pedido, id) descendente, con o sin filtros
+    # (solo PostgreSQL: SQLite no admite NULLS LAST en índices)
+    __table_args__ = (
+        db.Index('ix_pedidos_fecha_id', fecha_pedido.desc().nullslast(), id.desc()).ddl_if(dialect='postgresql'),
+        db.Index('ix_pedidos_estado_fecha', estado, fecha_pedido.desc().nullslast(),
+                 id.desc()).ddl_if(dialect='postgresql'),
+        db.Index('ix_pedidos_cliente_fecha', cliente_id, fecha_pedido.desc().nullslast(),
+                 id.desc()).ddl_if(dialect='postgresql'),
+    )
 
 
 # =========================
@@ -139,7 +150,7 @@ class PedidoDetalle(db.Model):
     """
     __tablename__ = 'pedido_detalles'
     id = db.Column(db.Integer, primary_key=True)
-    pedido_id = db.Column(db.Integer, db.ForeignKey('pedidos.id', ondelete='CASCADE'))
+    pedido_id = db.Column(db.Integer, db.ForeignKey('pedidos.id', ondelete='CASCADE'), index=True)
     producto_id = db.Column(db.Integer, db.ForeignKey('productos.id'))
     cantidad = db.Column(db.Integer, nullable=False)
     subtotal = db.Column(db.Numeric(10,2), nullable=False)
@@ -183,14 +194,19 @@ class RutaDetalle(db.Model):
 
 class InventarioMovimiento(db.Model):
     """
-    Registro de entradas y salidas de inventario.
+    Registro de entradas y salidas de inventario (libro mayor).
+    - Cada movimiento actualiza en la misma transacción el saldo de
+      InventarioSaldo para su (producto, sucursal, estado); ver inventario.py.
     """
     __tablename__ = 'inventario_movimientos'
     id = db.Column(db.Integer, primary_key=True)
     producto_id = db.Column(db.Integer, db.ForeignKey('productos.id'))
-    cantidad = db.Column(db.Integer, nullable=False)
+    sucursal_id = db.Column(db.Integer, db.ForeignKey('sucursales.id'))  # NULL en movimientos antiguos
+    estado = db.Column(db.String(50), default='disponible')
+    cantidad = db.Column(db.Numeric(12,3), nullable=False)  # metros / unidades, siempre positiva
     tipo = db.Column(db.String(20), nullable=False)  # entrada / salida
     fecha = db.Column(db.DateTime, server_default=db.func.now())
+    __table_args__ = (db.Index('ix_movimientos_prod_suc_estado', 'producto_id', 'sucursal_id', 'estado'),)
 
 
 # =========================
@@ -351,6 +367,24 @@ class InventarioSucursal(db.Model):
     __table_args__ = (db.Index('ix_inventario_prod_suc_estado', 'producto_id', 'sucursal_id', 'estado'),)
 
 
+class InventarioSaldo(db.Model):
+    """
+    Saldo corriente por (producto, sucursal, estado), materializado desde
+    InventarioMovimiento:
+    - Se actualiza en la transacción de cada movimiento (upsert por clave).
+    - Se puede reconstruir en bloque desde el libro mayor.
+    Consultar el stock de un producto en una sucursal es leer una fila por
+    clave primaria.
+    """
+    __tablename__ = 'inventario_saldos'
+    producto_id = db.Column(db.Integer, db.ForeignKey('productos.id'), primary_key=True)
+    sucursal_id = db.Column(db.Integer, db.ForeignKey('sucursales.id'), primary_key=True)
+    estado = db.Column(db.String(50), primary_key=True)
+    cantidad = db.Column(db.Numeric(12,3), nullable=False, default=0)
+    actualizado = db.Column(db.DateTime, server_default=db.func.now())
+    ultimo_movimiento_id = db.Column(db.Integer)
+
+
 # =========================
 # PROVEEDORES Y DISTRIBUIDORES
 # =========================
@@ -552,15 +586,25 @@ class ReporteGuardado(db.Model):
 class ModeloML(db.Model):
     """
     Registro de modelos de Machine Learning (ej. Random Forest).
+    Una fila por versión; solo una versión activa por nombre (ver ml/registro.py).
     """
     __tablename__ = 'modelo_ml'
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)
     tipo = db.Column(db.String(50))  # RandomForest, SVM, etc.
     ruta_archivo = db.Column(db.String(255))  # Ruta al archivo .pkl o URI (s3://...)
+    ruta_compilado = db.Column(db.String(255))  # Bosque compilado (.npz) que usa la API
+    hash_artefacto = db.Column(db.String(64))  # sha256 del artefacto servido
+    metricas = db.Column(db.JSON)  # p. ej. MAE / RMSE / R2 out-of-bag
+    esquema = db.Column(db.JSON)  # features de entrada (en orden) y target
     fecha_entrenamiento = db.Column(db.DateTime, server_default=db.func.now())
-    activo = db.Column(db.Boolean, default=True)
-    # opcionales: metricas, hiperparams, creado_por (puedes ampliarlo según necesites)
+    activo = db.Column(db.Boolean, default=False)
+    __table_args__ = (
+        db.UniqueConstraint('nombre', 'version', name='uq_modelo_ml_nombre_version'),
+        db.Index('uq_modelo_ml_activo', 'nombre', unique=True,
+                 postgresql_where=db.text('activo'), sqlite_where=db.text('activo')),
+    )
 
 
 class PrediccionML(db.Model):
@@ -0,0 +1,171 @@
+"""
+pool_db.py
+
+- Opciones del engine de SQLAlchemy para PostgreSQL bajo gunicorn (varios
+  workers x hilos): tamaño del pool y overflow por worker, pre-ping, recycle,
+  timeout de espera y statement_timeout por defecto.
+- Modo PgBouncer (pooling por transacción): el pool lo hace PgBouncer, así que
+  aquí se usa NullPool, y como no admite parámetros de arranque (-c ...) ni
+  SET de sesión, statement_timeout se aplica con SET LOCAL en cada transacción.
+- statement_timeout por endpoint: el decorador statement_timeout(ms) lo fija en
+  flask.g y cada transacción del request lo aplica con SET LOCAL (vuelve al
+  valor por defecto al terminar la transacción).
+- Métricas del pool por worker: conexiones en uso, overflow, espera por
+  checkout (promedio, p95, máximo) y timeouts, en /api/metrics/db-pool.
+"""
+
+import collections
+import functools
+import threading
+import time
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool, QueuePool
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+DEFAULT_STATEMENT_TIMEOUT_MS = 30000
+WAIT_SAMPLES = 1000
+
+
+class PoolMetrics:
+    """Contadores de checkout del pool y muestras recientes de espera."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waits = collections.deque(maxlen=WAIT_SAMPLES)
+        self.checkouts = 0
+        self.in_use = 0
+        self.timeouts = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    def observe(self, wait_s, ok):
+        with self._lock:
+            self._waits.append(wait_s)
+            self.wait_total_s += wait_s
+            self.wait_max_s = max(self.wait_max_s, wait_s)
+            if ok:
+                self.checkouts += 1
+                self.in_use += 1
+            else:
+                self.timeouts += 1
+
+    def returned(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            attempts = self.checkouts + self.timeouts
+            return {
+                'checkouts': self.checkouts,
+                'in_use': self.in_use,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(1000 * self.wait_total_s / attempts, 3) if attempts else None,
+                'wait_p95_ms': round(1000 * waits[int(0.95 * (len(waits) - 1))], 3) if waits else None,
+                'wait_max_ms': round(1000 * self.wait_max_s, 3),
+            }
+
+
+class _MeteredPool:
+    """Mide cuánto espera cada checkout (cola del pool más abrir la conexión si hace falta)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.observe(time.perf_counter() - start, ok=False)
+            raise
+        self.metrics.observe(time.perf_counter() - start, ok=True)
+        return conn
+
+    def _do_return_conn(self, record):
+        self.metrics.returned()
+        super()._do_return_conn(record)
+
+
+class MeteredQueuePool(_MeteredPool, QueuePool):
+    pass
+
+
+class MeteredNullPool(_MeteredPool, NullPool):
+    pass
+
+
+def engine_options(url, pool_size=DEFAULT_POOL_SIZE, max_overflow=DEFAULT_MAX_OVERFLOW,
+                   pool_timeout=DEFAULT_POOL_TIMEOUT, pool_recycle=DEFAULT_POOL_RECYCLE,
+                   pre_ping=True, statement_timeout_ms=DEFAULT_STATEMENT_TIMEOUT_MS, pgbouncer=False):
+    """SQLALCHEMY_ENGINE_OPTIONS para `url` (SQLite se deja con las opciones por defecto)."""
+    if not url or url.startswith('sqlite'):
+        return {}
+    if pgbouncer:
+        return {'poolclass': MeteredNullPool, 'pool_pre_ping': pre_ping}
+    options = {
+        'poolclass': MeteredQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': pre_ping,
+    }
+    if url.startswith('postgres') and statement_timeout_ms:
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout_ms)}'}
+    return options
+
+
+def install_statement_timeouts(default_ms=None):
+    """
+    Aplica con SET LOCAL, al empezar cada transacción en PostgreSQL, el
+    statement_timeout del endpoint (flask.g) o `default_ms` (modo PgBouncer).
+    """
+    @event.listens_for(Session, 'after_begin')
+    def _set_local_timeout(session, transaction, connection):
+        if connection.dialect.name != 'postgresql':
+            return
+        ms = g.get('statement_timeout_ms') if has_app_context() else None
+        if ms is None:
+            ms = default_ms
+        if ms is not None:
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(ms)}")
+
+
+def statement_timeout(ms):
+    """Decorador de endpoint: statement_timeout (ms) para las consultas del request; 0 = sin límite."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.statement_timeout_ms = ms
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def pool_stats(engine):
+    """Estado del pool de este worker."""
+    pool = engine.pool
+    stats = {'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+            'timeout_s': pool.timeout(),
+        })
+    metrics = getattr(pool, 'metrics', None)
+    if metrics is not None:
+        stats.update(metrics.snapshot())
+    return stats
@@ -0,0 +1,76 @@
+"""
+streaming.py
+
+- Respuestas de listados que se escriben por partes en vez de armar toda la
+  lista en memoria y pasarla a jsonify.
+- Las filas se leen de la base por bloques con yield_per (cursor del lado del
+  servidor en PostgreSQL) y se serializan de a chunk_size filas.
+- Dos formatos: arreglo JSON ({"success": true, "<clave>": [...]}, el mismo
+  cuerpo que antes) o NDJSON (un objeto por línea). Se elige con ?format=json|ndjson
+  o con el header Accept: application/x-ndjson.
+"""
+
+import json
+
+from flask import Response, stream_with_context
+
+DEFAULT_CHUNK_ROWS = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+FORMATS = ('json', 'ndjson')
+
+
+def stream_format(req, default='json'):
+    """'json' o 'ndjson' según ?format o el header Accept. ValueError si ?format no es válido."""
+    fmt = req.args.get('format')
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"format debe ser uno de {list(FORMATS)}")
+        return fmt
+    accept = req.accept_mimetypes
+    if accept[NDJSON_MIMETYPE] > accept['application/json']:
+        return 'ndjson'
+    return default
+
+
+def _rows(query, to_dict, chunk_size):
+    """Bloques de texto con chunk_size filas serializadas cada uno."""
+    chunk = []
+    for obj in query.yield_per(chunk_size):
+        chunk.append(json.dumps(to_dict(obj)))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_query(query, to_dict, key, fmt='json', chunk_size=DEFAULT_CHUNK_ROWS):
+    """
+    Response que recorre `query` por bloques y escribe cada fila con `to_dict`.
+    Si la base falla a mitad de camino ya se envió el status 200: en NDJSON se
+    agrega una última línea {"success": false, ...}; en JSON el arreglo queda
+    sin cerrar, así el cliente no lo toma por completo.
+    """
+    def ndjson():
+        try:
+            for chunk in _rows(query, to_dict, chunk_size):
+                yield '\n'.join(chunk) + '\n'
+        except Exception as e:
+            print(f"Error en listado '{key}' (stream): {e}")
+            yield json.dumps({'success': False, 'message': str(e)}) + '\n'
+
+    def json_array():
+        yield '{"success": true, "%s": [' % key
+        first = True
+        try:
+            for chunk in _rows(query, to_dict, chunk_size):
+                yield ('' if first else ', ') + ', '.join(chunk)
+                first = False
+        except Exception as e:
+            print(f"Error en listado '{key}' (stream): {e}")
+            return
+        yield ']}'
+
+    if fmt == 'ndjson':
+        return Response(stream_with_context(ndjson()), mimetype=NDJSON_MIMETYPE)
+    return Response(stream_with_context(json_array()), mimetype='application/json')
@@ -25,8 +25,17 @@ const Pedidos = () => {
   const fetchPedidos = async () => {
     setLoading(true);
     try {
-      const r = await axios.get(`${API_BASE}/api/pedidos`);
-      setList(r.data.pedidos || []);
+      // La API pagina por cursor: se piden páginas hasta que no haya más
+      const pedidos = [];
+      let cursor = null;
+      do {
+        const r = await axios.get(`${API_BASE}/api/pedidos`, {
+          params: cursor ? { cursor } : {},
+        });
+        pedidos.push(...(r.data.pedidos || []));
+        cursor = r.data.has_more ? r.data.next_cursor : null;
+      } while (cursor);
+      setList(pedidos);
     } catch (e) {
       console.error(e);
     } finally {